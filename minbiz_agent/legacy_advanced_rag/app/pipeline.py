@@ -28,7 +28,7 @@ from src.app.schemas import (
 from src.app.validators import check_support_ids_exist
 
 # —— LLM 调用封装 ——
-from src.app.llm_client import chat_json, chat_text
+from src.app.llm_client import chat_json, chat_text, run_many
 
 import re as _re_lang
 
@@ -164,7 +164,8 @@ def make_draft(
     question: str,
     evidence_context: str,
     model: str = "gpt-4o-mini",
-    allowed_ids: Set[str] | None = None
+    allowed_ids: Set[str] | None = None,
+    temperature: float = 0.2
 ) -> Draft:
     # 兜底（防止全局常量未加载的极端情况）
     SYS = globals().get("DRAFT_SYS") or (
@@ -193,7 +194,8 @@ def make_draft(
         messages=[{"role": "system", "content": SYS},
                   {"role": "user",   "content": user}],
         model=model,
-        temperature=0.2,
+        temperature=temperature,
+        cache=False,    # 校验失败后会用同样的问题重生成，缓存只会拿回同一份不合格草稿
     )
     norm = _normalize_draft_obj(raw, allowed_ids=allowed_ids)
     return Draft.model_validate(norm)
@@ -217,23 +219,33 @@ def _regenerate_draft_with_constraints(
     model: str = "gpt-4o-mini"
 ) -> Draft:
     """
-    首次校验失败后，带合法 chunk_id 白名单重试 1-2 次。
+    首次校验失败后，带合法 chunk_id 白名单一次并发生成 tries 份草稿，按顺序取第一份通过校验的。
+    各份温度递增、不走响应缓存，彼此是不同的尝试；并发省掉逐次重试的往返等待。
+    都没通过时返回第一份成功生成的草稿，交给兜底清洗；全部调用失败则抛出最后一个错误。
     """
-    last_err = None
     id_list = ", ".join(sorted(valid_ids))
-    draft = None
-    for _ in range(tries):
-        constrained_ctx = evidence_context + "\n\n" + RETRY_HINT.format(id_list=id_list)
-        draft = make_draft_fn(question, constrained_ctx, model=model, allowed_ids=valid_ids)
+    constrained_ctx = evidence_context + "\n\n" + RETRY_HINT.format(id_list=id_list)
+    temps = [round(0.2 + 0.3 * i, 2) for i in range(max(1, tries))]
+    results = run_many([
+        (lambda t=t: make_draft_fn(question, constrained_ctx, model=model, allowed_ids=valid_ids, temperature=t))
+        for t in temps
+    ])
+    last_err = None
+    drafts = []
+    for r in results:
+        if not r["ok"]:
+            last_err = r["error"]
+            continue
         try:
-            check_support_ids_exist(draft, valid_ids)
-            return draft
+            check_support_ids_exist(r["value"], valid_ids)
+            return r["value"]
         except Exception as e:
             last_err = e
-            continue
-    if last_err:
-        print(f"[pipeline] Draft 引用校验反复失败，将执行兜底清洗: {last_err}")
-    return draft
+            drafts.append(r["value"])
+    if not drafts:
+        raise RuntimeError(f"Draft 重生成全部失败：{last_err}")
+    print(f"[pipeline] Draft 引用校验反复失败，将执行兜底清洗: {last_err}")
+    return drafts[0]
 
 def _sanitize_draft(draft: Draft, valid_ids: Set[str]) -> Draft:
     """
@@ -308,6 +320,7 @@ def refine_with_background(draft: Draft, model: str = "gpt-4o") -> Refined:
                   {"role": "user",   "content": draft.model_dump_json()}],
         model=model,
         temperature=0.4,
+        cache=True,     # 输入就是草稿 JSON：同一草稿复用同一份补充（MINBIZ_LLM_CACHE 打开时）
     )
     norm = _normalize_refined_obj(raw)
     return Refined.model_validate(norm)
@@ -448,6 +461,7 @@ def synthesize_answer(
                   {"role": "user",   "content": user}],
         model=model,
         temperature=temp,
+        cache=True,     # 问题 + Refined + 风格都进了 key，同样输入复用同一份答案
     )
 
 
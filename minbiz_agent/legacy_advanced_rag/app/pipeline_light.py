@@ -8,8 +8,8 @@ import numpy as np
 from sentence_transformers import SentenceTransformer
 import faiss
 
-from openai import OpenAI
-_oai = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# 共享 OpenAI 客户端（连接池 + 重试 / 熔断），与 pipeline.py 的 chat_json / chat_text 同一个
+from src.app.llm_client import chat_completion
 
 
 # === ADD START: Multi-query expansion ===
@@ -18,17 +18,15 @@ def _expand_queries_with_llm(q: str, n: int = 3, model: str | None = None) -> li
     用 OpenAI 生成互补问句，增加召回覆盖面。
     返回: [原问题, 改写1, 改写2, ...]
     """
-    from openai import OpenAI
     import json, os
     m = model or os.getenv("MINBIZ_OAI_QUERY_MODEL", "gpt-4.1-mini")
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
     prompt = (
         "请为下面的问题生成3个不同角度的改写问句，覆盖同义和上下位表达。"
         "只输出JSON数组（字符串数组），不要解释。\n问题：" + q
     )
     try:
-        resp = client.chat.completions.create(
-            model=m,
+        resp = chat_completion(
+            m,
             messages=[
                 {"role": "system", "content": "你是检索提示词改写器，只输出JSON数组。"},
                 {"role": "user", "content": prompt},
@@ -359,8 +357,8 @@ Instructions:
 - Cite supporting chunk_ids like [doc-0001, doc-0003] where relevant.
 - If evidence is insufficient, say so briefly before general advice.
 """
-    resp = _oai.chat.completions.create(
-        model=model,
+    resp = chat_completion(
+        model,
         messages=[{"role":"system","content":sys},{"role":"user","content":prompt}],
         temperature=0.2,
     )
@@ -460,8 +458,8 @@ def synthesize_answer(q: str, refined_json: str, model: str, style: str = "conci
         "3) 如果没有任何 LEGAL_IDS，可在开头标注“【证据不足】”，随后给一般性建议；\n"
     )
 
-    resp = _oai.chat.completions.create(
-        model=model,
+    resp = chat_completion(
+        model,
         messages=[{"role":"system","content":sys},{"role":"user","content":user}],
         temperature=0.3,
     )
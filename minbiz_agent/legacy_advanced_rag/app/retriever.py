@@ -3,7 +3,9 @@
 
 from pathlib import Path
 from typing import List
-import re
+import re, copy
+
+from src.rag.result_cache import RESULT_CACHE, normalize_query
 
 class Hit:
     def __init__(self, text, score, source_file, chunk_id, section_title=None, start=0.0, end=0.0):
@@ -19,10 +21,12 @@ class HybridSearcher:
     def __init__(self, index_dir: str, exts=(".md", ".txt"), chunk_size=500, chunk_overlap=50):
         self.index_dir = Path(index_dir)
         self.docs = []  # [(source_file, chunk_text)]
+        self.generation = None  # 加载时的 (文件数, 最新 mtime)，作为检索缓存的代号
         if not self.index_dir.exists():
             print(f"[DummySearcher] index_dir not found: {self.index_dir.resolve()}")
             return
         files = [p for p in self.index_dir.rglob("*") if p.suffix.lower() in exts]
+        self.generation = (len(files), max((f.stat().st_mtime_ns for f in files), default=0))
         for f in files:
             try:
                 txt = f.read_text(encoding="utf-8", errors="ignore")
@@ -38,6 +42,16 @@ class HybridSearcher:
         print(f"[DummySearcher] loaded chunks: {len(self.docs)} from {self.index_dir.resolve()}")
 
     def search(self, query: str, top_k: int = 8) -> List[Hit]:
+        """带进程内缓存的检索（见 src.rag.result_cache）；未命中时走 _search。"""
+        if not self.docs or not query.strip():
+            return []
+        hits = RESULT_CACHE.get_or_compute(
+            f"dummy:{self.index_dir.resolve()}", (normalize_query(query), top_k), self.generation,
+            lambda: self._search(query, top_k),
+        )
+        return [copy.copy(h) for h in hits]
+
+    def _search(self, query: str, top_k: int = 8) -> List[Hit]:
         """
         简易中文友好检索：
         - 先做粗分词（字母/数字/中文）
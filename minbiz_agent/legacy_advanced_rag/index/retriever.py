@@ -1,11 +1,12 @@
 # src/index/retriever.py
 # -*- coding: utf-8 -*-
 import os, json, pickle, sys
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from typing import List, Tuple
 import numpy as np
 
 from src.index.tokenizers import tokenize_jieba_bigram
+from src.rag.result_cache import RESULT_CACHE, normalize_query
 
 @dataclass
 class Hit:
@@ -32,6 +33,12 @@ def rrf_fuse(bm25_hits: List[Hit], vec_hits: List[Hit], k: int = 60) -> List[Tup
     fused = sorted(scores.items(), key=lambda x: x[1], reverse=True)
     return [(bucket[_id], sc) for _id, sc in fused]
 
+def _stat(path: str):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
 def _safe_import_transformers():
     try:
         from transformers import AutoTokenizer, AutoModelForSequenceClassification
@@ -78,6 +85,11 @@ def rerank(query: str, hits: List[Hit], top_k: int = 50, final_k: int = 10) -> L
 class HybridSearcher:
     def __init__(self, index_dir: str, encoder_name: str = "intfloat/multilingual-e5-base"):
         self.index_dir = index_dir
+        # 索引代号：各索引文件的 (size, mtime)；重建后新实例的结果不会命中旧缓存
+        self.generation = tuple(
+            (st.st_size, st.st_mtime_ns) if st else None
+            for st in (_stat(os.path.join(index_dir, n)) for n in ("bm25.pkl", "meta.json", "faiss.index"))
+        )
         # BM25 包（我们保存的是 tokens/texts，需要重建 BM25Okapi）
         with open(os.path.join(index_dir, "bm25.pkl"), "rb") as f:
             pack = pickle.load(f)
@@ -148,6 +160,15 @@ class HybridSearcher:
 
     def search(self, query: str, bm25_k: int = 50, faiss_k: int = 50,
                rrf_k: int = 60, use_rerank: bool = True, final_k: int = 10) -> List[Hit]:
+        key = (normalize_query(query), bm25_k, faiss_k, rrf_k, use_rerank, final_k)
+        hits = RESULT_CACHE.get_or_compute(
+            f"hybrid:{os.path.abspath(self.index_dir)}", key, self.generation,
+            lambda: self._search(query, bm25_k, faiss_k, rrf_k, use_rerank, final_k),
+        )
+        return [replace(h) for h in hits]
+
+    def _search(self, query: str, bm25_k: int, faiss_k: int,
+                rrf_k: int, use_rerank: bool, final_k: int) -> List[Hit]:
         bm25_hits = self._bm25_search(query, topk=bm25_k)
         vec_hits  = self._faiss_search(query, topk=faiss_k) if self.vec_ok else []
         fused_hits = [h for (h, _) in rrf_fuse(bm25_hits, vec_hits, k=rrf_k)] if vec_hits else bm25_hits
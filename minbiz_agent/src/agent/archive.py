@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+对话轮次冷归档：热库（WAL + mmap）只留近期轮次，过期轮次移到只追加的压缩段文件
+- 每次归档写一个新段文件（写完 fsync + rename，之后不再修改）；段内每个会话一块，
+  块 = zlib 压缩的 JSON 行 [id, role, content, ts]，可单独解压
+- 每块在会话所在分片的 archive_index 表里记一行 (session, segment, offset, length, from_id, to_id, n, ts_max)，
+  读某个会话只需 seek 到对应偏移解压那几块，不扫整个段
+- 顺序：先写段文件，再在一个事务里写索引 + 删热库行；中途崩溃最多留下一个没被索引引用的段文件，不丢数据
+- archived_turns() 按需读回归档历史；热路径（last_k_turns / history_for_prompt）不读归档
+环境变量：
+  MINBIZ_ARCHIVE_DIR        段文件目录（默认 库文件同目录下 archive/）
+  MINBIZ_ARCHIVE_AGE_DAYS   超过多少天的轮次归档（默认 30）
+  MINBIZ_ARCHIVE_EVERY_S    后台归档周期秒数（默认 0 = 不启动，只用 tools/archive_turns.py 手动 / 定时跑）
+  MINBIZ_ARCHIVE_BATCH      单个段文件最多多少行（默认 50000；超过的留给下一轮）
+"""
+import json, os, threading, time, uuid, zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from . import memory
+
+ARCHIVE_AGE_DAYS = float(os.getenv("MINBIZ_ARCHIVE_AGE_DAYS", "30"))
+ARCHIVE_EVERY_S  = float(os.getenv("MINBIZ_ARCHIVE_EVERY_S", "0"))
+ARCHIVE_BATCH    = int(os.getenv("MINBIZ_ARCHIVE_BATCH", "50000"))
+
+SEG_MAGIC = b"MBZSEG1\n"
+
+_archiver: Optional[threading.Thread] = None
+_archiver_lock = threading.Lock()
+_run_lock = threading.Lock()
+
+
+def archive_dir() -> Path:
+    return Path(os.getenv("MINBIZ_ARCHIVE_DIR") or Path(memory.DB_PATH).parent / "archive")
+
+
+def _write_segment(stem: str, blocks: List[Tuple[str, bytes]]) -> Tuple[str, List[Tuple[int, int]]]:
+    """写一个段文件，返回 (文件名, [(offset, length)...])；先写临时文件再 rename，读端不会看到半个段。"""
+    d = archive_dir()
+    d.mkdir(parents=True, exist_ok=True)
+    name = f"{stem}-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.seg"
+    tmp = d / (name + ".tmp")
+    spans = []
+    with open(tmp, "wb") as f:
+        f.write(SEG_MAGIC)
+        for _, data in blocks:
+            spans.append((f.tell(), len(data)))
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, d / name)
+    return name, spans
+
+
+def _archive_shard(path: str, cutoff: float, limit: int) -> int:
+    con = memory._conn(path)
+    rows = con.execute(
+        "SELECT id, session, role, content, ts FROM turns WHERE ts < ? ORDER BY session, id LIMIT ?",
+        (cutoff, limit)
+    ).fetchall()
+    if not rows:
+        return 0
+    by_session: Dict[str, list] = {}
+    for r in rows:
+        by_session.setdefault(r[1], []).append(r)
+    sessions = list(by_session)
+    blocks = []
+    for s in sessions:
+        lines = "\n".join(json.dumps([i, role, c, ts], ensure_ascii=False) for i, _, role, c, ts in by_session[s])
+        blocks.append((s, zlib.compress(lines.encode("utf-8"), 6)))
+    seg, spans = _write_segment(Path(path).stem, blocks)
+
+    with memory._tx(con) as c:
+        for s, (off, ln) in zip(sessions, spans):
+            rs = by_session[s]
+            c.execute(
+                "INSERT OR REPLACE INTO archive_index(session,segment,offset,length,from_id,to_id,n,ts_max) "
+                "VALUES(?,?,?,?,?,?,?,?)",
+                (s, seg, off, ln, rs[0][0], rs[-1][0], len(rs), max(r[4] for r in rs))
+            )
+        c.executemany("DELETE FROM turns WHERE id=?", [(r[0],) for r in rows])
+    # 删掉的行从 WAL 合回主库，WAL 文件截回 0
+    con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return len(rows)
+
+
+def archive_old_turns(age_days: Optional[float] = None, batch: Optional[int] = None) -> int:
+    """把早于 age_days 天的轮次从各分片移到段文件；返回归档行数。同一进程内同时只跑一个。"""
+    age = ARCHIVE_AGE_DAYS if age_days is None else age_days
+    cutoff = time.time() - age * 86400
+    limit = ARCHIVE_BATCH if batch is None else batch
+    if not _run_lock.acquire(blocking=False):
+        return 0
+    try:
+        n = 0
+        for p in memory.shard_paths():
+            while True:
+                k = _archive_shard(p, cutoff, limit)
+                n += k
+                if k < limit:
+                    break
+        return n
+    finally:
+        _run_lock.release()
+
+
+def _read_block(segment: str, offset: int, length: int) -> List[list]:
+    with open(archive_dir() / segment, "rb") as f:
+        f.seek(offset)
+        data = zlib.decompress(f.read(length))
+    return [json.loads(l) for l in data.decode("utf-8").splitlines() if l]
+
+
+def archived_turns(session: str, limit: Optional[int] = None, before_id: Optional[int] = None):
+    """
+    归档里的历史 [(role, content, ts)]，按时间正序；
+    limit 只取最近的 limit 条，before_id 只取该 id 之前的（翻页用）。
+    """
+    q = "SELECT segment, offset, length FROM archive_index WHERE session=?"
+    args: list = [session]
+    if before_id is not None:
+        q += " AND from_id < ?"
+        args.append(before_id)
+    idx = memory._conn(memory._path(session)).execute(q + " ORDER BY to_id DESC", args).fetchall()
+    out: List[list] = []
+    for seg, off, ln in idx:                     # 从最新的块往前读，够 limit 就停
+        try:
+            rows = _read_block(seg, off, ln)
+        except (OSError, zlib.error, ValueError) as e:
+            print(f"[ARCHIVE] read {seg}@{off} failed ->", e)
+            continue
+        if before_id is not None:
+            rows = [r for r in rows if r[0] < before_id]
+        out = rows + out
+        if limit is not None and len(out) >= limit:
+            break
+    out.sort(key=lambda r: r[0])
+    if limit is not None:
+        out = out[-limit:] if limit > 0 else []
+    return [(role, c, ts) for _, role, c, ts in out]
+
+
+def archive_stats(session: Optional[str] = None) -> Dict[str, int]:
+    """归档块数 / 行数 / 压缩后字节数（session=None 为全部分片合计）"""
+    paths = [memory._path(session)] if session else memory.shard_paths()
+    blocks = rows = size = 0
+    for p in paths:
+        q = "SELECT COUNT(*), COALESCE(SUM(n),0), COALESCE(SUM(length),0) FROM archive_index"
+        r = memory._conn(p).execute(q + (" WHERE session=?" if session else ""),
+                                    (session,) if session else ()).fetchone()
+        blocks, rows, size = blocks + r[0], rows + r[1], size + r[2]
+    return {"blocks": blocks, "rows": rows, "bytes": size}
+
+
+def _archiver_loop():
+    while True:
+        time.sleep(ARCHIVE_EVERY_S)
+        try:
+            n = archive_old_turns()
+            if n:
+                print(f"[ARCHIVE] moved {n} turns to cold storage")
+        except Exception as e:
+            print("[ARCHIVE] error ->", e)
+
+def start_archiver():
+    """MINBIZ_ARCHIVE_EVERY_S > 0 时启动后台归档线程（重复调用无副作用）"""
+    global _archiver
+    if ARCHIVE_EVERY_S <= 0 or _archiver is not None:
+        return
+    with _archiver_lock:
+        if _archiver is None:
+            _archiver = threading.Thread(target=_archiver_loop, name="turn-archiver", daemon=True)
+            _archiver.start()
@@ -1,183 +1,120 @@
 # -*- coding: utf-8 -*-
-import os, sqlite3, re
-from typing import Any, Dict, List, Tuple
-from contextlib import closing, suppress
-
-
-# ---- OpenAI client ----
-from openai import OpenAI
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
-_client = OpenAI(api_key=OPENAI_API_KEY)  # 注意：全局单例，供下方 _gen_answer_llm 使用
+import os, re, time
+from typing import Any, Dict, Iterator, List, Tuple
+
+
+# ---- OpenAI client：进程级共享（连接池 + 按模型超时），见 app/llm_client.py ----
+from ..app.llm_client import chat_completion
+from ..rag.sqlite_fts import search as fts_search
+from ..rag.context_packer import pack_context
+from ..orchestrator.answer_pipeline import Stage, run_stages, background, background_slow
+from .memory import load_facts, add_turn, history_for_prompt, compact_session
+
+# 默认 0 = prompt 放整段正文；>0 时每条命中只放 snippet() 选出的命中词窗口（token 数，一个汉字算一个，上限 64），
+# 省 token 但会丢掉窗口外的上下文，需按语料自行评估后再开
+RAG_SNIPPET_TOKENS = int(os.getenv("MINBIZ_RAG_SNIPPET_TOKENS", "0"))
+# 检索候选条数；最终放进 prompt 的由 context_packer 按 token 预算挑选（MINBIZ_CTX_BUDGET_TOKENS）
+RAG_CANDIDATES = int(os.getenv("MINBIZ_RAG_CANDIDATES", "10"))
+
+# 各阶段 deadline（秒），超时用兜底结果继续；多查询改写默认关闭（多一次 LLM 调用）
+STAGE_TIMEOUT_MEMORY = float(os.getenv("MINBIZ_STAGE_TIMEOUT_MEMORY", "0.5"))
+STAGE_TIMEOUT_RAG    = float(os.getenv("MINBIZ_STAGE_TIMEOUT_RAG", "3"))
+STAGE_TIMEOUT_EXPAND = float(os.getenv("MINBIZ_STAGE_TIMEOUT_EXPAND", "2.5"))
+STAGE_TIMEOUT_LLM    = float(os.getenv("MINBIZ_STAGE_TIMEOUT_LLM", "60"))
+QUERY_EXPAND         = os.getenv("MINBIZ_QUERY_EXPAND", "0") == "1"
+HISTORY_TURNS        = int(os.getenv("MINBIZ_HISTORY_TURNS", "8"))   # 摘要之后最多带几条原始轮次
 
 # =========================
 # 基础：RAG 检索（容错封装）
 # =========================
-def _table_exists(conn, name: str) -> bool:
-    cur = conn.cursor()
-    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?;", (name,))
-    return cur.fetchone() is not None
-
-
-def _split_terms(q: str) -> list[str]:
-    # 取中文、英文数字，去掉标点，按连续块切开
-    terms = re.findall(r"[A-Za-z0-9]+|[\u4e00-\u9fff]+", q)
-    # 过滤过短项（比如“的”“了”），中文保留长度>=2的片段；英数长度>=2
-    out = []
-    for t in terms:
-        if re.search(r"[\u4e00-\u9fff]", t):
-            if len(t) >= 2:
-                out.append(t)
-        else:
-            if len(t) >= 2:
-                out.append(t.lower())
-    # 去重，保序
-    seen = set()
-    uniq = []
-    for t in out:
-        if t not in seen:
-            seen.add(t)
-            uniq.append(t)
-    return uniq
-
-def rag_search(db_path: str, q: str, limit: int = 6):
-    import sqlite3
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+def rag_search(db_path: str, q: str, limit: int = 6, snippet_tokens: int = 0, highlight: bool = False):
+    """
+    走 sqlite_fts 的 CJK 查询编译 + 倒排索引（bm25 排序）。
+    返回 [{'text','score','meta':{source,section_title,chunk_id}}]
+    snippet_tokens / highlight 打开时额外带 'snippet' / 'highlight'（见 sqlite_fts.search）
+    """
     try:
-        cur = conn.cursor()
-
-        # 1) 先试 FTS MATCH（成功就直接用）
-        rows = []
-        try:
-            cur.execute(
-                "SELECT text, source, section_title, chunk_id, 1.0 AS score "
-                "FROM paragraphs WHERE paragraphs MATCH ? LIMIT ?;",
-                (q, limit)
-            )
-            rows = cur.fetchall()
-        except Exception as e:
-            print("[RAG] FTS MATCH error ->", e)
-
-        # 2) 如果 MATCH 为空，做中文友好的 LIKE 回退
-        if not rows:
-            terms = _split_terms(q)
-            # 如果没有有效词，就退回整个 q，但一般不会发生
-            if not terms:
-                terms = [q]
-
-            # 拼接 WHERE: text LIKE ? OR text LIKE ? ...
-            where = " OR ".join(["text LIKE ?"] * len(terms))
-            params = [f"%{t}%" for t in terms]
-
-            cur.execute(
-                f"SELECT text, source, section_title, chunk_id "
-                f"FROM paragraphs WHERE {where} LIMIT 200;",
-                params
-            )
-            cand = cur.fetchall()
-
-            # 计算一个简单得分：命中词个数（越多越靠前）
-            scored = []
-            for r in cand:
-                txt = (r["text"] or "")
-                s = 0
-                for t in terms:
-                    if t in txt:
-                        s += 1
-                if s > 0:
-                    scored.append((s, r))
-            scored.sort(key=lambda x: x[0], reverse=True)
-            rows = [r for _, r in scored[:limit]]
-
-            # 把 rows 变成有 score 的结构
-            tmp = []
-            for s, r in scored[:limit]:
-                tmp.append({
-                    "text": r["text"],
-                    "source": r["source"],
-                    "section_title": r["section_title"],
-                    "chunk_id": r["chunk_id"],
-                    "score": float(s),   # 命中词个数作为分数
-                })
-            if tmp:
-                # 统一返回 dict 列表
-                return tmp
-
-        # 3) 统一规范化返回
-        hits = []
-        for r in rows:
-            # rows 可能来自 MATCH（Row，含 score=1.0）或上面的 tmp（已是 dict）
-            if isinstance(r, dict):
-                hits.append({
-                    "text": r.get("text", ""),
-                    "score": float(r.get("score", 0.0)),
-                    "meta": {
-                        "source": r.get("source"),
-                        "section_title": r.get("section_title"),
-                        "chunk_id": r.get("chunk_id"),
-                    },
-                })
-            else:
-                hits.append({
-                    "text": r["text"],
-                    "score": float(r["score"] if "score" in r.keys() else 1.0),
-                    "meta": {
-                        "source": r["source"],
-                        "section_title": r["section_title"],
-                        "chunk_id": r["chunk_id"],
-                    },
-                })
-        return hits
-    finally:
-        conn.close()
+        return fts_search(db_path, q, top_k=limit, snippet_tokens=snippet_tokens, highlight=highlight)
+    except Exception as e:
+        print("[RAG] search error ->", e)
+        return []
 
 # ---------- RAG 拼接 ----------
-def _build_context(db_path: str, query: str, top_k: int = 6):
-    """
-    检索 -> 生成 rag_ctx 和 evidence
-    """
-    hits = rag_search(db_path, query, limit=top_k)  # 统一用 limit
-    # 直接把 hits 里的字段映射到 evidence
+def _retrieve(db_path: str, query: str, top_k: int = 6):
+    return rag_search(db_path, query, limit=top_k,  # 统一用 limit
+                      snippet_tokens=RAG_SNIPPET_TOKENS)
+
+def _retrieve_many(db_path: str, queries: List[str], top_k: int = 6):
+    """改写问句逐条检索，按 chunk_id 去重（保留最高分）"""
+    best: Dict[Any, Dict[str, Any]] = {}
+    for q in queries:
+        for h in _retrieve(db_path, q, top_k):
+            cid = (h.get("meta") or {}).get("chunk_id") or h.get("text")
+            if cid not in best or h.get("score", 0.0) > best[cid].get("score", 0.0):
+                best[cid] = h
+    return sorted(best.values(), key=lambda h: h.get("score", 0.0), reverse=True)
+
+def _merge_hits(primary, extra, top_k: int = 6):
+    """原问句命中优先，改写问句的命中补位（按 chunk_id 去重）"""
+    seen = {(h.get("meta") or {}).get("chunk_id") or h.get("text") for h in primary}
+    out = list(primary)
+    for h in extra:
+        if len(out) >= top_k:
+            break
+        cid = (h.get("meta") or {}).get("chunk_id") or h.get("text")
+        if cid not in seen:
+            seen.add(cid)
+            out.append(h)
+    return out
+
+def _pack_context(hits):
+    """候选命中 -> 按 token 预算打包（相邻重叠合并、近重复去除），再映射成 rag_ctx 和 evidence"""
+    packed = pack_context(hits or [])
     ev = []
-    for h in (hits or []):
-        meta = h.get("meta") or {}
+    for p in packed:
+        meta = p.get("meta") or {}
         ev.append({
-            "score": float(h.get("score", 0.0)),
+            "score": float(p.get("score", 0.0)),
             "source": meta.get("source"),
-            "preview": (h.get("text") or "")[:200],
+            "preview": (p.get("text") or "")[:200],   # 纯文本：UI 用 st.json 展示，不渲染 <mark>
             "chunk_id": meta.get("chunk_id"),
             "title": meta.get("section_title"),
+            "merged": p.get("merged"),
+            "tokens": p.get("tokens"),
         })
-    # 上下文拼成一段（也可用段落列表拼接）
-    rag_ctx = "\n".join((h.get("text") or "") for h in (hits or []))
+    rag_ctx = "\n".join(p["text"] for p in packed)
     return rag_ctx, ev
 
 
-
-
-def _normalize_hits(hits: Any) -> List[Dict[str, Any]]:
-    """把检索结果统一成 [{'text','score','meta':{...}}]"""
-    if not hits:
-        return []
-    out: List[Dict[str, Any]] = []
-    for h in hits:
-        if isinstance(h, dict):
-            text  = h.get("text", "")
-            score = float(h.get("score", 0.0) or 0.0)
-            meta  = h.get("meta", {})
-        else:
-            # 兜底：未知结构
-            text, score, meta = str(h), 0.0, {}
-        out.append({"text": text, "score": score, "meta": meta})
-    return out
+def _expand_queries(q: str, n: int = 2) -> List[str]:
+    """用小模型生成互补问句（不含原问句），增加召回覆盖面；失败返回 []"""
+    import json
+    model = os.getenv("MINBIZ_OAI_QUERY_MODEL", "gpt-4o-mini")
+    resp = chat_completion(
+        model,
+        messages=[
+            {"role": "system", "content": "你是检索提示词改写器，只输出JSON数组。"},
+            {"role": "user", "content": f"请为下面的问题生成{n}个不同角度的改写问句，覆盖同义和上下位表达。"
+                                        "只输出JSON数组（字符串数组），不要解释。\n问题：" + q},
+        ],
+        temperature=0.3,
+    )
+    txt = (resp.choices[0].message.content or "").strip()
+    arr = json.loads(txt) if txt.startswith("[") else []
+    return [x.strip() for x in arr if isinstance(x, str) and x.strip() and x.strip() != q][:n]
 
 
 # =========================
 # LLM 生成
 # =========================
-def _gen_answer_llm(question: str, lang: str, rag_ctx: str) -> str:
+_LLM_SORRY = "Sorry, I had trouble generating the answer. Please try again."
+
+def _build_messages(question: str, lang: str, rag_ctx: str,
+                    facts: Dict[str, str] = None, history: List[Tuple[str, str]] = None,
+                    summary: str = "") -> List[Dict[str, str]]:
     """
-    使用你喜欢的英文 prompt（加入中英标题逻辑），并用上方 _client。
+    使用你喜欢的英文 prompt（加入中英标题逻辑）。
+    facts：用户画像；summary：较早对话的滚动摘要；history：摘要之后的几轮 (role, content)；都可为空。
     """
     # 标题常量（中英）
     if lang == "en":
@@ -187,11 +124,17 @@ def _gen_answer_llm(question: str, lang: str, rag_ctx: str) -> str:
 
     tag = "English" if lang == "en" else "Chinese"
 
+    profile = "".join(f"- {k}: {v}\n" for k, v in (facts or {}).items())
+    convo = "".join(f"{r}: {(c or '')[:300]}\n" for r, c in (history or []))
+
     prompt = (
         "You are MinBiz, a startup consultant. Always ground your answer in the PROVIDED CONTEXT first. "
         "If something is not in the context, add it as short general tips.\n"
         f"Write in {tag}. Style: friendly, vivid, example-driven, short sentences, bullet points.\n\n"
-        "User question:\n"
+        + (f"User profile:\n{profile}\n" if profile else "")
+        + (f"Earlier conversation (summary):\n{summary}\n\n" if summary else "")
+        + (f"Recent conversation:\n{convo}\n" if convo else "")
+        + "User question:\n"
         f"{question}\n\n"
         f"{rag_ctx if rag_ctx else '(no context)'}\n\n"
         "Please output in the following sections:\n"
@@ -208,60 +151,161 @@ def _gen_answer_llm(question: str, lang: str, rag_ctx: str) -> str:
     else:
         sys = "You are a startup coach. Detect the user's language (Chinese or English) and answer in the same language."
 
+    return [
+        {"role": "system", "content": sys},
+        {"role": "user", "content": prompt},
+    ]
+
+def _gen_answer_llm(question: str, lang: str, rag_ctx: str,
+                    facts: Dict[str, str] = None, history: List[Tuple[str, str]] = None,
+                    summary: str = "") -> str:
+    """一次性生成（共享客户端 + 重试 / 熔断，见 llm_client.chat_completion）"""
     try:
-        completion = _client.chat.completions.create(
-            model=os.getenv("MINBIZ_OPENAI_MODEL", "gpt-4o"),
-            messages=[
-                {"role": "system", "content": sys},
-                {"role": "user", "content": prompt},
-            ],
+        model = os.getenv("MINBIZ_OPENAI_MODEL", "gpt-4o")
+        completion = chat_completion(
+            model,
+            messages=_build_messages(question, lang, rag_ctx, facts, history, summary),
             temperature=0.3,
         )
         return (completion.choices[0].message.content or "").strip()
     except Exception as e:
         print("[LLM] error ->", e)
-        return "Sorry, I had trouble generating the answer. Please try again."
-
-# =========================
-# 画像 / 记忆（可选）
-# =========================
-def load_facts(session: str) -> Dict[str, str]:
-    # 你的实现；没有也没关系
-    return {}
+        return _LLM_SORRY
 
-def add_turn(session: str, role: str, content: str) -> None:
-    # 你的实现；没有也没关系
-    pass
+def _stream_answer_llm(question: str, lang: str, rag_ctx: str,
+                       facts: Dict[str, str] = None, history: List[Tuple[str, str]] = None,
+                       summary: str = "") -> Iterator[str]:
+    """流式生成：逐段 yield 模型输出的增量文本；出错时 yield 兜底文案后结束"""
+    got = False
+    try:
+        model = os.getenv("MINBIZ_OPENAI_MODEL", "gpt-4o")
+        stream = chat_completion(
+            model,
+            messages=_build_messages(question, lang, rag_ctx, facts, history, summary),
+            temperature=0.3,
+            stream=True,
+        )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                got = True
+                yield delta
+    except Exception as e:
+        print("[LLM] stream error ->", e)
+        yield ("\n\n" if got else "") + _LLM_SORRY
 
 # =========================
 # 对外主函数
 # =========================
+def _summarize_llm(prev: str, turns: List[Tuple[str, str]]) -> str:
+    """把旧摘要 + 一段对话折叠成新摘要（小模型，失败返回空串 = 本次不压缩）"""
+    convo = "".join(f"{r}: {(c or '')[:1200]}\n" for r, c in turns)
+    try:
+        model = os.getenv("MINBIZ_OAI_SUMMARY_MODEL", "gpt-4o-mini")
+        completion = chat_completion(
+            model,
+            messages=[
+                {"role": "system", "content": "你是对话记录压缩器。输出要点摘要，不要寒暄。"},
+                {"role": "user", "content":
+                    "把【已有摘要】和【新对话】合并成一份新的摘要（不超过250字，沿用对话语言）："
+                    "保留用户的背景、目标、约束、已给出的关键建议和尚未解决的问题。\n\n"
+                    f"【已有摘要】\n{prev or '（无）'}\n\n【新对话】\n{convo}"},
+            ],
+            temperature=0.2,
+        )
+        return (completion.choices[0].message.content or "").strip()
+    except Exception as e:
+        print("[LLM] summarize error ->", e)
+        return ""
+
+def _log_turns(session: str, query: str, text: str) -> None:
+    add_turn(session, "user", query)
+    add_turn(session, "assistant", text)
+    # 轮次够多时把较早的折叠进滚动摘要（单独的后台任务，不占响应时间，也不拖住轮次写入）
+    background_slow(compact_session, session, _summarize_llm)
+
+def _context_stages(session: str, query: str, db_path: str):
+    """生成前的并发阶段：画像、历史、检索、（可选）问句改写；返回 (stages, generate 的依赖)"""
+    stages = [
+        Stage("facts",    lambda: load_facts(session), timeout=STAGE_TIMEOUT_MEMORY, fallback=dict),
+        Stage("history",  lambda: history_for_prompt(session, HISTORY_TURNS), timeout=STAGE_TIMEOUT_MEMORY,
+              fallback=lambda: ("", [])),
+        Stage("retrieve", lambda: _retrieve(db_path, query, RAG_CANDIDATES), timeout=STAGE_TIMEOUT_RAG, fallback=list),
+    ]
+    deps = ("facts", "history", "retrieve")
+    if QUERY_EXPAND:
+        stages += [
+            Stage("expand", lambda: _expand_queries(query), timeout=STAGE_TIMEOUT_EXPAND, fallback=list,
+                  llm=True),
+            Stage("retrieve_more", lambda expand: _retrieve_many(db_path, expand, RAG_CANDIDATES),
+                  deps=("expand",), timeout=STAGE_TIMEOUT_RAG, fallback=list),
+        ]
+        deps += ("retrieve_more",)
+    return stages, deps
+
+def _detect_lang(query: str, lang: str) -> str:
+    # 简单判断语言：检测中文字符
+    if lang == "auto":
+        return "zh" if re.search(r"[\u4e00-\u9fff]", query) else "en"
+    return lang
+
 def answer(session: str, query: str, db_path: str, debug: bool = False, lang: str = "auto") -> Dict[str, Any]:
     """
     返回：
-      {"text": "...", "evidence": [...]}  // 仅在 debug=True 时包含 evidence
+      {"text": "...", "evidence": [...], "timings": {...}}  // evidence / timings 仅在 debug=True 时包含
+    画像、历史、检索、（可选）问句改写并发执行，各有 deadline 和兜底；LLM 等它们就绪后生成；
+    记录轮次放到后台，不占响应时间。
     """
-    text: str = ""  # 防止异常时 UnboundLocalError
-
-    # 1) 读取画像（不强依赖）
-    with suppress(Exception):
-        _ = load_facts(session)
+    lang = _detect_lang(query, lang)
+    stages, deps = _context_stages(session, query, db_path)
 
-    # 2) RAG
-    rag_ctx, ev = _build_context(db_path, query, top_k=6)
+    def _generate(facts, history, retrieve, retrieve_more=()):
+        rag_ctx, ev = _pack_context(_merge_hits(retrieve, retrieve_more, RAG_CANDIDATES))
+        summary, turns = history
+        return _gen_answer_llm(query, lang, rag_ctx, facts=facts, history=turns, summary=summary), ev
 
-    # 3) LLM
-    # 简单判断语言：检测中文字符
-    if lang == "auto":
-        lang = "zh" if re.search(r"[\u4e00-\u9fff]", query) else "en"
-    text = _gen_answer_llm(query, lang, rag_ctx)
+    stages.append(Stage("generate", _generate, deps=deps, timeout=STAGE_TIMEOUT_LLM,
+                        fallback=(_LLM_SORRY, []), llm=True))
+    results, timings = run_stages(stages)
+    text, ev = results["generate"]
 
-    # 4) 记录轮次（忽略错误）
-    with suppress(Exception):
-        add_turn(session, "user", query)
-        add_turn(session, "assistant", text)
+    # 记录轮次（后台执行，忽略错误）
+    background(_log_turns, session, query, text)
 
     out: Dict[str, Any] = {"text": text}
     if debug:
         out["evidence"] = ev
+        out["timings"] = timings
     return out
+
+def answer_stream(session: str, query: str, db_path: str, lang: str = "auto") -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    answer 的流式版本，按顺序 yield (event, data)：
+      ("evidence", {"evidence": [...], "timings": {...}})   上下文阶段完成后立即发出
+      ("token",    {"t": "增量文本"})                        模型每吐一段发一次
+      ("done",     {"text": "完整回答", "timings": {...}})    结束；轮次在此之后后台记录
+    """
+    lang = _detect_lang(query, lang)
+    stages, _ = _context_stages(session, query, db_path)
+    results, timings = run_stages(stages)
+    rag_ctx, ev = _pack_context(_merge_hits(results["retrieve"], results.get("retrieve_more", ()), RAG_CANDIDATES))
+    yield "evidence", {"evidence": ev, "timings": timings}
+
+    t0 = time.perf_counter()
+    first, parts = None, []
+    summary, turns = results["history"]
+    for delta in _stream_answer_llm(query, lang, rag_ctx, facts=results["facts"], history=turns, summary=summary):
+        if first is None:
+            first = time.perf_counter() - t0
+        parts.append(delta)
+        yield "token", {"t": delta}
+    text = "".join(parts).strip()
+    timings["generate"] = {
+        "ms": round((time.perf_counter() - t0) * 1000, 1), "status": "ok",
+        "first_token_ms": round((first or 0.0) * 1000, 1),
+    }
+
+    background(_log_turns, session, query, text)
+    yield "done", {"text": text, "timings": timings}
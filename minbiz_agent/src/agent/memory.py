@@ -1,105 +1,576 @@
 # -*- coding: utf-8 -*-
-"""Session memory (SQLite) for user facts & conversation turns."""
-import sqlite3, json, time, os
+"""
+Session memory (SQLite) for user facts & conversation turns.
+- 每个线程一条长连接（threading.local），不再每次调用 connect / close
+- 表结构用 PRAGMA user_version 做版本化迁移，每个进程每个库只跑一次
+- facts(session, ts) / turns(session, id) / turns(session, ts) 索引：按会话取历史不随总行数增长
+- 滚动摘要（compaction）：较早的轮次折叠进按轮次区间（from_id..to_id）存储的摘要，
+  prompt 只带「摘要 + 摘要之后的少量原始轮次」，长会话的 prompt 大小保持稳定
+- 按 session 哈希分片到 N 个库文件（MINBIZ_MEM_SHARDS），各分片各自一把写锁，并发写入随分片数扩展；
+  路由对调用方透明；已有单库用 tools/shard_memory_db.py 拆分
+- 冷归档：超过保留期的轮次由 archive.py 移到压缩段文件，热库只留近期数据
+- 写回队列（write-behind）：add_turn / save_fact 只入队，后台线程每 N 毫秒或 N 行合并成一个事务落盘；
+  队列满时短暂阻塞，仍满则改为同步写（背压）；进程退出时 atexit 把队列刷干净；
+  last_k_turns / load_facts 默认把尚未落盘的写入合并进结果（read-your-writes）
+环境变量：
+  MINBIZ_DB                 库文件（默认 <项目>/data/minbiz.db）
+  MINBIZ_MEM_MMAP_MB        mmap 大小（默认 256）
+  MINBIZ_MEM_SHARDS         分片数（默认 1 = 单库 MINBIZ_DB；N>1 时为同目录下 <名>.s00.db ... ）
+  MINBIZ_MEM_WRITE_BEHIND   1=启用写回队列（默认），0=同步写
+  MINBIZ_MEM_FLUSH_MS       最长攒批时间（默认 200）
+  MINBIZ_MEM_FLUSH_ROWS     单批最大行数（默认 256）
+  MINBIZ_MEM_QUEUE_MAX      队列容量（默认 10000）
+  MINBIZ_MEM_PUT_TIMEOUT    队列满时最多等待秒数，超时改同步写（默认 0.5）
+  MINBIZ_CACHE_MAX_ROWS     回答缓存 L2（SQLite）最大条数，按最近访问淘汰（默认 5000）
+  MINBIZ_CACHE_L1_SIZE      回答缓存 L1（进程内 LRU）条数（默认 512）
+  MINBIZ_CACHE_SWEEP_S      清理线程周期秒数：删过期 + 控制条数（默认 300）
+"""
+import atexit, hashlib, json, os, queue, sqlite3, threading, time
+from collections import OrderedDict
+from contextlib import suppress
 from pathlib import Path
-import hashlib, json, time, sqlite3, os
-DB_PATH = os.getenv("MINBIZ_DB", "data/minbiz.db")
-
-def _conn():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    con = sqlite3.connect(DB_PATH)
-    con.execute("PRAGMA journal_mode=WAL;")
-    con.execute("PRAGMA synchronous=NORMAL;")
-    con.execute("PRAGMA temp_store=MEMORY;")
-    con.execute("PRAGMA mmap_size=30000000000;")
-    return con
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from ..rag.result_cache import normalize_query
+
+DB_PATH = os.environ.get(
+    "MINBIZ_DB",
+    str(Path(__file__).resolve().parents[2] / "data" / "minbiz.db")
+)
+MEM_MMAP_MB = int(os.getenv("MINBIZ_MEM_MMAP_MB", "256"))
+MEM_SHARDS  = int(os.getenv("MINBIZ_MEM_SHARDS", "1"))
+
+MEM_WRITE_BEHIND = os.getenv("MINBIZ_MEM_WRITE_BEHIND", "1") == "1"
+MEM_FLUSH_MS     = int(os.getenv("MINBIZ_MEM_FLUSH_MS", "200"))
+MEM_FLUSH_ROWS   = int(os.getenv("MINBIZ_MEM_FLUSH_ROWS", "256"))
+MEM_QUEUE_MAX    = int(os.getenv("MINBIZ_MEM_QUEUE_MAX", "10000"))
+MEM_PUT_TIMEOUT  = float(os.getenv("MINBIZ_MEM_PUT_TIMEOUT", "0.5"))
+MEM_CARRY_MAX    = int(os.getenv("MINBIZ_MEM_CARRY_MAX", "10000"))   # 写失败后留待下一批重写的行数上限
+
+CACHE_MAX_ROWS = int(os.getenv("MINBIZ_CACHE_MAX_ROWS", "5000"))
+CACHE_L1_SIZE  = int(os.getenv("MINBIZ_CACHE_L1_SIZE", "512"))
+CACHE_SWEEP_S  = float(os.getenv("MINBIZ_CACHE_SWEEP_S", "300"))
+CACHE_TTL_MAX  = 7 * 86400    # 清理线程按这个上限删过期行（读取时仍按调用方的 ttl_sec 判断）
 
-def _ensure_cache_table(con):
-    con.execute("""
+# 第 i 条迁移把 user_version 从 i 升到 i+1；只追加，不修改已发布的条目
+_MIGRATIONS = [
+    # 1: 基础表（与早期版本建表语句一致，已有库直接跳过）
+    """
+    CREATE TABLE IF NOT EXISTS facts(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session TEXT, key TEXT, value TEXT, ts REAL
+    );
+    CREATE TABLE IF NOT EXISTS turns(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session TEXT, role TEXT, content TEXT, ts REAL
+    );
     CREATE TABLE IF NOT EXISTS cache (
       k TEXT PRIMARY KEY,
       v TEXT NOT NULL,
       ts INTEGER NOT NULL
-    )""")
+    );
+    """,
+    # 2: 按会话查询的索引
+    """
+    CREATE INDEX IF NOT EXISTS idx_facts_session_ts ON facts(session, ts);
+    CREATE INDEX IF NOT EXISTS idx_turns_session_id ON turns(session, id);
+    CREATE INDEX IF NOT EXISTS idx_turns_session_ts ON turns(session, ts);
+    """,
+    # 3: 回答缓存加 session / 索引代号 / 访问时间列（旧表的 key 无法还原 session，缓存直接重建）
+    """
+    DROP TABLE IF EXISTS cache;
+    CREATE TABLE cache (
+      k TEXT PRIMARY KEY,
+      session TEXT NOT NULL,
+      gen INTEGER NOT NULL DEFAULT 0,
+      v TEXT NOT NULL,
+      ts INTEGER NOT NULL,
+      atime INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_cache_session ON cache(session);
+    CREATE INDEX IF NOT EXISTS idx_cache_atime ON cache(atime);
+    """,
+    # 4: 会话滚动摘要，按轮次区间存；最新一条（to_id 最大）覆盖 from_id..to_id 的全部轮次
+    """
+    CREATE TABLE IF NOT EXISTS summaries (
+      session TEXT NOT NULL,
+      from_id INTEGER NOT NULL,
+      to_id INTEGER NOT NULL,
+      summary TEXT NOT NULL,
+      ts REAL NOT NULL,
+      PRIMARY KEY (session, to_id)
+    );
+    """,
+    # 5: 冷归档（archive.py）：每个段文件里每个会话一块，记录偏移 / 长度 / 覆盖的轮次区间；按 ts 找过期轮次
+    """
+    CREATE TABLE IF NOT EXISTS archive_index (
+      session TEXT NOT NULL,
+      segment TEXT NOT NULL,
+      offset INTEGER NOT NULL,
+      length INTEGER NOT NULL,
+      from_id INTEGER NOT NULL,
+      to_id INTEGER NOT NULL,
+      n INTEGER NOT NULL,
+      ts_max REAL NOT NULL,
+      PRIMARY KEY (session, to_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_turns_ts ON turns(ts);
+    """,
+]
+SCHEMA_VERSION = len(_MIGRATIONS)
+
+_local = threading.local()
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+def _migrate(con: sqlite3.Connection):
+    """按 user_version 依次执行未跑过的迁移；BEGIN IMMEDIATE 防止多进程同时迁移。"""
+    for i in range(SCHEMA_VERSION):
+        if con.execute("PRAGMA user_version").fetchone()[0] > i:
+            continue
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            if con.execute("PRAGMA user_version").fetchone()[0] <= i:   # 拿到写锁后再确认一次
+                for stmt in _MIGRATIONS[i].split(";"):
+                    if stmt.strip():
+                        con.execute(stmt)
+                con.execute(f"PRAGMA user_version={i + 1}")
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+
+def _open(path: str) -> sqlite3.Connection:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(path, timeout=30, isolation_level=None, cached_statements=128)
+    con.executescript(f"""
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA mmap_size={MEM_MMAP_MB << 20};
+    """)
+    if path not in _migrated:
+        with _migrate_lock:
+            if path not in _migrated:
+                _migrate(con)
+                _migrated.add(path)
+    return con
+
+def shard_paths(n: Optional[int] = None) -> List[str]:
+    """n 个分片的库文件路径；n<=1 时就是 DB_PATH 本身"""
+    n = MEM_SHARDS if n is None else n
+    if n <= 1:
+        return [DB_PATH]
+    p = Path(DB_PATH)
+    return [str(p.with_name(f"{p.stem}.s{i:02d}{p.suffix}")) for i in range(n)]
+
+def shard_of(session: str, n: Optional[int] = None) -> int:
+    """session -> 分片号；用 sha1 而不是 hash()，跨进程 / 重启稳定"""
+    n = MEM_SHARDS if n is None else n
+    if n <= 1:
+        return 0
+    return int.from_bytes(hashlib.sha1(session.encode("utf-8")).digest()[:8], "big") % n
+
+def _path(session: str) -> str:
+    return shard_paths()[shard_of(session)]
+
+def _conn(path: Optional[str] = None) -> sqlite3.Connection:
+    """当前线程连到 path（默认 DB_PATH）的长连接（autocommit 模式，写操作用 _tx() 包事务）。"""
+    path = path or DB_PATH
+    pool = getattr(_local, "pool", None)
+    if pool is None:
+        pool = _local.pool = {}
+    con = pool.get(path)
+    if con is None:
+        con = pool[path] = _open(path)
+    return con
+
+class _tx:
+    """写事务：BEGIN IMMEDIATE ... COMMIT / ROLLBACK"""
+    def __init__(self, con):
+        self.con = con
+    def __enter__(self):
+        self.con.execute("BEGIN IMMEDIATE")
+        return self.con
+    def __exit__(self, et, ev, tb):
+        self.con.execute("ROLLBACK" if et else "COMMIT")
+        return False
+
+def close_connections():
+    """关闭当前线程持有的连接（线程退出前 / 测试里用）。"""
+    pool = getattr(_local, "pool", None) or {}
+    for con in pool.values():
+        try:
+            con.close()
+        except Exception:
+            pass
+    pool.clear()
+
+def _ensure():
+    # 兼容旧调用：迁移在首次取连接时完成
+    for p in shard_paths():
+        _conn(p)
+
+
+# =========================
+# 回答缓存：L1 进程内 LRU -> L2 SQLite
+# =========================
+# key = sha1(session | 索引代号 | 归一化问句)；索引重建后 key 变化，旧条目自然不再命中，由 LRU / 清理线程回收。
+# 只适合结果不随会话历史变化的调用方：带了历史的回答每轮都不同，不要放进来
+_l1: "OrderedDict[str, Tuple[str, int, Any]]" = OrderedDict()   # k -> (session, ts, payload)
+_l1_by_session: Dict[str, Set[str]] = {}
+_l1_lock = threading.Lock()
+_sweeper: Optional[threading.Thread] = None
+_sweeper_lock = threading.Lock()
+_cache_sets = 0
+
+
+def _cache_key(session: str, query: str, generation: int) -> str:
+    return hashlib.sha1(f"{session}|{generation}|{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+def _l1_put(k: str, session: str, ts: int, payload: Any):
+    with _l1_lock:
+        _l1[k] = (session, ts, payload)
+        _l1.move_to_end(k)
+        _l1_by_session.setdefault(session, set()).add(k)
+        while len(_l1) > CACHE_L1_SIZE:
+            old, (s, _, _) = _l1.popitem(last=False)
+            _l1_by_session.get(s, set()).discard(old)
+
+def _l1_drop_session(session: str):
+    with _l1_lock:
+        for k in _l1_by_session.pop(session, ()):
+            _l1.pop(k, None)
 
-def cache_get(session: str, query: str, ttl_sec: int = 3600):
-    k = hashlib.sha1(f"{session}|{query}".encode("utf-8")).hexdigest()
-    con = _conn(); _ensure_cache_table(con)
-    row = con.execute("SELECT v, ts FROM cache WHERE k=?", (k,)).fetchone()
-    con.close()
+def cache_get(session: str, query: str, ttl_sec: int = 3600, generation: int = 0):
+    k = _cache_key(session, query, generation)
+    now = int(time.time())
+    with _l1_lock:
+        hit = _l1.get(k)
+        if hit is not None and now - hit[1] <= ttl_sec:
+            _l1.move_to_end(k)
+            return hit[2]
+    row = _conn(_path(session)).execute("SELECT v, ts, atime FROM cache WHERE k=?", (k,)).fetchone()
     if not row: return None
-    v, ts = row
-    if time.time() - ts > ttl_sec: return None
-    try: return json.loads(v)   # 约定为 {"text":..., "evidence":[...]}
+    v, ts, atime = row
+    if now - ts > ttl_sec: return None
+    try: payload = json.loads(v)   # 约定为 {"text":..., "evidence":[...]}
     except: return None
+    if now - atime > 60:           # 访问时间粗粒度更新，避免每次读都写库；库忙就放弃
+        with suppress(sqlite3.Error):
+            with _tx(_conn(_path(session))) as con:
+                con.execute("UPDATE cache SET atime=? WHERE k=?", (now, k))
+    _l1_put(k, session, ts, payload)
+    return payload
 
-def cache_set(session: str, query: str, payload: dict):
-    k = hashlib.sha1(f"{session}|{query}".encode("utf-8")).hexdigest()
-    con = _conn(); _ensure_cache_table(con)
-    con.execute("INSERT OR REPLACE INTO cache(k,v,ts) VALUES(?,?,?)",
-                (k, json.dumps(payload, ensure_ascii=False), int(time.time())))
-    con.commit(); con.close()
+def cache_set(session: str, query: str, payload: dict, generation: int = 0):
+    global _cache_sets
+    k = _cache_key(session, query, generation)
+    now = int(time.time())
+    _l1_put(k, session, now, payload)
+    with _tx(_conn(_path(session))) as con:
+        con.execute("INSERT OR REPLACE INTO cache(k,session,gen,v,ts,atime) VALUES(?,?,?,?,?,?)",
+                    (k, session, generation, json.dumps(payload, ensure_ascii=False), now, now))
+    _cache_sets += 1
+    if _cache_sets % 64 == 0:      # 写入间隙顺手控制条数；过期清理交给后台线程
+        cache_sweep(expire=False)
+    _start_sweeper()
 
 def cache_invalidate_session(session: str):
-    # 当你写入画像/事实时可调用，避免旧缓存影响
-    prefix = hashlib.sha1(f"{session}|".encode("utf-8")).hexdigest()[:8]  # 简单做法：全表删更直接
-    con = _conn(); _ensure_cache_table(con)
-    con.execute("DELETE FROM cache")   # 简化：全清；如需细粒度可建二级索引存 session
-    con.commit(); con.close()
+    # 写入画像/事实时调用：删掉该 session 的 L2 条目（走 session 索引）和本进程 L1；
+    # 其他进程 L1 里的旧条目要等 TTL / LRU 淘汰
+    _l1_drop_session(session)
+    with _tx(_conn(_path(session))) as con:
+        con.execute("DELETE FROM cache WHERE session=?", (session,))
 
-DB_PATH = os.environ.get(
-    "MINBIZ_DB",
-    str(Path(__file__).resolve().parents[2] / "data" / "minbiz.db")
-)
+def cache_sweep(expire: bool = True, max_rows: Optional[int] = None) -> int:
+    """删除过期条目，并按最近访问时间把 L2 淘汰到 max_rows 条以内（分片时平均分到各分片）；返回删除条数。"""
+    paths = shard_paths()
+    max_rows = CACHE_MAX_ROWS if max_rows is None else max_rows
+    per_shard = -(-max_rows // len(paths))
+    n = 0
+    for p in paths:
+        with _tx(_conn(p)) as con:
+            if expire:
+                n += con.execute("DELETE FROM cache WHERE ts < ?", (int(time.time()) - CACHE_TTL_MAX,)).rowcount
+            extra = con.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - per_shard
+            if extra > 0:
+                n += con.execute(
+                    "DELETE FROM cache WHERE k IN (SELECT k FROM cache ORDER BY atime LIMIT ?)", (extra,)
+                ).rowcount
+    return n
+
+def _sweeper_loop():
+    while True:
+        time.sleep(CACHE_SWEEP_S)
+        try:
+            n = cache_sweep()
+            if n:
+                print(f"[MEM] cache sweep: -{n} rows")
+        except Exception as e:
+            print("[MEM] cache sweep error ->", e)
+
+def _start_sweeper():
+    global _sweeper
+    if _sweeper is None:
+        with _sweeper_lock:
+            if _sweeper is None:
+                _sweeper = threading.Thread(target=_sweeper_loop, name="cache-sweeper", daemon=True)
+                _sweeper.start()
+
+# =========================
+# 写回队列（write-behind）
+# =========================
+# 队列元素：(kind, session, a, b, ts)；kind="turn" 时 a/b = role/content，"fact" 时 a/b = key/value
+Item = Tuple[str, str, str, str, float]
+
+_pending: Dict[str, List[Item]] = {}      # session -> 已入队未落盘的写入（供 read-your-writes）
+_pending_lock = threading.Lock()
+_writers: Dict[str, "_Writer"] = {}       # 库文件 -> 写线程；每个分片一个，互不阻塞
+_writers_lock = threading.Lock()
+_carry: Dict[str, List[Item]] = {}        # 库文件 -> 重试后仍未写入的行，随下一批一起写（仍在 _pending 里，读端可见）
+_stats = {"flush_errors": 0, "dropped": 0}
+_STOP = object()
+
+
+class _Writer:
+    """一个分片的写回队列 + 写线程"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.q: "queue.Queue" = queue.Queue(maxsize=MEM_QUEUE_MAX)
+        self.thread = threading.Thread(target=_writer_loop, args=(self,),
+                                       name=f"memory-writer:{Path(path).name}", daemon=True)
+        self.thread.start()
+
+
+def _write_batch(path: str, batch: List[Item]):
+    """
+    一个事务写入一批（连同上次没写进去的行）；失败重试两次，仍失败则把这批留到下一批再写，
+    不让写线程卡死。留存超过 MEM_CARRY_MAX 时丢弃最早的行，计入 memory_stats()['dropped']。
+    """
+    with _pending_lock:
+        batch = _carry.pop(path, []) + batch
+    turns = [(s, a, b, ts) for k, s, a, b, ts in batch if k == "turn"]
+    facts = [(s, a, b, ts) for k, s, a, b, ts in batch if k == "fact"]
+    for attempt in range(3):
+        try:
+            with _tx(_conn(path)) as con:
+                if turns:
+                    con.executemany("INSERT INTO turns(session,role,content,ts) VALUES(?,?,?,?)", turns)
+                if facts:
+                    con.executemany("INSERT INTO facts(session,key,value,ts) VALUES(?,?,?,?)", facts)
+            done = batch
+            break
+        except sqlite3.Error as e:
+            print(f"[MEM] flush error (try {attempt + 1}) ->", e)
+            time.sleep(0.2 * (attempt + 1))
+    else:
+        keep = batch[-MEM_CARRY_MAX:] if MEM_CARRY_MAX > 0 else []
+        done = batch[:len(batch) - len(keep)]       # 超出上限的最早几行只能丢弃
+        with _pending_lock:
+            _stats["flush_errors"] += 1
+            _stats["dropped"] += len(done)
+            if keep:
+                _carry[path] = keep + _carry.get(path, [])
+        print(f"[MEM] flush failed after retries: {len(keep)} rows kept for next flush, {len(done)} dropped -> {path}")
+    # 落盘（或丢弃）后再从 pending 移除；读端按 ts 去重，所以这里不用和读端互斥
+    with _pending_lock:
+        for it in done:
+            lst = _pending.get(it[1])
+            if lst:
+                try:
+                    lst.remove(it)
+                except ValueError:
+                    pass
+                if not lst:
+                    del _pending[it[1]]
+
+def _writer_loop(w: _Writer):
+    stop = False
+    while not stop:
+        item = w.q.get()
+        batch: List[Item] = []
+        waiters: List[threading.Event] = []
+        deadline = time.monotonic() + MEM_FLUSH_MS / 1000.0
+        while True:
+            if item is _STOP:
+                stop = True
+                break
+            if isinstance(item, threading.Event):
+                waiters.append(item)     # flush()：把已攒的写完就通知
+                break
+            batch.append(item)
+            if len(batch) >= MEM_FLUSH_ROWS:
+                break
+            rem = deadline - time.monotonic()
+            if rem <= 0:
+                break
+            try:
+                item = w.q.get(timeout=rem)
+            except queue.Empty:
+                break
+        if batch or _carry.get(w.path):
+            _write_batch(w.path, batch)
+        for ev in waiters:
+            ev.set()
+
+def _writer_for(path: str) -> _Writer:
+    w = _writers.get(path)
+    if w is not None and w.thread.is_alive():
+        return w
+    with _writers_lock:
+        w = _writers.get(path)
+        if w is None or not w.thread.is_alive():
+            if not _writers:
+                atexit.register(shutdown)
+            w = _writers[path] = _Writer(path)
+    return w
+
+def _enqueue(item: Item):
+    with _pending_lock:
+        _pending.setdefault(item[1], []).append(item)
+    path = _path(item[1])
+    if not MEM_WRITE_BEHIND:
+        _write_batch(path, [item])
+        return
+    try:
+        _writer_for(path).q.put(item, timeout=MEM_PUT_TIMEOUT)
+    except queue.Full:
+        # 背压：写盘跟不上时由调用方同步写，承担这次延迟
+        _write_batch(path, [item])
+
+def flush(timeout: Optional[float] = 10.0) -> bool:
+    """等待此前入队的写入全部落盘（所有分片）；返回是否在超时内完成。"""
+    evs = []
+    for w in list(_writers.values()):
+        if w.thread.is_alive():
+            ev = threading.Event()
+            w.q.put(ev)
+            evs.append(ev)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    return all(ev.wait(None if deadline is None else max(0.0, deadline - time.monotonic())) for ev in evs)
+
+def shutdown(timeout: float = 10.0):
+    """刷完队列并停止写线程（atexit 自动调用；服务关闭钩子里也可主动调用）。"""
+    live = [w for w in list(_writers.values()) if w.thread.is_alive()]
+    for w in live:
+        w.q.put(_STOP)
+    deadline = time.monotonic() + timeout
+    for w in live:
+        w.thread.join(max(0.0, deadline - time.monotonic()))
+        if w.thread.is_alive():
+            print(f"[MEM] shutdown: writer {w.path} still busy after {timeout}s, ~{w.q.qsize()} rows unflushed")
+    for path, rows in list(_carry.items()):
+        print(f"[MEM] shutdown: {len(rows)} rows could not be written -> {path}")
+
+def memory_stats() -> Dict[str, int]:
+    """写回队列状况：queued 为各分片队列积压，carried 为写失败待重写的行，dropped 为累计丢弃的行。"""
+    with _pending_lock:
+        return {
+            "queued": sum(w.q.qsize() for w in list(_writers.values())),
+            "pending": sum(len(v) for v in _pending.values()),
+            "carried": sum(len(v) for v in _carry.values()),
+            **_stats,
+        }
+
+def _pending_of(session: str, kind: str) -> List[Item]:
+    with _pending_lock:
+        return [it for it in _pending.get(session, ()) if it[0] == kind]
 
-def _ensure():
-    Path(DB_PATH).parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH); c = conn.cursor()
-    c.execute("""CREATE TABLE IF NOT EXISTS facts(
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        session TEXT, key TEXT, value TEXT, ts REAL
-    )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS turns(
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        session TEXT, role TEXT, content TEXT, ts REAL
-    )""")
-    conn.commit(); conn.close()
 
 def save_fact(session: str, key: str, value: str):
-    _ensure()
-    conn = sqlite3.connect(DB_PATH); c = conn.cursor()
-    c.execute("INSERT INTO facts(session,key,value,ts) VALUES(?,?,?,?)",
-              (session, key, value, time.time()))
-    conn.commit(); conn.close()
+    _enqueue(("fact", session, key, value, time.time()))
     cache_invalidate_session(session)
 
-def load_facts(session: str):
-    _ensure()
-    conn = sqlite3.connect(DB_PATH); c = conn.cursor()
-    rows = c.execute(
-        "SELECT key,value FROM facts WHERE session=? ORDER BY ts DESC",
+def load_facts(session: str, pending: bool = True):
+    # 先取未落盘快照再读库：两边都有的按 ts 去重，不会漏也不会重复
+    extra = _pending_of(session, "fact") if pending else []
+    rows = _conn(_path(session)).execute(
+        "SELECT key,value,ts FROM facts WHERE session=? ORDER BY ts DESC",
         (session,)
     ).fetchall()
-    conn.close()
+    if extra:
+        rows = sorted(set(rows) | {(k, v, ts) for _, _, k, v, ts in extra}, key=lambda r: r[2], reverse=True)
     out = {}
-    for k, v in rows:
+    for k, v, _ in rows:
         out.setdefault(k, v)
     return out
 
 def add_turn(session: str, role: str, content: str):
-    _ensure()
-    conn = sqlite3.connect(DB_PATH); c = conn.cursor()
-    c.execute("INSERT INTO turns(session,role,content,ts) VALUES(?,?,?,?)",
-              (session, role, content, time.time()))
-    conn.commit(); conn.close()
-
-def last_k_turns(session: str, k: int = 6):
-    _ensure()
-    conn = sqlite3.connect(DB_PATH); c = conn.cursor()
-    rows = c.execute(
-        "SELECT role,content FROM turns WHERE session=? ORDER BY id DESC LIMIT ?",
-        (session, k)
+    _enqueue(("turn", session, role, content, time.time()))
+
+def last_k_turns(session: str, k: int = 6, pending: bool = True, after_id: int = 0):
+    """最近 k 轮 [(role, content)]，按时间正序；after_id>0 时只取该 id 之后的（摘要未覆盖的部分）"""
+    extra = _pending_of(session, "turn") if pending else []
+    rows = _conn(_path(session)).execute(
+        "SELECT role,content,ts FROM turns WHERE session=? AND id>? ORDER BY id DESC LIMIT ?",
+        (session, after_id, k)
     ).fetchall()
-    conn.close()
     rows.reverse()
-    return rows
+    if extra:
+        seen = set(rows)
+        rows += [(r, c, ts) for _, _, r, c, ts in extra if (r, c, ts) not in seen]
+        rows = rows[-k:] if k > 0 else []
+    return [(r, c) for r, c, _ in rows]
+
+
+# =========================
+# 滚动摘要（compaction）
+# =========================
+COMPACT_KEEP  = int(os.getenv("MINBIZ_COMPACT_KEEP", "4"))    # 摘要之后至少保留的原始轮次
+COMPACT_EVERY = int(os.getenv("MINBIZ_COMPACT_EVERY", "4"))   # 未覆盖轮次超过 KEEP 这么多条时折叠一次
+
+_compacting: Set[str] = set()
+_compacting_lock = threading.Lock()
+
+
+def latest_summary(session: str) -> Optional[Tuple[int, int, str]]:
+    """最新摘要 (from_id, to_id, summary)；没有返回 None"""
+    return _conn(_path(session)).execute(
+        "SELECT from_id, to_id, summary FROM summaries WHERE session=? ORDER BY to_id DESC LIMIT 1",
+        (session,)
+    ).fetchone()
+
+def save_summary(session: str, from_id: int, to_id: int, summary: str):
+    with _tx(_conn(_path(session))) as con:
+        con.execute("INSERT OR REPLACE INTO summaries(session,from_id,to_id,summary,ts) VALUES(?,?,?,?,?)",
+                    (session, from_id, to_id, summary, time.time()))
+
+def history_for_prompt(session: str, k: Optional[int] = None) -> Tuple[str, List[Tuple[str, str]]]:
+    """
+    (摘要, 摘要之后的原始轮次)。原始轮次最多 k 条（默认 KEEP + EVERY，即压缩前可能积累的上限），
+    所以无论会话多长，prompt 里的历史都有上界。
+    """
+    k = COMPACT_KEEP + COMPACT_EVERY if k is None else k
+    s = latest_summary(session)
+    return (s[2] if s else ""), last_k_turns(session, k, after_id=s[1] if s else 0)
+
+def compact_session(session: str, summarize, keep: int = COMPACT_KEEP, every: int = COMPACT_EVERY) -> bool:
+    """
+    未被摘要覆盖的（已落盘）轮次超过 keep + every 条时，把除最后 keep 条以外的折叠进摘要：
+      summarize(旧摘要, [(role, content), ...]) -> 新摘要
+    同一会话同时只跑一个；返回是否生成了新摘要。适合在回答返回后放到后台调用。
+    """
+    with _compacting_lock:
+        if session in _compacting:
+            return False
+        _compacting.add(session)
+    try:
+        prev = latest_summary(session)
+        rows = _conn(_path(session)).execute(
+            "SELECT id, role, content FROM turns WHERE session=? AND id>? ORDER BY id",
+            (session, prev[1] if prev else 0)
+        ).fetchall()
+        if len(rows) < keep + every:
+            return False
+        fold = rows[:len(rows) - keep]
+        text = summarize(prev[2] if prev else "", [(r, c) for _, r, c in fold])
+        if not text:
+            return False
+        save_summary(session, prev[0] if prev else fold[0][0], fold[-1][0], text)
+        return True
+    finally:
+        with _compacting_lock:
+            _compacting.discard(session)
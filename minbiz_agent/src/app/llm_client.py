@@ -6,77 +6,621 @@ from __future__ import annotations  # ← 必须放在文件最前（文档字
 统一的大模型调用封装：
 - chat_json：强制输出 JSON（用于 Draft/Refine）
 - chat_text：普通文本（用于最终合成）
+- chat_many：一批互不依赖的请求并发执行（有界并发、逐条时限、结果按输入顺序、部分失败逐条报告）
+- get_client / get_async_client：进程级共享客户端（brain / voice_agent / pipeline_light 都从这里取）
+  首次使用时才构造；底层一个 httpx 连接池（keep-alive），不再每次调用新建客户端、重新握手 TLS；
+  按模型取不同超时（with_options 只是浅拷贝，共用同一个连接池）
 环境变量：
   OPENAI_API_KEY            必填
   OPENAI_BASE_URL           选填（自定义网关/代理用）
   OPENAI_ORG                选填
   MINBIZ_OPENAI_MODEL       选填（不传 model 参数时的默认）
+  MINBIZ_LLM_TIMEOUT        默认单次请求超时秒数（默认 30）
+  MINBIZ_LLM_TIMEOUTS       按模型覆盖超时，如 "gpt-4o=60,gpt-4o-mini=20,whisper-1=120"
+  MINBIZ_LLM_MAX_CONN       连接池最大连接数（默认 64）
+  MINBIZ_LLM_KEEPALIVE      保持的空闲连接数（默认 32）
+  MINBIZ_LLM_KEEPALIVE_S    空闲连接保留秒数（默认 60）
+  MINBIZ_LLM_RETRIES        可重试错误的最多重试次数（默认 3；SDK 自带重试关闭，统一由 with_retry 负责）
+  MINBIZ_LLM_BACKOFF_BASE / MINBIZ_LLM_BACKOFF_MAX   抖动退避基数 / 上限秒数（默认 0.5 / 8）
+  MINBIZ_LLM_RETRY_DEADLINE 单次调用含重试的总时限秒数（默认 60）
+  MINBIZ_LLM_RETRY_RATIO    全局重试预算：重试量 / 请求量上限（默认 0.2）
+  MINBIZ_LLM_CB_FAILURES    连续失败多少次熔断（默认 5）
+  MINBIZ_LLM_CB_OPEN_S      熔断后多久放探测请求（默认 30）
+  MINBIZ_LLM_FALLBACK       降级模型，如 "gpt-4o=gpt-4o-mini"
+  MINBIZ_LLM_CACHE          chat_json / chat_text 响应缓存（默认 off；只对传了 cache=True 的调用生效）：
+                              on     先查缓存，未命中再调用并写入
+                              record 总是调用上游，并把结果写入 / 覆盖缓存
+                              replay 只读缓存，未命中抛 LLMCacheMiss（离线重放整条流水线）
+  MINBIZ_LLM_CACHE_DB       缓存库文件（默认 <项目>/data/llm_cache.db）
+  MINBIZ_LLM_CACHE_MAX_MB   缓存大小上限，超过按最近访问淘汰（默认 256）
+  MINBIZ_LLM_FANOUT_WORKERS chat_many / run_many 共享线程池大小（默认 8，也是单次 fan-out 的默认并发上限）
 """
 
-import os, json, time
-from typing import List, Dict, Any, Optional
+import os, json, hashlib, random, sqlite3, time, threading, weakref, zlib
+from pathlib import Path
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Callable, Optional, Sequence
 from dotenv import load_dotenv
 load_dotenv()  # 自动读取项目根目录 .env
 
-# 也可以改成别家 SDK；这里以 openai >= 1.0 为例
-def _openai_client():
-    from openai import OpenAI
+LLM_TIMEOUT     = float(os.getenv("MINBIZ_LLM_TIMEOUT", "30"))
+LLM_MAX_CONN    = int(os.getenv("MINBIZ_LLM_MAX_CONN", "64"))
+LLM_KEEPALIVE   = int(os.getenv("MINBIZ_LLM_KEEPALIVE", "32"))
+LLM_KEEPALIVE_S = float(os.getenv("MINBIZ_LLM_KEEPALIVE_S", "60"))
+
+def _parse_map(spec: str, cast=float) -> Dict[str, Any]:
+    """'a=1,b=2' -> {'a': cast('1'), ...}；格式不对的项打日志跳过"""
+    out = {}
+    for part in (spec or "").split(","):
+        k, _, v = part.partition("=")
+        if k.strip() and v.strip():
+            try:
+                out[k.strip()] = cast(v.strip())
+            except ValueError:
+                print(f"[LLM] bad config entry: {part!r}")
+    return out
+
+LLM_TIMEOUTS = _parse_map(os.getenv("MINBIZ_LLM_TIMEOUTS", ""))
+
+_lock = threading.Lock()
+_client = None                                       # 同步客户端（线程安全，全进程一个）
+_by_timeout: Dict[float, Any] = {}                   # 超时 -> with_options 视图
+_async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()   # 事件循环 -> 异步客户端
+
+
+def timeout_for(model: Optional[str]) -> float:
+    return LLM_TIMEOUTS.get(model or "", LLM_TIMEOUT)
+
+def _client_kwargs() -> Dict[str, Any]:
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("缺少 OPENAI_API_KEY 环境变量")
-    base_url = os.environ.get("OPENAI_BASE_URL")  # 可选
-    org = os.environ.get("OPENAI_ORG")            # 可选
-    return OpenAI(api_key=api_key, base_url=base_url, organization=org)
-
-def _retry(func, *args, **kwargs):
-    tries = kwargs.pop("_tries", 3)
-    delay = kwargs.pop("_delay", 1.0)
-    for i in range(tries):
+    return dict(api_key=api_key,
+                base_url=os.environ.get("OPENAI_BASE_URL") or None,   # 可选
+                organization=os.environ.get("OPENAI_ORG") or None,    # 可选
+                timeout=LLM_TIMEOUT,
+                max_retries=0)            # 重试由 with_retry 统一做（分类 + 预算 + 熔断），避免两层叠加
+
+def _http_client(async_: bool = False):
+    """调好连接池的 httpx 客户端；没有 httpx（或 SDK 太旧）时返回 None，用 SDK 默认"""
+    try:
+        import httpx
+        limits = httpx.Limits(max_connections=LLM_MAX_CONN, max_keepalive_connections=LLM_KEEPALIVE,
+                              keepalive_expiry=LLM_KEEPALIVE_S)
+    except Exception:
+        return None
+    try:   # openai>=1.17 提供带 SDK 默认设置（重定向、超时）的 httpx 子类
+        from openai import DefaultAsyncHttpxClient, DefaultHttpxClient
+        return (DefaultAsyncHttpxClient if async_ else DefaultHttpxClient)(limits=limits)
+    except ImportError:
+        return (httpx.AsyncClient if async_ else httpx.Client)(limits=limits, timeout=LLM_TIMEOUT)
+
+def get_client(model: Optional[str] = None, timeout: Optional[float] = None):
+    """进程级共享的 OpenAI 客户端；timeout 不传时按 model 取（MINBIZ_LLM_TIMEOUTS）"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from openai import OpenAI
+                _client = OpenAI(http_client=_http_client(), **_client_kwargs())
+    t = timeout_for(model) if timeout is None else timeout
+    if t == LLM_TIMEOUT:
+        return _client
+    c = _by_timeout.get(t)
+    if c is None:
+        c = _by_timeout[t] = _client.with_options(timeout=t)
+    return c
+
+def get_async_client(model: Optional[str] = None, timeout: Optional[float] = None):
+    """
+    AsyncOpenAI 客户端；httpx 的异步连接池绑定在事件循环上，所以每个事件循环一个
+    （uvicorn 一个 worker 就是一个）。须在事件循环里调用。
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    c = _async_clients.get(loop)
+    if c is None:
+        with _lock:
+            c = _async_clients.get(loop)
+            if c is None:
+                from openai import AsyncOpenAI
+                c = _async_clients[loop] = AsyncOpenAI(http_client=_http_client(async_=True), **_client_kwargs())
+    t = timeout_for(model) if timeout is None else timeout
+    return c if t == LLM_TIMEOUT else c.with_options(timeout=t)
+
+def close_clients():
+    """关闭同步客户端的连接池（进程退出 / 测试用）；异步客户端随事件循环回收"""
+    global _client
+    with _lock:
+        if _client is not None:
+            try:
+                _client.close()
+            except Exception:
+                pass
+        _client = None
+        _by_timeout.clear()
+
+# 兼容旧名字
+def _openai_client():
+    return get_client()
+
+# =========================
+# 重试 / 限流 / 熔断
+# =========================
+class CircuitOpenError(RuntimeError):
+    """熔断打开且没有可降级的模型：直接失败，不再打上游"""
+
+
+_RETRYABLE = {"rate_limit", "timeout", "network", "server"}
+
+def classify_error(e: BaseException) -> str:
+    """
+    rate_limit（429） / timeout / network / server（5xx、408、409）可重试；
+    fatal（其余 4xx、额度用尽、本地错误）重试也没用，直接抛出
+    """
+    code = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    if code == 429:
+        return "fatal" if getattr(e, "code", None) == "insufficient_quota" else "rate_limit"
+    if code in (408, 409) or (code and code >= 500):
+        return "server"
+    if code and 400 <= code < 500:
+        return "fatal"
+    name = type(e).__name__
+    if "Timeout" in name or isinstance(e, TimeoutError):
+        return "timeout"
+    if "Connection" in name or isinstance(e, ConnectionError):
+        return "network"
+    return "fatal"
+
+def _retry_after(e: BaseException) -> Optional[float]:
+    """读响应头 retry-after-ms / retry-after（秒数或 HTTP 日期）；没有返回 None"""
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        ms = headers.get("retry-after-ms")
+        if ms:
+            return float(ms) / 1000.0
+        v = headers.get("retry-after")
+        if not v:
+            return None
         try:
-            return func(*args, **kwargs)
-        except Exception:
-            if i == tries - 1:
+            return float(v)
+        except ValueError:
+            from email.utils import parsedate_to_datetime
+            return max(0.0, parsedate_to_datetime(v).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class _RetryBudget:
+    """
+    全局重试预算（令牌桶）：每个请求存入 ratio 个令牌，每次重试取走 1 个；另外每秒保底补 min_per_s 个。
+    上游整体变慢 / 限流时重试总量最多是请求量的 ratio 倍，不会把故障放大成重试风暴。
+    """
+
+    def __init__(self, ratio: float, min_per_s: float, cap: float):
+        self.ratio, self.min_per_s, self.cap = ratio, min_per_s, cap
+        self.tokens = cap
+        self.t = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.cap, self.tokens + (now - self.t) * self.min_per_s)
+        self.t = now
+
+    def deposit(self):
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.cap, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+
+class _Breaker:
+    """
+    按模型的熔断器：连续 N 次可重试类失败 -> open（快速失败 / 降级）；open_s 秒后 half-open，
+    放一个探测请求，成功 -> closed，失败 -> 再 open。fatal 错误（如 400）不计入。
+    """
+
+    def __init__(self, failures: int, open_s: float):
+        self.failures, self.open_s = failures, open_s
+        self.state, self.fails, self.opened_at, self.probing = "closed", 0, 0.0, False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.open_s:
+                self.state = "half_open"
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.state, self.fails, self.probing = "closed", 0, False
+
+    def failure(self) -> bool:
+        """记一次失败；返回这次是否把熔断器打开"""
+        with self.lock:
+            self.fails += 1
+            self.probing = False
+            if self.state == "half_open" or self.fails >= self.failures:
+                opened = self.state != "open"
+                self.state, self.opened_at = "open", time.monotonic()
+                return opened
+            return False
+
+
+LLM_RETRIES        = int(os.getenv("MINBIZ_LLM_RETRIES", "3"))             # 单次调用最多重试次数
+LLM_BACKOFF_BASE   = float(os.getenv("MINBIZ_LLM_BACKOFF_BASE", "0.5"))    # 退避基数秒，按 2^i 增长、全抖动
+LLM_BACKOFF_MAX    = float(os.getenv("MINBIZ_LLM_BACKOFF_MAX", "8"))
+LLM_RETRY_DEADLINE = float(os.getenv("MINBIZ_LLM_RETRY_DEADLINE", "60"))   # 含重试的总耗时上限
+LLM_RETRY_RATIO    = float(os.getenv("MINBIZ_LLM_RETRY_RATIO", "0.2"))     # 重试预算：请求量的比例
+LLM_CB_FAILURES    = int(os.getenv("MINBIZ_LLM_CB_FAILURES", "5"))
+LLM_CB_OPEN_S      = float(os.getenv("MINBIZ_LLM_CB_OPEN_S", "30"))
+# 熔断 / 重试用尽时的降级模型，如 "gpt-4o=gpt-4o-mini,gpt-4.1=gpt-4.1-mini"
+LLM_FALLBACK       = _parse_map(os.getenv("MINBIZ_LLM_FALLBACK", ""), str)
+
+_budget = _RetryBudget(LLM_RETRY_RATIO, min_per_s=1.0, cap=max(10.0, LLM_RETRY_RATIO * 100))
+_breakers: Dict[str, _Breaker] = {}
+_stats: Dict[str, int] = {}
+_stats_lock = threading.Lock()
+
+
+def _count(key: str, n: int = 1):
+    with _stats_lock:
+        _stats[key] = _stats.get(key, 0) + n
+
+def _breaker(model: str) -> _Breaker:
+    b = _breakers.get(model)
+    if b is None:
+        with _lock:
+            b = _breakers.setdefault(model, _Breaker(LLM_CB_FAILURES, LLM_CB_OPEN_S))
+    return b
+
+def llm_stats() -> Dict[str, Any]:
+    """计数器快照：请求 / 成功 / 各类错误 / 重试 / 预算耗尽 / 熔断 / 降级，以及各模型熔断器状态"""
+    with _stats_lock:
+        out: Dict[str, Any] = dict(_stats)
+    out["breakers"] = {m: b.state for m, b in list(_breakers.items())}
+    out["retry_tokens"] = round(_budget.tokens, 2)
+    return out
+
+
+def _admit(model: str) -> _Breaker:
+    br = _breaker(model)
+    if not br.allow():
+        _count("short_circuited")
+        raise CircuitOpenError(f"circuit open for {model}")
+    _budget.deposit()
+    return br
+
+def _backoff(br: _Breaker, model: str, e: Exception, i: int, deadline: float) -> Optional[float]:
+    """第 i 次尝试失败后：返回应等待的秒数；None = 不再重试（调用方重新抛出 e）"""
+    kind = classify_error(e)
+    _count(f"errors.{kind}")
+    if kind not in _RETRYABLE:
+        if br.state == "half_open":
+            br.success()           # 探测请求到达了上游，只是请求本身有问题
+        return None
+    if br.failure():
+        _count("breaker_opened")
+        print(f"[LLM] circuit opened for {model} ({kind}: {e})")
+    if br.state == "open" or i == LLM_RETRIES:
+        return None
+    wait = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** i)))   # full jitter
+    ra = _retry_after(e)
+    if ra is not None:
+        wait = max(wait, ra)
+    if time.monotonic() + wait > deadline:
+        _count("deadline_exceeded")
+        return None
+    if not _budget.withdraw():
+        _count("budget_exhausted")
+        return None
+    _count("retries")
+    return wait
+
+def _attempt(call, model: str):
+    """在 model 上调用，带分类重试；返回结果或抛出最后一个异常"""
+    br = _admit(model)
+    deadline = time.monotonic() + LLM_RETRY_DEADLINE
+    for i in range(LLM_RETRIES + 1):
+        _count("requests")
+        try:
+            r = call(model)
+        except Exception as e:
+            wait = _backoff(br, model, e, i, deadline)
+            if wait is None:
+                raise
+            time.sleep(wait)
+            continue
+        br.success()
+        _count("successes")
+        return r
+    raise RuntimeError("unreachable")
+
+async def _aattempt(acall, model: str):
+    """_attempt 的异步版本：退避用 asyncio.sleep，不占事件循环"""
+    import asyncio
+    br = _admit(model)
+    deadline = time.monotonic() + LLM_RETRY_DEADLINE
+    for i in range(LLM_RETRIES + 1):
+        _count("requests")
+        try:
+            r = await acall(model)
+        except Exception as e:
+            wait = _backoff(br, model, e, i, deadline)
+            if wait is None:
                 raise
-            time.sleep(delay)
-            delay = min(delay * 2.0, 8.0)
+            await asyncio.sleep(wait)
+            continue
+        br.success()
+        _count("successes")
+        return r
+    raise RuntimeError("unreachable")
+
+def _fallback_for(model: str, e: Exception) -> Optional[str]:
+    fb = LLM_FALLBACK.get(model)
+    if not fb or not (isinstance(e, CircuitOpenError) or classify_error(e) in _RETRYABLE):
+        return None
+    _count("fallbacks")
+    print(f"[LLM] {model} unavailable ({type(e).__name__}), falling back to {fb}")
+    return fb
 
-def chat_json(messages: List[Dict[str, str]], model: Optional[str] = None, temperature: float = 0.2) -> Dict[str, Any]:
+def with_retry(call, model: str):
     """
-    让模型以 JSON 对象形式返回（不含 markdown 代码块）。
+    call(model) -> 响应。可重试错误按抖动指数退避重试（尊重 Retry-After，受全局重试预算和总时限约束）；
+    熔断打开或重试用尽时，若配置了降级模型（MINBIZ_LLM_FALLBACK）就换它再来一次。
     """
-    client = _openai_client()
-    model = model or os.environ.get("MINBIZ_OPENAI_MODEL", "gpt-4o-mini")
+    try:
+        return _attempt(call, model)
+    except Exception as e:
+        fb = _fallback_for(model, e)
+        if fb is None:
+            raise
+        return _attempt(call, fb)
 
-    def _call():
-        resp = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            response_format={"type": "json_object"},
-        )
-        return resp
-
-    resp = _retry(_call)
-    content = resp.choices[0].message.content
+async def awith_retry(acall, model: str):
+    """with_retry 的异步版本：acall(model) 是协程函数；熔断器 / 重试预算 / 计数与同步版共用"""
     try:
-        return json.loads(content)
+        return await _aattempt(acall, model)
     except Exception as e:
-        raise ValueError(f"期望 JSON 输出，但解析失败：{e}\n原始输出：{content!r}")
+        fb = _fallback_for(model, e)
+        if fb is None:
+            raise
+        return await _aattempt(acall, fb)
+
+def chat_completion(model: str, timeout: Optional[float] = None, **kwargs):
+    """chat.completions.create 的容错版本（共享客户端 + 重试 / 熔断 / 降级）；stream=True 时只对建立连接重试"""
+    return with_retry(lambda m: get_client(m, timeout).chat.completions.create(model=m, **kwargs), model)
+
+async def achat_completion(model: str, timeout: Optional[float] = None, **kwargs):
+    """chat_completion 的异步版本（AsyncOpenAI，等待上游时不阻塞事件循环）"""
+    return await awith_retry(lambda m: get_async_client(m, timeout).chat.completions.create(model=m, **kwargs), model)
+
+# =========================
+# 响应缓存（内容寻址，opt-in）：评测 / 合成数据 / 开发重跑不再为相同的请求重复付费
+# =========================
+class LLMCacheMiss(LookupError):
+    """replay 模式下缓存里没有这个请求"""
+
+
+LLM_CACHE        = os.getenv("MINBIZ_LLM_CACHE", "off").lower()
+LLM_CACHE_DB     = os.getenv("MINBIZ_LLM_CACHE_DB", str(Path(__file__).resolve().parents[2] / "data" / "llm_cache.db"))
+LLM_CACHE_MAX_MB = float(os.getenv("MINBIZ_LLM_CACHE_MAX_MB", "256"))
+
+_cache_local = threading.local()
+_cache_puts = 0
+
+
+def cache_key(model: str, messages: List[Dict[str, str]], temperature: float,
+              response_format: Optional[Dict[str, Any]] = None) -> str:
+    """sha256(规范化 JSON：model, messages, temperature, response_format)"""
+    raw = json.dumps([model, messages, round(float(temperature), 4), response_format],
+                     ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _cache_conn() -> sqlite3.Connection:
+    con = getattr(_cache_local, "con", None)
+    if con is None:
+        Path(LLM_CACHE_DB).parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(LLM_CACHE_DB, timeout=30, isolation_level=None)
+        con.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        CREATE TABLE IF NOT EXISTS responses (
+          k TEXT PRIMARY KEY,
+          model TEXT NOT NULL,
+          content BLOB NOT NULL,      -- zlib 压缩的响应文本
+          size INTEGER NOT NULL,
+          ts REAL NOT NULL,
+          atime REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_responses_atime ON responses(atime);
+        """)
+        _cache_local.con = con
+    return con
+
+def _cache_get(k: str) -> Optional[str]:
+    con = _cache_conn()
+    row = con.execute("SELECT content FROM responses WHERE k=?", (k,)).fetchone()
+    if row is None:
+        return None
+    con.execute("UPDATE responses SET atime=? WHERE k=?", (time.time(), k))
+    return zlib.decompress(row[0]).decode("utf-8")
+
+def _cache_put(k: str, model: str, content: str):
+    global _cache_puts
+    blob = zlib.compress(content.encode("utf-8"), 6)
+    now = time.time()
+    _cache_conn().execute(
+        "INSERT OR REPLACE INTO responses(k,model,content,size,ts,atime) VALUES(?,?,?,?,?,?)",
+        (k, model, blob, len(blob), now, now))
+    _cache_puts += 1
+    if _cache_puts % 32 == 0:
+        cache_evict()
 
-def chat_text(messages: List[Dict[str, str]], model: Optional[str] = None, temperature: float = 0.3) -> str:
+def cache_evict(max_mb: Optional[float] = None) -> int:
+    """按最近访问时间淘汰到 max_mb 以内；返回删除条数"""
+    limit = int((LLM_CACHE_MAX_MB if max_mb is None else max_mb) * (1 << 20))
+    con = _cache_conn()
+    total = con.execute("SELECT COALESCE(SUM(size),0) FROM responses").fetchone()[0]
+    n = 0
+    if total > limit:
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            for k, size in con.execute("SELECT k, size FROM responses ORDER BY atime").fetchall():
+                if total <= limit:
+                    break
+                con.execute("DELETE FROM responses WHERE k=?", (k,))
+                total -= size
+                n += 1
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+    return n
+
+def _cached_content(model: str, messages: List[Dict[str, str]], temperature: float,
+                    response_format: Optional[Dict[str, Any]], cache: bool, check=None) -> str:
+    """
+    cache=True 时按 MINBIZ_LLM_CACHE 模式取响应文本；cache=False 直接调用上游（不读也不写缓存）。
+    check(content) 抛异常的响应不写入缓存（如 JSON 解析失败），异常照常抛给调用方。
+    """
+    mode = LLM_CACHE if cache else "off"
+    kwargs = {"response_format": response_format} if response_format else {}
+    if mode not in ("on", "record", "replay"):
+        resp = chat_completion(model, messages=messages, temperature=temperature, **kwargs)
+        return resp.choices[0].message.content or ""
+    k = cache_key(model, messages, temperature, response_format)
+    if mode != "record":
+        hit = _cache_get(k)
+        if hit is not None:
+            _count("cache_hits")
+            return hit
+        if mode == "replay":
+            _count("cache_misses")
+            raise LLMCacheMiss(f"no cached response for {model} ({k[:12]})")
+    _count("cache_misses")
+    resp = chat_completion(model, messages=messages, temperature=temperature, **kwargs)
+    content = resp.choices[0].message.content or ""
+    if check is not None:
+        check(content)
+    _cache_put(k, model, content)
+    return content
+
+def chat_json(messages: List[Dict[str, str]], model: Optional[str] = None, temperature: float = 0.2,
+              cache: bool = False) -> Dict[str, Any]:
+    """
+    让模型以 JSON 对象形式返回（不含 markdown 代码块）。
+    cache=True 时走响应缓存（MINBIZ_LLM_CACHE）；只给同样输入可以复用同一输出的调用打开，
+    重试 / 重新生成类调用不要打开，否则拿回的还是上次那份。
+    """
+    model = model or os.environ.get("MINBIZ_OPENAI_MODEL", "gpt-4o-mini")
+    def _parse(content: str) -> Dict[str, Any]:
+        try:
+            return json.loads(content)
+        except Exception as e:
+            raise ValueError(f"期望 JSON 输出，但解析失败：{e}\n原始输出：{content!r}")
+
+    return _parse(_cached_content(model, messages, temperature, {"type": "json_object"}, cache, check=_parse))
+
+def chat_text(messages: List[Dict[str, str]], model: Optional[str] = None, temperature: float = 0.3,
+              cache: bool = False) -> str:
     """
     普通文本回答。
+    cache=True 时走响应缓存（MINBIZ_LLM_CACHE），约定同 chat_json。
     """
-    client = _openai_client()
     model = model or os.environ.get("MINBIZ_OPENAI_MODEL", "gpt-4o")
+    return _cached_content(model, messages, temperature, None, cache).strip()
+
+
+# =========================
+# 并发 fan-out
+# =========================
+LLM_FANOUT_WORKERS = int(os.getenv("MINBIZ_LLM_FANOUT_WORKERS", "8"))
+
+_fanout_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _fanout() -> ThreadPoolExecutor:
+    global _fanout_pool
+    if _fanout_pool is None:
+        with _lock:
+            if _fanout_pool is None:
+                _fanout_pool = ThreadPoolExecutor(max_workers=LLM_FANOUT_WORKERS, thread_name_prefix="llm-fanout")
+    return _fanout_pool
 
-    def _call():
-        resp = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-        )
-        return resp
+def _timed(fn):
+    t0 = time.perf_counter()
+    v = fn()
+    return v, time.perf_counter() - t0
+
+def run_many(calls: Sequence[Callable[[], Any]], max_parallel: Optional[int] = None,
+             timeout: Optional[float] = None, timeouts: Optional[Sequence[Optional[float]]] = None) -> List[Dict[str, Any]]:
+    """
+    并发执行一组无参调用（共享线程池，同时在跑的最多 max_parallel 个），结果与输入同序：
+      [{"ok": bool, "value": 结果或 None, "error": None 或 "类型: 信息", "kind": 错误分类, "ms": 耗时}]
+    timeout / timeouts[i]：单条时限（秒，从提交算起）；超时的记为 kind="deadline"，线程在后台自然结束、结果丢弃。
+    单条失败不影响其他条。不要在 run_many 的任务里再调用 run_many（共享池可能被占满）。
+    """
+    n = len(calls)
+    par = max(1, min(max_parallel or LLM_FANOUT_WORKERS, LLM_FANOUT_WORKERS))
+    lim = [(timeouts[i] if timeouts and timeouts[i] is not None else timeout) for i in range(n)]
+    out: List[Optional[Dict[str, Any]]] = [None] * n
+    running: Dict[Any, Any] = {}          # future -> (i, 提交时刻)
+    nxt = 0
+    while nxt < n or running:
+        while nxt < n and len(running) < par:
+            running[_fanout().submit(_timed, calls[nxt])] = (nxt, time.perf_counter())
+            nxt += 1
+        deadlines = [t0 + lim[i] for i, t0 in running.values() if lim[i] is not None]
+        wait_s = max(0.0, min(deadlines) - time.perf_counter()) if deadlines else None
+        done, _ = wait(list(running), timeout=wait_s, return_when=FIRST_COMPLETED)
+        now = time.perf_counter()
+        for fut, (i, t0) in list(running.items()):
+            if fut in done:
+                try:
+                    v, dt = fut.result()
+                    out[i] = {"ok": True, "value": v, "error": None, "kind": None, "ms": round(dt * 1000, 1)}
+                except Exception as e:
+                    out[i] = {"ok": False, "value": None, "error": f"{type(e).__name__}: {e}",
+                              "kind": classify_error(e), "ms": round((now - t0) * 1000, 1)}
+            elif lim[i] is not None and now >= t0 + lim[i]:
+                out[i] = {"ok": False, "value": None, "error": f"deadline {lim[i]}s exceeded",
+                          "kind": "deadline", "ms": round((now - t0) * 1000, 1)}
+            else:
+                continue
+            del running[fut]
+    failed = sum(1 for r in out if not r["ok"])
+    if failed:
+        _count("fanout_failed", failed)
+        print(f"[LLM] run_many: {failed}/{n} failed")
+    return out  # type: ignore[return-value]
+
+def chat_many(requests: Sequence[Dict[str, Any]], max_parallel: Optional[int] = None,
+              timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    requests[i]：{"messages": [...], "model"?, "temperature"?, "json"?: bool, "cache"?: bool, "timeout"?: 秒}
+      json=True 走 chat_json（value 为 dict），否则走 chat_text（value 为 str）
+    返回与 requests 同序的结果（格式见 run_many）；共享客户端 / 重试 / 熔断 / 响应缓存照常生效。
+    """
+    def _one(r: Dict[str, Any]) -> Callable[[], Any]:
+        fn = chat_json if r.get("json") else chat_text
+        kw = {k: r[k] for k in ("model", "temperature", "cache") if k in r}
+        return lambda: fn(r["messages"], **kw)
 
-    resp = _retry(_call)
-    return resp.choices[0].message.content.strip()
+    return run_many([_one(r) for r in requests], max_parallel=max_parallel, timeout=timeout,
+                    timeouts=[r.get("timeout") for r in requests])
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+回答编排：小型阶段 DAG 执行器（brain.answer / voice_agent 共用）
+- 每个 Stage 声明依赖；依赖就绪即提交到共享线程池，互不依赖的阶段并发执行，
+  总耗时趋近最慢的那条依赖链，而不是所有阶段之和
+- 每个阶段有自己的 deadline（从该阶段真正开始执行算起，线程池里排队的时间不算）：
+  超时 / 抛异常时用 fallback 顶上，下游照常继续；超时的线程无法强杀，会在后台自然结束，结果丢弃
+- llm=True 的阶段（一次 LLM 调用，动辄几十秒）走独立线程池，占满了也不会饿死画像/历史/检索这些短阶段
+- 每个阶段上报耗时与状态（ok / timeout / error）
+- background()：不在关键路径上的收尾工作（如记录对话轮次），不阻塞响应；
+  background_slow()：慢的收尾工作（如调 LLM 压缩历史），单独排队，不拖住轮次写入
+环境变量：
+  MINBIZ_PIPELINE_WORKERS      短阶段线程池大小（默认 16）
+  MINBIZ_PIPELINE_LLM_WORKERS  LLM 阶段线程池大小（默认 16）
+"""
+import os, time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+PIPELINE_WORKERS = int(os.getenv("MINBIZ_PIPELINE_WORKERS", "16"))
+PIPELINE_LLM_WORKERS = int(os.getenv("MINBIZ_PIPELINE_LLM_WORKERS", "16"))
+
+_pool = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="stage")
+_llm_pool = ThreadPoolExecutor(max_workers=PIPELINE_LLM_WORKERS, thread_name_prefix="stage-llm")
+_bg_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="stage-bg")
+_slow_bg_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stage-bg-slow")
+
+_POLL_SEC = 0.02   # 有阶段还在排队（尚未开始计时）时，主循环多久看一次
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: Callable[..., Any]          # 以依赖阶段的结果为关键字参数调用：fn(**{dep: result})
+    deps: Tuple[str, ...] = ()
+    timeout: float = 5.0            # 秒
+    fallback: Any = None            # 超时/异常时的结果；可调用则调用 fallback() 生成（避免共享可变对象）
+    llm: bool = False               # True：走独立的 LLM 线程池
+
+
+def _fallback(s: Stage):
+    return s.fallback() if callable(s.fallback) else s.fallback
+
+def _timed(fn, kwargs, started: List[float]):
+    """在 worker 里执行；开始时刻写进 started，主循环据此计算 deadline"""
+    started.append(time.perf_counter())
+    v = fn(**kwargs)
+    return v, time.perf_counter() - started[0]
+
+
+def run_stages(stages: Sequence[Stage]) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    执行阶段 DAG，返回 (results, timings)。
+      results[name] = 阶段结果（或 fallback）
+      timings[name] = {"ms": 耗时, "status": "ok"|"timeout"|"error"[, "error": "..."]}
+    不能在阶段函数内部再调用 run_stages（共享线程池可能被占满）。
+    """
+    names = {s.name for s in stages}
+    for s in stages:
+        for d in s.deps:
+            if d not in names:
+                raise ValueError(f"stage {s.name!r} depends on unknown stage {d!r}")
+
+    results: Dict[str, Any] = {}
+    timings: Dict[str, Dict[str, Any]] = {}
+    pending: List[Stage] = list(stages)
+    running: Dict[Future, Tuple[Stage, List[float]]] = {}
+
+    while pending or running:
+        for s in [s for s in pending if all(d in results for d in s.deps)]:
+            pending.remove(s)
+            kwargs = {d: results[d] for d in s.deps}
+            started: List[float] = []
+            running[(_llm_pool if s.llm else _pool).submit(_timed, s.fn, kwargs, started)] = (s, started)
+        if not running:
+            raise ValueError("stage graph has a cycle: " + ", ".join(s.name for s in pending))
+
+        now = time.perf_counter()
+        deadlines = [st[0] + s.timeout for s, st in running.values() if st]
+        if len(deadlines) < len(running):           # 还有阶段在排队：开始时刻未知，定期回来看
+            deadlines.append(now + _POLL_SEC)
+        done, _ = wait(list(running), timeout=max(0.0, min(deadlines) - now),
+                       return_when=FIRST_COMPLETED)
+        now = time.perf_counter()
+        for fut, (s, st) in list(running.items()):
+            t0 = st[0] if st else now
+            if fut in done:
+                try:
+                    results[s.name], dt = fut.result()
+                    timings[s.name] = {"ms": round(dt * 1000, 1), "status": "ok"}
+                except Exception as e:
+                    results[s.name] = _fallback(s)
+                    timings[s.name] = {"ms": round((now - t0) * 1000, 1), "status": "error",
+                                       "error": f"{type(e).__name__}: {e}"}
+                    print(f"[PIPE] stage {s.name} error ->", e)
+            elif st and now >= t0 + s.timeout:
+                results[s.name] = _fallback(s)
+                timings[s.name] = {"ms": round((now - t0) * 1000, 1), "status": "timeout"}
+                print(f"[PIPE] stage {s.name} timeout after {s.timeout}s, using fallback")
+            else:
+                continue
+            del running[fut]
+    return results, timings
+
+
+def _run_bg(fn, args, kwargs):
+    try:
+        fn(*args, **kwargs)
+    except Exception as e:
+        print(f"[PIPE] background {getattr(fn, '__name__', fn)} error ->", e)
+
+def _done_future() -> Future:
+    f: Future = Future()
+    f.set_result(None)
+    return f
+
+def background(fn: Callable[..., Any], *args, **kwargs) -> Future:
+    """
+    提交关键路径之外的收尾工作；异常只打日志。进程正常退出时会等队列里的任务跑完。
+    解释器已在退出（线程池不再接任务）时就地同步执行，保证轮次照样落盘。
+    """
+    try:
+        return _bg_pool.submit(_run_bg, fn, args, kwargs)
+    except RuntimeError:
+        _run_bg(fn, args, kwargs)
+        return _done_future()
+
+def background_slow(fn: Callable[..., Any], *args, **kwargs) -> Future:
+    """
+    同 background()，但走单独的队列，给调 LLM 之类的慢任务用，不占 background() 的 worker。
+    解释器已在退出时直接丢弃（下一轮对话会再触发）。
+    """
+    try:
+        return _slow_bg_pool.submit(_run_bg, fn, args, kwargs)
+    except RuntimeError:
+        return _done_future()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+按 token 预算打包 prompt 上下文（brain / voice_agent 共用）：
+1) 同一来源的相邻命中若首尾重叠（切块时留的 overlap_chars 重叠），拼成一段，重叠部分只出现一次；
+   相邻判断用整段正文（text），不用 snippet 窗口（窗口太短，几乎碰不到切块重叠区）；
+   合并后的段落用拼接出的连续正文，未合并的命中仍用 snippet
+2) MMR 选段：相关度（score 按候选集 min-max 归一到 0..1，兼容全为负数的 cross-encoder logits）
+   减去与已选段落的最大相似度（字符二元组 Jaccard），
+   相似度超过阈值的近重复直接丢弃
+3) 按 token 数装箱直到预算用完；第一段就超预算时截断放入，保证至少有一段证据
+环境变量：
+  MINBIZ_CTX_BUDGET_TOKENS  上下文 token 预算（默认 1200）
+  MINBIZ_CTX_MMR_LAMBDA     MMR 中相关度权重（默认 0.7，越小越偏向多样性）
+  MINBIZ_CTX_DUP_SIM        近重复阈值（默认 0.8）
+"""
+import os, re
+from typing import Any, Dict, List, Optional, Set
+
+# 可选：tiktoken 精确计数；没有就用估算（汉字≈1 token，其余≈4 字符 1 token）
+try:
+    import tiktoken
+    _ENC = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _ENC = None
+
+CTX_BUDGET_TOKENS = int(os.getenv("MINBIZ_CTX_BUDGET_TOKENS", "1200"))
+CTX_MMR_LAMBDA    = float(os.getenv("MINBIZ_CTX_MMR_LAMBDA", "0.7"))
+CTX_DUP_SIM       = float(os.getenv("MINBIZ_CTX_DUP_SIM", "0.8"))
+
+MIN_OVERLAP = 16      # 首尾重叠至少这么多字符才认为是相邻切块
+MAX_OVERLAP = 400     # 只在尾部这么长的范围里找重叠
+ELLIPSIS = "…"
+
+_CJK_PTN = re.compile("[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3000-\u303f\uff00-\uffef]")
+
+
+def count_tokens(s: str) -> int:
+    if not s:
+        return 0
+    if _ENC is not None:
+        return len(_ENC.encode(s, disallowed_special=()))
+    cjk = len(_CJK_PTN.findall(s))
+    return cjk + (len(s) - cjk + 3) // 4
+
+def truncate_tokens(s: str, budget: int) -> str:
+    """截到不超过 budget 个 token（末尾补省略号）"""
+    if count_tokens(s) <= budget:
+        return s
+    if _ENC is not None:
+        ids = _ENC.encode(s, disallowed_special=())
+        return _ENC.decode(ids[:max(0, budget - 1)]) + ELLIPSIS
+    lo, hi = 0, len(s)
+    while lo < hi:                      # 二分找最长可放下的前缀
+        mid = (lo + hi + 1) // 2
+        if count_tokens(s[:mid]) + 1 <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return s[:lo] + ELLIPSIS
+
+
+def _overlap(a: str, b: str) -> int:
+    """a 的后缀与 b 的前缀最长重叠长度（不足 MIN_OVERLAP 返回 0）"""
+    if len(a) < MIN_OVERLAP or len(b) < MIN_OVERLAP:
+        return 0
+    head = b[:MIN_OVERLAP]
+    i = a.find(head, max(0, len(a) - MAX_OVERLAP))
+    while i != -1:
+        k = len(a) - i
+        if b.startswith(a[i:]) and k < len(b):
+            return k
+        i = a.find(head, i + 1)
+    return 0
+
+def _bigrams(s: str) -> Set[str]:
+    s = re.sub(r"\s+", "", s.lower())
+    return {s[i:i + 2] for i in range(len(s) - 1)} or {s}
+
+def _sim(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def _text_of(h: Dict[str, Any]) -> str:
+    return (h.get("snippet") or h.get("text") or "").strip()
+
+def merge_neighbours(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    同一 source 下正文首尾重叠或互相包含的命中合并为一段：
+    text 为拼接出的连续正文（未合并的保持 snippet / text），score、meta / highlight 取分数最高的那条，
+    merged 记录所有 chunk_id。
+    """
+    groups: List[Dict[str, Any]] = []
+    for h in hits:
+        t = _text_of(h)
+        if not t:
+            continue
+        full = (h.get("text") or "").strip() or t
+        src = (h.get("meta") or {}).get("source")
+        cid = (h.get("meta") or {}).get("chunk_id")
+        g = {**h, "text": t, "_full": full, "score": float(h.get("score") or 0.0), "merged": [cid]}
+        g.pop("snippet", None)
+        for other in groups:
+            if (other.get("meta") or {}).get("source") != src:
+                continue
+            a, b = other["_full"].strip(ELLIPSIS), full.strip(ELLIPSIS)
+            if b in a:
+                joined = a
+            elif a in b:
+                joined = b
+            elif _overlap(a, b):
+                joined = a + b[_overlap(a, b):]
+            elif _overlap(b, a):
+                joined = b + a[_overlap(b, a):]
+            else:
+                continue
+            if g["score"] > other["score"]:     # meta / highlight 跟随分数更高的那条
+                other.update({k: v for k, v in g.items() if k not in ("text", "_full", "merged")})
+            other["text"] = other["_full"] = joined
+            other["merged"].append(cid)
+            break
+        else:
+            groups.append(g)
+    for g in groups:
+        g.pop("_full", None)
+    return groups
+
+
+def pack_context(hits: List[Dict[str, Any]], budget_tokens: Optional[int] = None,
+                 mmr_lambda: float = CTX_MMR_LAMBDA, dup_sim: float = CTX_DUP_SIM) -> List[Dict[str, Any]]:
+    """
+    hits：[{'text','score','meta':{source,chunk_id,...}}]（可带 'snippet' / 'highlight'，有 snippet 时用 snippet）
+    返回按 MMR 选中顺序排列的段落：[{'text','score','meta','merged':[chunk_id...],'tokens', ...}]
+    """
+    budget = CTX_BUDGET_TOKENS if budget_tokens is None else budget_tokens
+    cands = merge_neighbours(hits or [])
+    if not cands or budget <= 0:
+        return []
+    lo = min(c["score"] for c in cands)
+    span = max(c["score"] for c in cands) - lo
+    rel = [(c["score"] - lo) / span if span > 0 else 1.0 for c in cands]
+    feats = [_bigrams(c["text"]) for c in cands]
+
+    picked: List[int] = []
+    out: List[Dict[str, Any]] = []
+    used = 0
+    left = list(range(len(cands)))
+    while left and used < budget:
+        best, best_val = None, None
+        for i in list(left):
+            red = max((_sim(feats[i], feats[j]) for j in picked), default=0.0)
+            if red >= dup_sim:              # 近重复：直接丢弃
+                left.remove(i)
+                continue
+            val = mmr_lambda * rel[i] - (1 - mmr_lambda) * red
+            if best_val is None or val > best_val:
+                best, best_val = i, val
+        if best is None:
+            break
+        left.remove(best)
+        c = cands[best]
+        n = count_tokens(c["text"])
+        if used + n > budget:
+            if out:                         # 放不下就跳过，看后面更短的能否装进去
+                continue
+            c = dict(c, text=truncate_tokens(c["text"], budget))
+            n = count_tokens(c["text"])
+        picked.append(best)
+        out.append(dict(c, tokens=n))
+        used += n
+    return out
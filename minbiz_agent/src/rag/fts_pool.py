@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+FTS 库只读连接池（检索热路径用）：
+- 每个线程每个 db 一条长连接，免去每次查询的 open / schema 解析 / 页缓存预热
+- mode=ro + query_only，读端永远不会误写或抢写锁
+- mmap + 大 page cache，多线程读者共享 OS 页缓存
+- sqlite3 按 SQL 文本缓存预编译语句（cached_statements），同一条 SQL 不会重复 prepare
+环境变量：
+  MINBIZ_FTS_MMAP_MB   mmap 大小（默认 256）
+  MINBIZ_FTS_CACHE_MB  每连接 page cache（默认 32）
+"""
+import os, sqlite3, threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+FTS_MMAP_MB  = int(os.getenv("MINBIZ_FTS_MMAP_MB", "256"))
+FTS_CACHE_MB = int(os.getenv("MINBIZ_FTS_CACHE_MB", "32"))
+
+_local = threading.local()
+
+
+class Reader:
+    """一条池化的只读连接；state 供调用方缓存与该连接绑定的派生信息（如当前代表名）。"""
+
+    def __init__(self, db_path: str):
+        p = Path(db_path).resolve()
+        st = p.stat()
+        self.ident = (st.st_dev, st.st_ino)
+        self.conn = sqlite3.connect(f"{p.as_uri()}?mode=ro", uri=True, cached_statements=256)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(f"""
+        PRAGMA query_only=1;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA mmap_size={FTS_MMAP_MB << 20};
+        PRAGMA cache_size=-{FTS_CACHE_MB << 10};
+        """)
+        self.state: Dict[str, Any] = {}
+
+    def close(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+def get_reader(db_path: str) -> Optional[Reader]:
+    """取当前线程的池化连接；库文件不存在返回 None。库文件被替换（inode 变化）时自动重连。"""
+    pool: Dict[str, Reader] = getattr(_local, "pool", None)
+    if pool is None:
+        pool = _local.pool = {}
+    try:
+        st = os.stat(db_path)
+    except FileNotFoundError:
+        return None
+    r = pool.get(db_path)
+    if r is not None and r.ident != (st.st_dev, st.st_ino):
+        r.close()
+        r = None
+    if r is None:
+        r = pool[db_path] = Reader(db_path)
+    return r
+
+
+def close_readers():
+    """关闭当前线程持有的所有连接（线程退出前 / 测试里用）。"""
+    pool = getattr(_local, "pool", None) or {}
+    for r in pool.values():
+        r.close()
+    pool.clear()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+进程内检索结果缓存（热门问题直接从内存返回）：
+- key = (backend, 归一化查询, top_k, 其他检索参数, 索引代号 generation)
+- OrderedDict 实现 LRU，条目数封顶；TTL 过期后当作未命中
+- 某个 backend 出现新 generation 时，顺手清掉它旧代的全部条目（索引重建后自动失效）
+- hits / misses / evictions 计数，stats() 查看
+环境变量：
+  MINBIZ_RAG_CACHE_SIZE  最大条目数（默认 1024；0 = 关闭缓存）
+  MINBIZ_RAG_CACHE_TTL   过期秒数（默认 600；0 = 不过期）
+"""
+import os, re, time, threading, unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+RAG_CACHE_SIZE = int(os.getenv("MINBIZ_RAG_CACHE_SIZE", "1024"))
+RAG_CACHE_TTL  = float(os.getenv("MINBIZ_RAG_CACHE_TTL", "600"))
+
+_WS_PTN    = re.compile(r"\s+")
+_TRAIL_PTN = re.compile(r"[\s?？!！。.,，、~～…]+$")
+
+
+def normalize_query(q: str) -> str:
+    """全角转半角 + 大小写折叠 + 空白合并 + 去句尾标点：'如何理解定位？' 与 '如何理解定位?' 同一个 key。"""
+    s = unicodedata.normalize("NFKC", q or "").casefold()
+    s = _WS_PTN.sub(" ", s).strip()
+    return _TRAIL_PTN.sub("", s)
+
+
+class ResultCache:
+    """线程安全的 LRU + TTL 缓存；值由调用方保证不被原地修改（或取出后自行拷贝）。"""
+
+    def __init__(self, maxsize: int = RAG_CACHE_SIZE, ttl: float = RAG_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._gens: Dict[str, Hashable] = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def _observe(self, backend: str, generation: Hashable):
+        # 调用方需持锁；发现新一代就把该 backend 的旧条目全部清掉
+        if self._gens.get(backend, generation) != generation:
+            for k in [k for k in self._data if k[0] == backend]:
+                del self._data[k]
+        self._gens[backend] = generation
+
+    def get(self, backend: str, key: Hashable, generation: Hashable = 0):
+        if self.maxsize <= 0:
+            return None
+        k = (backend, key, generation)
+        with self._lock:
+            self._observe(backend, generation)
+            item = self._data.get(k)
+            if item is not None and (self.ttl <= 0 or item[0] > time.monotonic()):
+                self._data.move_to_end(k)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._data[k]
+            self.misses += 1
+            return None
+
+    def put(self, backend: str, key: Hashable, generation: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        k = (backend, key, generation)
+        with self._lock:
+            self._observe(backend, generation)
+            self._data[k] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(k)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, backend: Optional[str] = None):
+        """清空某个 backend（None = 全部）。"""
+        with self._lock:
+            if backend is None:
+                self._data.clear()
+                self._gens.clear()
+                return
+            for k in [k for k in self._data if k[0] == backend]:
+                del self._data[k]
+            self._gens.pop(backend, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# 进程内共享一份：sqlite_fts.search / HybridSearcher.search 都走它
+RESULT_CACHE = ResultCache()
@@ -1,12 +1,84 @@
 # -*- coding: utf-8 -*-
-import sqlite3, os, glob, json,re
+import sqlite3, os, glob, json, re, hashlib, threading, time
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+from .fts_pool import Reader, get_reader
+from .result_cache import RESULT_CACHE
 
 CANDIDATE_KEYS = ["text", "content", "paragraph", "chunk", "body", "abstract"]
 
+# =========================
+# CJK 分词（索引端 + 查询端）
+# =========================
+# unicode61 会把一整串连续汉字当成一个 token，中文问句几乎 MATCH 不中，只能退回 LIKE 全表扫。
+# 做法：入库时在相邻汉字之间插入分隔符 \x1f（控制字符，unicode61 视为分隔符，原文里不会出现），
+# 每个汉字成为独立 token；查询时把中文片段编成相邻二字短语 "定 位"，OR 起来交给 bm25 排序。
+# （trigram 分词器对 2 字中文词无法命中，所以不用它。）
+# 早期版本用零宽空格（UTF-8 占 3 字节，中文正文体积翻倍），\x1f 只占 1 字节；还原时两者都去掉。
+SEP  = "\x1f"
+ZWSP = "\u200b"
+_CJK = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_SEG_PTN  = re.compile(rf"(?<=[{_CJK}])(?=\w)|(?<=\w)(?=[{_CJK}])")
+_TERM_PTN = re.compile(rf"[{_CJK}]+|[A-Za-z0-9]+")
+_CJK_PTN  = re.compile(rf"[{_CJK}]")
+
+# 问句里高频但几乎没有区分度的二字组合，编进查询只会放大候选集
+_STOP_BIGRAMS = {
+    "什么", "怎么", "如何", "为什", "么呢", "是什", "我们", "你们", "他们",
+    "一个", "这个", "那个", "可以", "的话", "请问", "么做", "么样",
+}
+
+LAYOUT = "cjk-v3"          # 写入 fts_meta，读端据此判断是否为当前布局（分代 + external content）
+TABLE  = "paragraphs"      # 旧版表名；新版为 paragraphs_g{N}
+CHUNKS = "chunks"          # external content 正文表 chunks_g{N}
+
+
+def segment_cjk(s: str) -> str:
+    """入库前分词：相邻汉字（及汉字与英数字之间）插入分隔符。"""
+    return _SEG_PTN.sub(SEP, unsegment(s))
 
 
+def unsegment(s: str) -> str:
+    """读出后还原：去掉分隔符，得到原文。"""
+    return (s or "").replace(SEP, "").replace(ZWSP, "")
+
+
+def compile_match(q: str) -> str:
+    """
+    把自然语言问题编译成合法的 FTS5 表达式：
+    - 中文片段 -> 相邻二字短语 "定 位"（过滤高频虚词组合）
+    - 英文/数字 -> 小写；长度>=3 的加前缀匹配 "price"*
+    - 全部 OR 连接，由 bm25() 决定排序
+    只产出 [a-z0-9] 与汉字，引号内无需转义。
+    """
+    terms, singles = [], []
+    for run in _TERM_PTN.findall(q or ""):
+        if _CJK_PTN.match(run):
+            if len(run) == 1:
+                singles.append(f'"{run}"')
+                continue
+            for i in range(len(run) - 1):
+                bg = run[i:i + 2]
+                if bg not in _STOP_BIGRAMS:
+                    terms.append(f'"{bg[0]} {bg[1]}"')
+        else:
+            t = run.lower()
+            terms.append(f'"{t}"*' if len(t) >= 3 else f'"{t}"')
+    # 只有单字时才退而用单字（否则“的/了”之类会把候选集撑爆）
+    if not terms:
+        terms = singles
+    seen, uniq = set(), []
+    for t in terms:
+        if t not in seen:
+            seen.add(t)
+            uniq.append(t)
+    return " OR ".join(uniq)
+
+
+# =========================
+# 建索引
+# =========================
 def _extract_text_from_json(obj):
     if isinstance(obj, dict):
         for k in CANDIDATE_KEYS:
@@ -20,103 +92,541 @@ def _extract_text_from_json(obj):
         return "\n".join(parts)
     return ""
 
-def build_index(data_dir: str):
+def _title_of(text: str) -> str:
+    """整篇 txt 没有 section_title 时，取首个 markdown 标题行。"""
+    for line in (text or "").splitlines()[:5]:
+        line = line.strip()
+        if line.startswith("#"):
+            return line.lstrip("#").strip()
+    return ""
+
+Row = Tuple[str, str, str, str]   # (text, source, section_title, chunk_id)
+
+def _source_files(p: Path) -> List[str]:
+    """paragraphs/ 下的源文件：先 txt（整篇一条），再 jsonl（逐行一条）。"""
+    return (sorted(glob.glob(str(p / "paragraphs" / "*.txt")))
+            + sorted(glob.glob(str(p / "paragraphs" / "*.jsonl"))))
+
+def _rows_of_file(path: str) -> Iterator[Row]:
+    name = os.path.basename(path)
+    # 1) 纯文本：整篇一条
+    if path.endswith(".txt"):
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            content = f.read()
+        if content.strip():
+            yield content, name, _title_of(content), Path(path).stem
+        return
+
+    # 2) JSONL：逐行解析，每行当作一个“虚拟文档”
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for i, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+            except Exception:
+                continue
+            text = _extract_text_from_json(obj)
+            if not text:
+                continue
+            source = obj.get("src") or obj.get("source") or name
+            title  = obj.get("section_title") or obj.get("title") or ""
+            # chunk_id 优先继承 cid/chunk_id，否则用 文件名#L行号 便于定位
+            cid = obj.get("cid") or obj.get("chunk_id") or obj.get("id") or f"{Path(path).stem}#L{i+1}"
+            yield text, str(source), str(title), str(cid)
+
+def _row_hash(row: Row) -> int:
+    # 取 sha1 前 64 位存成 INTEGER（8 字节），比 40 字符十六进制省 4 倍多
+    digest = hashlib.sha1("\x1f".join(row).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big", signed=True)
+
+def _file_sig(path: str) -> str:
+    # 先比 size+mtime（免读文件），变了再比内容 sha1
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+def _file_sha1(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _table_exists(conn, name: str) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE name=?;", (name,)).fetchone()
+    return row is not None
+
+def _existing_rows(conn) -> List[Row]:
+    """
+    没有 paragraphs/ 源文件时，把库里已有的数据原地升级：
+    - 旧版 build_index 写的 docs(path, content)
+    - 旧版 paragraphs(text, source, section_title, chunk_id)
+    """
+    rows = []
+    if _table_exists(conn, "docs"):
+        for path, content in conn.execute("SELECT path, content FROM docs"):
+            if not content:
+                continue
+            fpath, _, line_no = (path or "").partition("#")
+            name = os.path.basename(fpath)
+            cid = Path(name).stem + (f"#{line_no}" if line_no else "")
+            rows.append((content, name, _title_of(content), cid))
+    legacy = [TABLE]
+    if _meta(conn, "layout") == "cjk-v2":         # 分代但正文仍存在 FTS 表里的布局
+        legacy.append(f"{TABLE}_g{_meta(conn, 'active', '0')}")
+    for t in legacy:
+        if not _table_exists(conn, t):
+            continue
+        for text, source, title, cid in conn.execute(
+            f"SELECT text, source, section_title, chunk_id FROM {t}"
+        ):
+            if text:
+                rows.append((unsegment(text), source or "", unsegment(title or ""), cid or ""))
+    return rows
+
+# =========================
+# 代际（generation）管理
+# =========================
+# 每次整库重建写进一组新的影子表 chunks_g{N} / paragraphs_g{N} / fts_files_g{N}，
+# 建完 optimize 后在一个小事务里把 fts_meta.active 指向 N —— 读端每次按指针解析表名，
+# 重建期间线上始终读旧表，不会读到半空的索引。上一代保留一轮，给还在跑的查询兜底。
+# fts_meta.generation 每次内容变化（整库切换 / 增量有改动）都 +1，供缓存做失效键。
+#
+# 存储布局（external content）：
+# - chunks_g{N}：普通表，正文只存这一份（分词形式）+ 紧凑元数据 + 行级内容哈希（兼做增量清单），
+#   source / section_title / path 建 B-tree 索引，元数据过滤不走 FTS
+# - paragraphs_g{N}：FTS5 倒排索引，content='chunks_g{N}'，自身不再存正文；触发器保持同步
+#
+# 构建互斥：同一个库同时只有一个 build_index 在写（多个 uvicorn worker 启动时会同时重建）。
+# 锁是 fts_meta 里的一行 build_lock = "<进程:线程> <时间戳>"，在 BEGIN IMMEDIATE 里抢；
+# 后来者轮询等待，拿到锁后重新读状态（通常增量一遍就发现没有变化）。持有者崩溃留下的锁
+# 超过 MINBIZ_FTS_BUILD_LOCK_STALE 秒视为失效。否则先建完的那次会把另一次还在写的影子表当旧代删掉。
+_GEN_PTN = re.compile(rf"^{TABLE}_g(\d+)$")
+_BATCH_ROWS = 5000          # 整库重建时每个事务写入的行数，避免单个大事务撑爆 WAL
+BUILD_LOCK_STALE = float(os.getenv("MINBIZ_FTS_BUILD_LOCK_STALE", "3600"))
+_BUILD_LOCK_POLL = 0.5
+
+def _names(n: int) -> Tuple[str, str, str]:
+    """第 n 代的 (FTS 索引, 文件清单, 正文表)。"""
+    return f"{TABLE}_g{n}", f"fts_files_g{n}", f"{CHUNKS}_g{n}"
+
+def _chunks_of(table: str) -> str:
+    return CHUNKS + table[len(TABLE):]
+
+def _meta(conn, k: str, default: str = "") -> str:
+    if not _table_exists(conn, "fts_meta"):
+        return default
+    row = conn.execute("SELECT v FROM fts_meta WHERE k=?", (k,)).fetchone()
+    return row[0] if row else default
+
+def _set_meta(c, **kv):
+    c.executemany("INSERT OR REPLACE INTO fts_meta(k, v) VALUES(?,?)",
+                  [(k, str(v)) for k, v in kv.items()])
+
+def _acquire_build_lock(conn) -> str:
+    """抢构建锁（见上）；返回持有者标识，交给 _release_build_lock。"""
+    me = f"{os.getpid()}:{threading.get_ident()}"
+    waited = False
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("CREATE TABLE IF NOT EXISTS fts_meta(k TEXT PRIMARY KEY, v TEXT)")
+        held = _meta(conn, "build_lock").split()
+        if not held or time.time() - float(held[-1]) > BUILD_LOCK_STALE:
+            _set_meta(conn, build_lock=f"{me} {time.time()}")
+            conn.execute("COMMIT")
+            return me
+        conn.execute("COMMIT")
+        if not waited:
+            print(f"[RAG] index build in progress by {held[0]}, waiting")
+            waited = True
+        time.sleep(_BUILD_LOCK_POLL)
+
+def _release_build_lock(conn, me: str):
+    conn.execute("DELETE FROM fts_meta WHERE k='build_lock' AND v LIKE ?", (me + " %",))
+
+def resolve_active(conn) -> Tuple[str, int]:
+    """读端解析当前代：返回 (FTS 表名, generation)；未升级的旧库返回 ("", 0)。"""
+    if _meta(conn, "layout") != LAYOUT:
+        return "", 0
+    return _names(int(_meta(conn, "active", "0")))[0], int(_meta(conn, "generation", "0"))
+
+def _active_for(r: Reader) -> Tuple[str, int]:
+    """池化连接上的代解析：PRAGMA data_version 没变（无其它连接提交）就直接用缓存。"""
+    dv = r.conn.execute("PRAGMA data_version").fetchone()[0]
+    if r.state.get("data_version") != dv:
+        r.state["active"] = resolve_active(r.conn)
+        r.state["data_version"] = dv
+    return r.state["active"]
+
+def index_generation(db_path: str) -> int:
+    """当前索引代号；库不存在或旧库返回 0。"""
+    r = get_reader(db_path)
+    return _active_for(r)[1] if r else 0
+
+# 批量写入时的 PRAGMA：WAL + NORMAL 只在 checkpoint 时 fsync，大缓存 + 内存临时表
+_BULK_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-65536;
+"""
+
+def _create_tables(c, n: int):
+    fts, files, chunks = _names(n)
+    for t in (fts, files, chunks):          # 上次崩溃留下的同名影子表
+        c.execute(f"DROP TABLE IF EXISTS {t}")
+    # text / section_title 存分词后的形式（\x1f 分隔）；h 为行内容哈希，file_id 指向来源文件（增量清单）
+    c.execute(
+        f"CREATE TABLE {chunks}(id INTEGER PRIMARY KEY, text TEXT, source TEXT, "
+        "section_title TEXT, chunk_id TEXT, file_id INTEGER, h INTEGER)"
+    )
+    for col in ("source", "section_title", "file_id"):
+        c.execute(f"CREATE INDEX {chunks}_{col} ON {chunks}({col})")
+    c.execute(
+        f"CREATE VIRTUAL TABLE {fts} USING fts5("
+        f"text, section_title, content='{chunks}', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2')"
+    )
+    # 文件级签名：先比 size+mtime，再比 sha1
+    c.execute(f"CREATE TABLE {files}(id INTEGER PRIMARY KEY, path TEXT UNIQUE, sig TEXT, sha1 TEXT)")
+
+def _create_triggers(c, n: int):
+    """增量更新时由触发器把 chunks 的增删改同步进 FTS 索引（整库装载走 rebuild，不经触发器）。"""
+    fts, _, chunks = _names(n)
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS {chunks}_ai AFTER INSERT ON {chunks} BEGIN
+        INSERT INTO {fts}(rowid, text, section_title) VALUES (new.id, new.text, new.section_title);
+    END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS {chunks}_ad AFTER DELETE ON {chunks} BEGIN
+        INSERT INTO {fts}({fts}, rowid, text, section_title) VALUES ('delete', old.id, old.text, old.section_title);
+    END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS {chunks}_au AFTER UPDATE ON {chunks} BEGIN
+        INSERT INTO {fts}({fts}, rowid, text, section_title) VALUES ('delete', old.id, old.text, old.section_title);
+        INSERT INTO {fts}(rowid, text, section_title) VALUES (new.id, new.text, new.section_title);
+    END""")
+
+def _drop_generations(c, keep: set):
+    """删掉 keep 以外的所有代，以及旧版布局遗留的表。"""
+    for (name,) in c.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall():
+        m = _GEN_PTN.match(name)
+        if m and int(m.group(1)) not in keep:
+            g = int(m.group(1))
+            for t in _names(g) + (f"fts_rows_g{g}",):
+                c.execute(f"DROP TABLE IF EXISTS {t}")
+    for t in (TABLE, "docs", "fts_files", "fts_rows"):
+        c.execute(f"DROP TABLE IF EXISTS {t}")
+
+def _insert_rows(c, n: int, file_id: Optional[int], rows: List[Row], next_id: int) -> int:
+    if not rows:
+        return next_id
+    chunks = _names(n)[2]
+    ids = range(next_id, next_id + len(rows))
+    c.executemany(
+        f"INSERT INTO {chunks}(id, text, source, section_title, chunk_id, file_id, h) VALUES(?,?,?,?,?,?,?)",
+        [(i, segment_cjk(r[0]), r[1], segment_cjk(r[2]), r[3], file_id, _row_hash(r)) for i, r in zip(ids, rows)],
+    )
+    return next_id + len(rows)
+
+def _delete_rows(c, n: int, ids: List[int]):
+    c.executemany(f"DELETE FROM {_names(n)[2]} WHERE id=?", [(i,) for i in ids])
+
+def _full_load(c, p: Path, files: List[str], legacy: List[Row]) -> Dict[str, int]:
+    """整库重建到影子表：批量写 chunks -> FTS rebuild -> 建触发器 -> optimize -> 原子切换。"""
+    c.execute("BEGIN IMMEDIATE")
+    c.execute("CREATE TABLE IF NOT EXISTS fts_meta(k TEXT PRIMARY KEY, v TEXT)")
+    n = int(_meta(c.connection, "seq", "0")) + 1      # 预留表后缀，防止并发重建撞名
+    _set_meta(c, seq=n)
+    _create_tables(c, n)
+    c.execute("COMMIT")
+
+    fts, ffiles, _ = _names(n)
+    try:
+        next_id, pending = 1, 0
+        c.execute("BEGIN")
+        if legacy:
+            next_id = _insert_rows(c, n, None, legacy, next_id)
+        for f in files:
+            fid = c.execute(f"INSERT INTO {ffiles}(path, sig, sha1) VALUES(?,?,?)",
+                            (os.path.relpath(f, p), _file_sig(f), _file_sha1(f))).lastrowid
+            rows = list(_rows_of_file(f))
+            next_id = _insert_rows(c, n, fid, rows, next_id)
+            pending += len(rows)
+            if pending >= _BATCH_ROWS:
+                c.execute("COMMIT"); c.execute("BEGIN")
+                pending = 0
+        c.execute("COMMIT")
+        c.execute("BEGIN")
+        c.execute(f"INSERT INTO {fts}({fts}) VALUES('rebuild')")   # 一次性从 chunks 建倒排
+        _create_triggers(c, n)
+        c.execute("COMMIT")
+        c.execute(f"INSERT INTO {fts}({fts}) VALUES('optimize')")  # 合并段，查询更快
+    except Exception:
+        if c.connection.in_transaction:
+            c.execute("ROLLBACK")
+        for t in _names(n):
+            c.execute(f"DROP TABLE IF EXISTS {t}")
+        raise
+
+    # 原子切换：读端下一次解析即看到新代
+    c.execute("BEGIN IMMEDIATE")
+    prev = int(_meta(c.connection, "active", "0"))
+    gen = int(_meta(c.connection, "generation", "0")) + 1
+    _set_meta(c, layout=LAYOUT, active=n, previous=prev, generation=gen)
+    c.execute("COMMIT")
+    # 旧代清理放在切换之后、单独事务；上一代保留给仍在执行的查询
+    c.execute("BEGIN IMMEDIATE")
+    _drop_generations(c, keep={n, prev})
+    c.execute("COMMIT")
+    return {"added": next_id - 1, "deleted": 0, "unchanged": 0, "generation": gen}
+
+def _apply_delta(c, p: Path, files: List[str]) -> Dict[str, int]:
+    """在当前代上原地增量更新（单事务）；有改动则 generation +1。"""
+    n = int(_meta(c.connection, "active", "0"))
+    _, ffiles, chunks = _names(n)
+    c.execute("BEGIN IMMEDIATE")
+    next_id = (c.execute(f"SELECT max(id) FROM {chunks}").fetchone()[0] or 0) + 1
+    known = {path: (fid, sig, sha1) for fid, path, sig, sha1 in c.execute(f"SELECT id, path, sig, sha1 FROM {ffiles}")}
+    stats = {"added": 0, "deleted": 0, "unchanged": 0}
+    seen = set()
+    for f in files:
+        rel = os.path.relpath(f, p)
+        seen.add(rel)
+        sig, old = _file_sig(f), known.get(rel)
+        if old and old[1] == sig:
+            stats["unchanged"] += 1
+            continue
+        sha1 = _file_sha1(f)
+        if old and old[2] == sha1:          # 只是 touch 过，内容没变
+            c.execute(f"UPDATE {ffiles} SET sig=? WHERE id=?", (sig, old[0]))
+            stats["unchanged"] += 1
+            continue
+        if old:
+            fid = old[0]
+            c.execute(f"UPDATE {ffiles} SET sig=?, sha1=? WHERE id=?", (sig, sha1, fid))
+        else:
+            fid = c.execute(f"INSERT INTO {ffiles}(path, sig, sha1) VALUES(?,?,?)", (rel, sig, sha1)).lastrowid
+
+        # 行级比对：哈希还在的行原样保留，只删旧行、插新行
+        old_rows: Dict[int, List[int]] = {}
+        for rid, h in c.execute(f"SELECT id, h FROM {chunks} WHERE file_id=?", (fid,)):
+            old_rows.setdefault(h, []).append(rid)
+        fresh = []
+        for r in _rows_of_file(f):
+            ids = old_rows.get(_row_hash(r))
+            if ids:
+                ids.pop()
+            else:
+                fresh.append(r)
+        stale = [rid for ids in old_rows.values() for rid in ids]
+        _delete_rows(c, n, stale)
+        next_id = _insert_rows(c, n, fid, fresh, next_id)
+        stats["added"] += len(fresh)
+        stats["deleted"] += len(stale)
+
+    # 源文件已删除 -> 连同它的行一起清掉
+    for rel in set(known) - seen:
+        fid = known[rel][0]
+        stale = [rid for (rid,) in c.execute(f"SELECT id FROM {chunks} WHERE file_id=?", (fid,))]
+        _delete_rows(c, n, stale)
+        c.execute(f"DELETE FROM {ffiles} WHERE id=?", (fid,))
+        stats["deleted"] += len(stale)
+
+    gen = int(_meta(c.connection, "generation", "0"))
+    if stats["added"] or stats["deleted"]:
+        gen += 1
+        _set_meta(c, generation=gen)
+    c.execute("COMMIT")
+    stats["generation"] = gen
+    return stats
+
+def build_index(data_dir: str, incremental: bool = True):
+    """
+    从 data_dir/paragraphs/*.txt|*.jsonl 建 FTS5 索引，返回 db 路径。
+    - incremental=True：在当前代上按清单只删/插内容有变化的行（单事务）
+    - incremental=False 或首次：整库重建到新一代影子表，optimize 后原子切换
+    可在线上流量下执行，读端不会看到半空的表；多个进程同时调用时按构建锁排队执行。
+    """
     p = Path(data_dir)
     db = p / "rag_fts5.db"
     p.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(db)); c = conn.cursor()
-    c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5(path, content)")
+    conn = sqlite3.connect(str(db), isolation_level=None, timeout=30)   # 手动控制事务
+    conn.executescript(_BULK_PRAGMAS)
+    c = conn.cursor()
+    me = _acquire_build_lock(conn)
     try:
-        c.execute("DELETE FROM docs")
-    except Exception:
-        pass
+        files = _source_files(p)
+        table, _ = resolve_active(conn)
+        tracked = bool(table) and \
+            c.execute(f"SELECT 1 FROM {_names(int(_meta(conn, 'active')))[1]} LIMIT 1").fetchone() is not None
 
-    # 1) 先吃纯文本
-    txt_pattern = str(p / "paragraphs" / "*.txt")
-    for txt in glob.glob(txt_pattern):
-        with open(txt, "r", encoding="utf-8", errors="ignore") as f:
-            content = f.read()
-        c.execute("INSERT INTO docs(path, content) VALUES(?,?)", (txt, content))
-
-    # 2) 再吃 JSONL：逐行解析，抽取文本
-    jsonl_pattern = str(p / "paragraphs" / "*.jsonl")
-    for jf in glob.glob(jsonl_pattern):
-        with open(jf, "r", encoding="utf-8", errors="ignore") as f:
-            for i, line in enumerate(f):
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                except Exception:
-                    continue
-                text = _extract_text_from_json(obj)
-                if not text:
-                    continue
-                # 每行当作一个“虚拟文档”，path 上附加行号，便于定位
-                virtual_path = f"{jf}#L{i+1}"
-                c.execute("INSERT INTO docs(path, content) VALUES(?,?)", (virtual_path, text))
-
-    conn.commit(); conn.close()
+        # 没有源文件时不动已升级的索引（源目录没挂载不应清空线上索引）
+        if not files and table:
+            return str(db)
+        if files and incremental and tracked:
+            mode, stats = "incremental", _apply_delta(c, p, files)
+        elif files:
+            mode, stats = "full", _full_load(c, p, files, [])
+        else:
+            # 旧库原地升级：把 docs / paragraphs 里的旧数据搬进新一代
+            mode, stats = "upgrade", _full_load(c, p, [], _existing_rows(conn))
+    finally:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        _release_build_lock(conn, me)
+        conn.close()
+    print(f"[RAG] index {mode}: +{stats['added']} -{stats['deleted']} rows, "
+          f"{stats['unchanged']} files unchanged, generation={stats['generation']} -> {db}")
     return str(db)
 
-def _normalize_query(q: str) -> str:
+
+# =========================
+# 检索
+# =========================
+def _split_terms(q: str) -> list[str]:
+    # 取中文、英文数字，去掉标点，按连续块切开；中英文都只保留长度>=2 的片段
+    out = []
+    for t in _TERM_PTN.findall(q or ""):
+        if len(t) >= 2:
+            out.append(t if _CJK_PTN.match(t) else t.lower())
+    return list(dict.fromkeys(out))
+
+def _legacy_search(cur, q: str, top_k: int) -> List[Dict[str, Any]]:
     """
-    把用户自然语言问题转成 FTS5 友好查询：
-    - 去掉会破坏 MATCH 语法的符号（? " ' ( ) | : - 等）
-    - 仅保留中文/英文/数字，按词切分
-    - 用前缀匹配：token* token* ...
+    旧库（未用 build_index 重建、没有 fts_meta）兼容路径：原样 MATCH，空则 LIKE 回退。
+    重建一次索引（tools/build_rag_index.py）即可走倒排索引。
     """
-    # 全角转半角 + 小写
-    q = q.strip().lower()
-    # 只保留“字母/数字/汉字”，其它变空格
-    q = re.sub(r"[^\w\u4e00-\u9fff]+", " ", q)
-    tokens = [t for t in q.split() if t]
-    if not tokens:
-        return ""
-    # FTS5 前缀匹配（注意：过短的 token 可不加 *，按需调整阈值）
-    parts = []
-    for t in tokens:
-        if len(t) >= 2:
-            parts.append(f'{t}*')
-        else:
-            parts.append(t)
-    return " ".join(parts)
+    rows = []
+    try:
+        cur.execute(
+            f"SELECT text, source, section_title, chunk_id, 1.0 AS score "
+            f"FROM {TABLE} WHERE {TABLE} MATCH ? LIMIT ?;",
+            (q, top_k)
+        )
+        rows = [dict(r) for r in cur.fetchall()]
+    except Exception as e:
+        print("[RAG] FTS MATCH error ->", e)
+    if rows:
+        return rows
+
+    terms = _split_terms(q) or [q]
+    where = " OR ".join(["text LIKE ?"] * len(terms))
+    cur.execute(
+        f"SELECT text, source, section_title, chunk_id FROM {TABLE} WHERE {where} LIMIT 200;",
+        [f"%{t}%" for t in terms]
+    )
+    scored = []
+    for r in cur.fetchall():
+        txt = r["text"] or ""
+        s = sum(1 for t in terms if t in txt)   # 命中词个数作为分数
+        if s > 0:
+            scored.append(dict(r, score=float(s)))
+    scored.sort(key=lambda x: x["score"], reverse=True)
+    return scored[:top_k]
+
+# snippet() 的窗口宽度按 token 计（一个汉字 = 一个 token），FTS5 上限 64
+SNIPPET_MAX = 64
+HL_OPEN, HL_CLOSE = "<mark>", "</mark>"
+ELLIPSIS = "…"
 
 
-def search(db_path: str, query: str, top_k: int = 6) -> List[Dict[str, Any]]:
+def _query_active(cur, table: str, expr: str, top_k: int, filters: Dict[str, str],
+                  snippet_tokens: int = 0, highlight: bool = False):
+    # ✅ 参数绑定；bm25 越小越相关，取负号后作为 score；元数据从 chunks 取（B-tree 过滤）
+    chunks = _chunks_of(table)
+    where = "".join(f" AND c.{col} = ?" for col in filters)
+    cols, args = "", []
+    if snippet_tokens > 0:
+        # 第 0 列是正文；窗口由 FTS5 按命中词密度选取
+        cols += f", snippet({table}, 0, '', '', ?, ?) AS snippet"
+        args += [ELLIPSIS, snippet_tokens]
+        if highlight:
+            cols += f", snippet({table}, 0, ?, ?, ?, ?) AS marked"
+            args += [HL_OPEN, HL_CLOSE, ELLIPSIS, snippet_tokens]
+    elif highlight:
+        cols += f", highlight({table}, 0, ?, ?) AS marked"
+        args += [HL_OPEN, HL_CLOSE]
+    cur.execute(
+        f"SELECT c.text, c.source, c.section_title, c.chunk_id, -bm25({table}) AS score{cols} "
+        f"FROM {table} JOIN {chunks} c ON c.id = {table}.rowid "
+        f"WHERE {table} MATCH ?{where} ORDER BY score DESC LIMIT ?",
+        (*args, expr, *filters.values(), top_k),
+    )
+    return cur.fetchall()
+
+
+def _unmark(s: str) -> str:
+    # 相邻两个汉字分别命中时 FTS5 会标成两段，还原分隔符后把紧挨着的标记并成一段
+    return unsegment(s).replace(HL_CLOSE + HL_OPEN, "")
+
+
+def search(db_path: str, query: str, top_k: int = 6,
+           source: Optional[str] = None, section_title: Optional[str] = None,
+           snippet_tokens: int = 0, highlight: bool = False) -> List[Dict[str, Any]]:
     """
-    返回统一结构：[{ 'text': str, 'score': float, 'meta': {...} }, ...]
-    你可以把表名/字段名改为你现有的：比如 paragraphs(content TEXT, path TEXT, ...)
+    返回统一结构：[{ 'text': str, 'score': float, 'meta': {source, section_title, chunk_id} }, ...]
+    score 为 -bm25（越大越相关）。走 fts_pool 的每线程只读长连接，表名按当前代解析。
+    source / section_title：可选的元数据精确过滤（chunks 上的 B-tree 索引）。
+    snippet_tokens > 0：额外返回 'snippet'，即 FTS5 snippet() 选出的命中词窗口（宽度按 token 计，
+      上限 64，一个汉字算一个 token），给 prompt 用，替代整段正文。
+    highlight=True：额外返回 'highlight'，命中词用 <mark></mark> 包裹，给 UI 证据展示用；
+      有 snippet_tokens 时只标注窗口，否则标注整段（highlight()）。
+    旧布局库（未升级）不支持这两项，不返回对应字段。
+    结果按 (查询, 参数, 索引代号) 缓存在 RESULT_CACHE 里，索引换代后自动失效。
     """
-    norm = _normalize_query(query)
-    if not norm:
+    snippet_tokens = max(0, min(int(snippet_tokens or 0), SNIPPET_MAX))
+    r = get_reader(db_path)
+    if r is None:
+        return []
+    cur = r.conn.cursor()
+    table, gen = _active_for(r)
+    if not table:
+        return _to_hits(_legacy_search(cur, query, top_k) if _table_exists(r.conn, TABLE) else [])
+    expr = compile_match(query)
+    if not expr:
         return []
+    filters = {}
+    if source:
+        filters["source"] = source
+    if section_title:
+        filters["section_title"] = segment_cjk(section_title)
+    q = (expr, top_k, filters, snippet_tokens, highlight)
 
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    try:
-        cur = conn.cursor()
-        # ✅ 参数绑定，避免引号/问号破坏语法；rank 使用 bm25 或 fts5 的 rank 函数按你的库来
-        sql = """
-        SELECT
-            content as text,
-            path    as source,
-            bm25(paragraphs) as score
-        FROM paragraphs
-        WHERE paragraphs MATCH ?
-        ORDER BY score
-        LIMIT ?
-        """
-        cur.execute(sql, (norm, top_k))
-        rows = cur.fetchall()
-        out = []
-        for r in rows:
-            out.append({
-                "text": r["text"] or "",
-                "score": float(r["score"]) if r["score"] is not None else 0.0,
-                "meta": {"source": r["source"]},
-            })
-        return out
-    finally:
-        conn.close()
\ No newline at end of file
+    # 编译后的 MATCH 表达式就是最准确的归一化：标点/大小写/停用二字组不同的问句共用一条缓存
+    backend = f"fts:{db_path}"
+    key = (expr, top_k, source, section_title, snippet_tokens, highlight)
+    hits = RESULT_CACHE.get(backend, key, (r.ident, gen))
+    if hits is None:
+        try:
+            rows = _query_active(cur, table, *q)
+        except sqlite3.OperationalError as e:
+            # 解析后恰好遇到连续两次整库切换、旧代被清理：重新解析一次，
+            # 结果按实际查询的那一代入缓存（不能记在旧代号下）
+            if "no such table" not in str(e):
+                raise
+            r.state.clear()
+            table, gen = _active_for(r)
+            rows = _query_active(cur, table, *q)
+        hits = _to_hits(rows)
+        RESULT_CACHE.put(backend, key, (r.ident, gen), hits)
+    return [dict(h, meta=dict(h["meta"])) for h in hits]   # 拷贝一层，调用方改了也不污染缓存
+
+
+def _to_hits(rows) -> List[Dict[str, Any]]:
+    out = []
+    for row in rows:
+        hit = {
+            "text": unsegment(row["text"]),
+            "score": float(row["score"]) if row["score"] is not None else 0.0,
+            "meta": {
+                "source": row["source"],
+                "section_title": unsegment(row["section_title"]),
+                "chunk_id": row["chunk_id"],
+            },
+        }
+        keys = row.keys()
+        if "snippet" in keys:
+            hit["snippet"] = unsegment(row["snippet"] or "")
+        if "marked" in keys:
+            hit["highlight"] = _unmark(row["marked"] or "")
+        out.append(hit)
+    return out
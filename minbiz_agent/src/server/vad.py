@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+实时语音用的轻量 VAD + 语句切分（16 kHz / 16-bit / 单声道 PCM）
+- 30 ms 一帧判断有无人声：装了 webrtcvad 就用它，否则用能量阈值（噪声底自适应）
+- 说话中短停顿（PAUSE_MS）切出一个「片段」，可以立刻送去转写，不用等整句说完
+- 静音超过 END_MS 认为这句话结束；单个片段最长 MAX_SEG_MS，超过强制切
+- 语音起点前保留 PREROLL_MS 音频，避免吞掉第一个字
+环境变量：
+  MINBIZ_VAD_PAUSE_MS     片段切分停顿（默认 300）
+  MINBIZ_VAD_END_MS       语句结束静音（默认 700）
+  MINBIZ_VAD_MAX_SEG_MS   单片段最长（默认 8000）
+  MINBIZ_VAD_ENERGY_MIN   能量 VAD 的绝对下限（RMS，默认 300）
+  MINBIZ_VAD_AGGRESSIVE   webrtcvad 灵敏度 0-3（默认 2）
+"""
+import math, os
+from array import array
+from collections import deque
+from typing import List, Optional, Tuple
+
+# 可选：webrtcvad（更抗噪）；没有就用能量阈值
+try:
+    import webrtcvad
+except Exception:
+    webrtcvad = None
+
+SAMPLE_RATE = 16000
+FRAME_MS    = 30
+FRAME_BYTES = SAMPLE_RATE * FRAME_MS // 1000 * 2
+
+VAD_PAUSE_MS   = int(os.getenv("MINBIZ_VAD_PAUSE_MS", "300"))
+VAD_END_MS     = int(os.getenv("MINBIZ_VAD_END_MS", "700"))
+VAD_MAX_SEG_MS = int(os.getenv("MINBIZ_VAD_MAX_SEG_MS", "8000"))
+VAD_ENERGY_MIN = float(os.getenv("MINBIZ_VAD_ENERGY_MIN", "300"))
+VAD_AGGRESSIVE = int(os.getenv("MINBIZ_VAD_AGGRESSIVE", "2"))
+
+START_FRAMES = 3       # 连续这么多帧有声才算开口（90 ms），过滤咔哒声
+PREROLL_MS   = 300
+
+Event = Tuple[str, Optional[bytes]]    # ("start", None) / ("segment", pcm) / ("end", None)
+
+
+def frame_rms(frame: bytes) -> float:
+    a = array("h", frame)
+    return math.sqrt(sum(x * x for x in a) / len(a)) if a else 0.0
+
+
+class FrameVAD:
+    """单帧有无人声"""
+
+    def __init__(self):
+        self._vad = webrtcvad.Vad(VAD_AGGRESSIVE) if webrtcvad is not None else None
+        self.floor = VAD_ENERGY_MIN / 3     # 噪声底，静音帧上做指数平滑
+
+    def is_speech(self, frame: bytes) -> bool:
+        if self._vad is not None:
+            return self._vad.is_speech(frame, SAMPLE_RATE)
+        rms = frame_rms(frame)
+        voiced = rms > max(VAD_ENERGY_MIN, self.floor * 3)
+        if not voiced:
+            self.floor = 0.95 * self.floor + 0.05 * rms
+        return voiced
+
+
+class UtteranceSegmenter:
+    """喂入任意长度的 PCM，吐出 start / segment / end 事件"""
+
+    def __init__(self):
+        self.vad = FrameVAD()
+        self._rest = b""
+        self._pre: "deque[bytes]" = deque(maxlen=PREROLL_MS // FRAME_MS)
+        self._onset: List[bytes] = []
+        self._seg = bytearray()
+        self._seg_voiced = 0        # 当前片段里有声帧的毫秒数
+        self._silence = 0
+        self._paused = False        # 这次停顿已经切过片段（PAUSE_MS 不是帧长整数倍时也只切一次）
+        self.in_speech = False
+
+    def _cut(self, out: List[Event]):
+        if self._seg_voiced > 0:
+            out.append(("segment", bytes(self._seg)))
+        self._seg = bytearray()
+        self._seg_voiced = 0
+
+    def _frame(self, f: bytes, out: List[Event]):
+        speech = self.vad.is_speech(f)
+        if not self.in_speech:
+            if not speech:
+                self._onset.clear()
+                self._pre.append(f)
+                return
+            self._onset.append(f)
+            if len(self._onset) < START_FRAMES:
+                return
+            self.in_speech, self._silence, self._paused = True, 0, False
+            self._seg = bytearray(b"".join(self._pre) + b"".join(self._onset))
+            self._seg_voiced = len(self._onset) * FRAME_MS
+            self._pre.clear()
+            self._onset.clear()
+            out.append(("start", None))
+            return
+
+        self._seg += f
+        if speech:
+            self._silence, self._paused = 0, False
+            self._seg_voiced += FRAME_MS
+        else:
+            self._silence += FRAME_MS
+            if self._silence >= VAD_PAUSE_MS and not self._paused:
+                self._paused = True
+                self._cut(out)
+            if self._silence >= VAD_END_MS:
+                self._cut(out)
+                self.in_speech = False
+                out.append(("end", None))
+                return
+        if len(self._seg) // (FRAME_BYTES // FRAME_MS) >= VAD_MAX_SEG_MS:
+            self._cut(out)
+
+    def feed(self, pcm: bytes) -> List[Event]:
+        out: List[Event] = []
+        data = self._rest + pcm
+        n = len(data) - len(data) % FRAME_BYTES
+        for i in range(0, n, FRAME_BYTES):
+            self._frame(data[i:i + FRAME_BYTES], out)
+        self._rest = data[n:]
+        return out
+
+    def flush(self) -> List[Event]:
+        """客户端说「说完了」：把没切的部分作为最后一个片段，并结束这句话"""
+        out: List[Event] = []
+        if self.in_speech:
+            self._seg += self._rest
+            self._cut(out)
+            self.in_speech = False
+            out.append(("end", None))
+        self._rest = b""
+        return out
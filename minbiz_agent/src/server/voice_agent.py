@@ -2,35 +2,40 @@
 """
 MinBiz Voice Agent (Full: RAG + TTS + STT + evidence)
 - /ask-business-v1 : 统一业务端点（RAG -> LLM），总是返回 evidence
+- /ask-business-v1/stream : 同上，SSE 流式：evidence -> token... -> done
 - /ask-text-v2     : 文本 -> (RAG) -> LLM -> [可选TTS音频]（保留兼容）
 - /ask-voice-v2    : 语音 -> STT -> (RAG) -> LLM -> [可选TTS音频]
 - /stt-openai      : 语音转写
 - /tts-say         : 文本转语音（自动中英文）
+- /ws/voice        : 实时语音（WebSocket 推 PCM 流 -> VAD 切句 -> 增量转写 -> 检索 + 流式回答 [+ 音频]）
 - /health          : 健康检查
+v2 / STT / TTS 端点全程非阻塞：AsyncOpenAI + asyncio.Semaphore 闸门，检索放到有界线程池（MINBIZ_VOICE_RAG_WORKERS）
 """
 
 import os
 import re
 import io
 import json
-import base64
+import wave
+import hashlib
 import traceback
+from collections import OrderedDict
+from contextlib import suppress
 from pathlib import Path
 from typing import Any, Dict, List, Tuple
 
-from fastapi import FastAPI, Form, File, UploadFile, Header
+from fastapi import FastAPI, Form, File, UploadFile, Header, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, Response
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from importlib import import_module
-from threading import Semaphore
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
 load_dotenv()  # 读取 .env
 
-# --- OpenAI SDK ---
-from openai import OpenAI
-
 os.environ["OMP_NUM_THREADS"] = "1"
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
@@ -55,16 +60,24 @@ OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "3"))
 STT_MAX_CONCURRENCY    = int(os.getenv("STT_MAX_CONCURRENCY", "1"))
 TTS_MAX_CONCURRENCY    = int(os.getenv("TTS_MAX_CONCURRENCY", "1"))
 
-llm_sem = Semaphore(OPENAI_MAX_CONCURRENCY)
-stt_sem = Semaphore(STT_MAX_CONCURRENCY)
-tts_sem = Semaphore(TTS_MAX_CONCURRENCY)
+# 并发闸门：asyncio.Semaphore，排队时只挂起当前请求，不占事件循环（旧版 threading.Semaphore 会卡住整个 worker）
+llm_sem = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+stt_sem = asyncio.Semaphore(STT_MAX_CONCURRENCY)
+tts_sem = asyncio.Semaphore(TTS_MAX_CONCURRENCY)
 
-# --- OpenAI 客户端 ---
-client = OpenAI(
-    api_key=OPENAI_API_KEY,
-    base_url=OPENAI_BASE_URL,
-    timeout=30,              # ⬅ 全局默认超时（秒）
-)
+# 检索是 CPU / 磁盘活（向量 + BM25 + 打包），放到有界线程池里跑
+RAG_WORKERS = int(os.getenv("MINBIZ_VOICE_RAG_WORKERS", "4"))
+_rag_pool = ThreadPoolExecutor(max_workers=RAG_WORKERS, thread_name_prefix="voice-rag")
+
+# --- OpenAI 客户端：进程级共享（连接池 + 按模型超时 + 重试 / 熔断），见 src/app/llm_client.py ---
+# 单次调用超时（秒）；MINBIZ_LLM_TIMEOUTS 里给该模型配置了超时时以那个为准
+VOICE_CALL_TIMEOUT = float(os.getenv("MINBIZ_VOICE_CALL_TIMEOUT", "28"))
+
+def _call_timeout(model: str) -> float:
+    return LLM_TIMEOUTS.get(model, VOICE_CALL_TIMEOUT)
+
+def _aoc(model: str):
+    return get_async_client(model, timeout=_call_timeout(model))
 
 # ========== FastAPI ==========
 app = FastAPI(title="MinBiz Voice Agent", version="2.2")
@@ -76,26 +89,32 @@ app.add_middleware(
 
 # ========== 业务大脑（RAG + 记忆） ==========
 # 你的 brain.answer 会：读画像+对话、做轻量RAG、强风格输出，并返回 {"text","evidence","topic"}
-from ..agent.brain import answer as biz_answer
+from ..agent.brain import answer as biz_answer, answer_stream as biz_answer_stream
+from ..agent import memory, archive
 from ..rag.sqlite_fts import build_index as rag_build
+from ..rag.context_packer import pack_context
+from ..app.llm_client import get_async_client, achat_completion, awith_retry, llm_stats, LLM_TIMEOUTS
+from . import vad
 
 # ========== 可选：适配层，供 ask-text-v2 / ask-voice-v2 使用 ==========
 # 旧版 UI 用到的“RAG上下文拼接”函数（若存在则用；失败则空上下文）
 _searcher = None
+_NO_SEARCHER = object()                  # 加载失败的标记：和成功的实例一样只尝试一次，之后直接走空上下文
+_searcher_lock = threading.Lock()
 def get_searcher():
-    """尝试从 src.app.retriever 加载 HybridSearcher（若项目有）"""
+    """尝试从 src.app.retriever 加载 HybridSearcher（若项目有）；加载（含向量模型）较慢，启动时预热"""
     global _searcher
-    if _searcher is not None:
-        return _searcher
-    try:
-        mod = import_module("src.app.retriever")
-        _searcher = mod.HybridSearcher(index_dir=MINBIZ_INDEX_DIR)
-        print(f"[RAG] HybridSearcher ready, index_dir={MINBIZ_INDEX_DIR}")
-        return _searcher
-    except Exception as e:
-        print("[RAG] import HybridSearcher fail:", e)
-        _searcher = None
-        return None
+    if _searcher is None:
+        with _searcher_lock:             # 并发的首批请求只加载一次
+            if _searcher is None:
+                try:
+                    mod = import_module("src.app.retriever")
+                    _searcher = mod.HybridSearcher(index_dir=MINBIZ_INDEX_DIR)
+                    print(f"[RAG] HybridSearcher ready, index_dir={MINBIZ_INDEX_DIR}")
+                except Exception as e:
+                    print("[RAG] import HybridSearcher fail (RAG context disabled until restart):", e)
+                    _searcher = _NO_SEARCHER
+    return None if _searcher is _NO_SEARCHER else _searcher
 
 try:
     from src.app.rag import build_context_for_query_secure
@@ -172,28 +191,30 @@ def build_rag_context_and_refs(question: str, top_k: int = 6) -> Tuple[str, List
         except Exception as e:
             print("[RAG] build_context_for_query_secure error ->", e)
 
-    if not norm_hits:
+    # 按 token 预算打包：相邻切块重叠合并、近重复去除
+    packed = pack_context(norm_hits)
+    if not packed:
         return "", []
-    ctx_text = "【检索参考】\n" + "\n\n".join((h["text"] or "")[:500] for h in norm_hits)
+    ctx_text = "【检索参考】\n" + "\n\n".join(p["text"] for p in packed)
     rag_debug = [
         {
-            "score": h["score"],
-            "source": (h["meta"] or {}).get("source"),
-            "preview": (h["text"] or "")[:200],
-            "chunk_id": (h["meta"] or {}).get("chunk_id"),
-            "title": (h["meta"] or {}).get("section_title"),
-            "start_s": (h["meta"] or {}).get("start"),
-            "end_s": (h["meta"] or {}).get("end"),
+            "score": p["score"],
+            "source": (p["meta"] or {}).get("source"),
+            "preview": (p["text"] or "")[:200],
+            "chunk_id": (p["meta"] or {}).get("chunk_id"),
+            "title": (p["meta"] or {}).get("section_title"),
+            "start_s": (p["meta"] or {}).get("start"),
+            "end_s": (p["meta"] or {}).get("end"),
+            "tokens": p["tokens"],
         }
-        for h in norm_hits
+        for p in packed
     ]
     return ctx_text, rag_debug
 
 # ========== LLM / STT / TTS ==========
-def generate_answer(question: str, style: str, lang: str, bilingual: bool, rag_context: str) -> str:
-    """优先基于 RAG 上下文；超时/异常快速返回；可用 MINBIZ_FAKE_LLM 跳过 OpenAI。"""
+def _answer_prompt(question: str, lang: str, rag_context: str) -> Tuple[str, str]:
+    """(语言标签, prompt)；一次性生成与流式生成共用"""
     lang_tag = decide_lang_tag(question, lang)
-
     prompt = (
         "You are MinBiz, a startup consultant. Always ground your answer in the PROVIDED CONTEXT first. "
         "If something is not in the context, add it as short general tips. "
@@ -208,6 +229,11 @@ def generate_answer(question: str, style: str, lang: str, bilingual: bool, rag_c
         "2) 3 actionable steps (with mini examples)\n"
         "3) Risks & next move\n"
     )
+    return lang_tag, prompt
+
+async def generate_answer(question: str, style: str, lang: str, bilingual: bool, rag_context: str) -> str:
+    """优先基于 RAG 上下文；超时/异常快速返回；可用 MINBIZ_FAKE_LLM 跳过 OpenAI。"""
+    lang_tag, prompt = _answer_prompt(question, lang, rag_context)
 
     # 调试：不走 OpenAI，确认后端链路是否通畅
     if MINBIZ_FAKE_LLM:
@@ -216,12 +242,11 @@ def generate_answer(question: str, style: str, lang: str, bilingual: bool, rag_c
     t0 = time.time()
     try:
         # 单次请求再加一层更严格的超时（比如 28s）
-        oc = client.with_options(timeout=28)
-        with llm_sem:
-            oc = client.with_options(timeout=28)
-            completion = oc.chat.completions.create(
-                model=MINBIZ_OPENAI_MODEL,
-                messages=[...],
+        async with llm_sem:
+            completion = await achat_completion(
+                MINBIZ_OPENAI_MODEL,
+                timeout=_call_timeout(MINBIZ_OPENAI_MODEL),
+                messages=[{"role": "user", "content": prompt}],
                 temperature=0.3,
             )
         text = (completion.choices[0].message.content or "").strip()
@@ -231,55 +256,502 @@ def generate_answer(question: str, style: str, lang: str, bilingual: bool, rag_c
         log.error("[LLM] fail after %.2fs -> %s", time.time()-t0, e)
         return f"System is busy now (model timeout). Please try again later.\n\n(error: {e})"
 
-def transcribe_audio_to_text(file_bytes: bytes, suffix: str = "mp3") -> str:
-    """Whisper 识别：并发闸门 + 每次调用级超时；临时文件更稳。"""
+async def stream_answer(question: str, lang: str, rag_context: str, out: Dict[str, str] = None):
+    """流式生成：逐段 yield 文本增量；out["text"] 累积完整回答（调用方在流结束后读取）"""
+    out = {} if out is None else out
+    out["text"] = ""
+    lang_tag, prompt = _answer_prompt(question, lang, rag_context)
+    if MINBIZ_FAKE_LLM:
+        out["text"] = f"[FAKE_ANSWER in {lang_tag}] TL;DR … Step1 … Step2 … Step3 …"
+        yield out["text"]
+        return
     try:
-        with stt_sem:
-            # 简单清理后缀
-            suf = (suffix or "mp3").lower().strip(".")
-            tmp = Path(f"tmp_input.{suf}")
-            tmp.write_bytes(file_bytes)
+        async with llm_sem:
+            stream = await achat_completion(
+                MINBIZ_OPENAI_MODEL,
+                timeout=_call_timeout(MINBIZ_OPENAI_MODEL),
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.3,
+                stream=True,
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    out["text"] += delta
+                    yield delta
+    except Exception as e:
+        log.error("[LLM] stream fail -> %s", e)
+        if not out["text"]:
+            out["text"] = "System is busy now (model timeout). Please try again later."
+            yield out["text"]
+
+RAG_STAGE_TIMEOUT = float(os.getenv("MINBIZ_STAGE_TIMEOUT_RAG", "3"))
+GEN_STAGE_TIMEOUT = float(os.getenv("MINBIZ_VOICE_GEN_TIMEOUT", "30"))
 
-            with tmp.open("rb") as f:
-                # 每次调用再加一次较短超时，避免卡住整个服务
-                oc = client.with_options(timeout=28)
-                r = oc.audio.transcriptions.create(model=VOICE_STT_MODEL, file=f)
+async def _retrieve(question: str) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    检索放到线程池，超时/失败就用空上下文；返回 (rag_context, rag_debug, timing)
+    searcher 还没加载好（启动预热未完成）时先等加载，一次性的冷启动不计入 RAG_STAGE_TIMEOUT
+    """
+    loop = asyncio.get_running_loop()
+    t0 = time.perf_counter()
+    if _searcher is None:
+        with suppress(Exception):
+            await loop.run_in_executor(_rag_pool, get_searcher)
+    if _searcher is _NO_SEARCHER:         # 加载失败过：不再排进线程池
+        return "", [], {"ms": round((time.perf_counter() - t0) * 1000, 1), "status": "unavailable"}
+    try:
+        rag_context, rag_debug = await asyncio.wait_for(
+            loop.run_in_executor(_rag_pool, build_rag_context_and_refs, question, 6), RAG_STAGE_TIMEOUT)
+        status = "ok"
+    except asyncio.TimeoutError:
+        rag_context, rag_debug, status = "", [], "timeout"
+        print(f"[RAG] retrieve timeout after {RAG_STAGE_TIMEOUT}s, using empty context")
+    except Exception as e:
+        rag_context, rag_debug, status = "", [], "error"
+        print("[RAG] retrieve error ->", e)
+    if rag_debug is None or rag_debug is Ellipsis:
+        rag_debug = []   # <-- 防御式
+    return rag_context, rag_debug, {"ms": round((time.perf_counter() - t0) * 1000, 1), "status": status}
 
-            try:
-                tmp.unlink(missing_ok=True)
-            except Exception:
-                pass
+async def answer_with_rag(question: str, style: str, lang: str, bilingual: bool):
+    """
+    检索（线程池，超时/失败就用空上下文继续）-> LLM（AsyncOpenAI）；返回 (answer, rag_debug, timings)
+    timings 与阶段执行器格式一致：{"retrieve": {"ms", "status"}, "generate": {...}}
+    """
+    timings: Dict[str, Dict[str, Any]] = {}
+    rag_context, rag_debug, timings["retrieve"] = await _retrieve(question)
 
+    t0 = time.perf_counter()
+    try:
+        answer = await asyncio.wait_for(generate_answer(question, style, lang, bilingual, rag_context),
+                                        GEN_STAGE_TIMEOUT)
+        status = "ok"
+    except asyncio.TimeoutError:
+        answer, status = "System is busy now (model timeout). Please try again later.", "timeout"
+    timings["generate"] = {"ms": round((time.perf_counter() - t0) * 1000, 1), "status": status}
+    return answer, rag_debug, timings
+
+async def transcribe_audio_to_text(file_bytes: bytes, suffix: str = "mp3") -> str:
+    """Whisper 识别：并发闸门 + 每次调用级超时；音频以内存缓冲直接上传，不落临时文件（并发请求互不覆盖）。"""
+    try:
+        async with stt_sem:
+            # 简单清理后缀（上游靠文件名后缀判断格式）
+            suf = (suffix or "mp3").lower().strip(".")
+            # 每次尝试新建一个 BytesIO 视图（不复制数据），重试时不用管读指针
+            r = await awith_retry(lambda m: _aoc(m).audio.transcriptions.create(
+                model=m, file=(f"audio.{suf}", io.BytesIO(file_bytes))
+            ), VOICE_STT_MODEL)
             return getattr(r, "text", "") or ""
     except Exception as e:
         print("[STT] error ->", e)
         return ""
 
 
-def synthesize_tts_to_mp3_b64(text: str, voice: str | None = None, lang: str | None = None) -> str:
+# ========== 实时语音：PCM 片段转写 ==========
+# MINBIZ_STT_BACKEND=local 时用 faster-whisper 在本机转写（片段不上传，CPU 上 small/int8 足够跟上语速）；
+# 没装 / 加载失败时退回 OpenAI：PCM 在内存里包成 WAV 上传
+STT_BACKEND       = os.getenv("MINBIZ_STT_BACKEND", "openai").lower()
+LOCAL_STT_MODEL   = os.getenv("MINBIZ_LOCAL_STT_MODEL", "small")
+LOCAL_STT_DEVICE  = os.getenv("MINBIZ_LOCAL_STT_DEVICE", "auto")
+LOCAL_STT_COMPUTE = os.getenv("MINBIZ_LOCAL_STT_COMPUTE", "int8")
+
+# 可选：faster-whisper（本地转写）
+try:
+    from faster_whisper import WhisperModel
+except Exception:
+    WhisperModel = None
+    if STT_BACKEND == "local":
+        print("[STT] faster-whisper not installed, realtime STT falls back to OpenAI")
+
+_whisper = None
+_whisper_lock = threading.Lock()
+_stt_pool = ThreadPoolExecutor(max_workers=STT_MAX_CONCURRENCY, thread_name_prefix="voice-stt")
+
+def _local_whisper():
+    global _whisper
+    if _whisper is None:
+        with _whisper_lock:
+            if _whisper is None:
+                _whisper = WhisperModel(LOCAL_STT_MODEL, device=LOCAL_STT_DEVICE, compute_type=LOCAL_STT_COMPUTE)
+                print(f"[STT] faster-whisper ready: {LOCAL_STT_MODEL} ({LOCAL_STT_DEVICE}/{LOCAL_STT_COMPUTE})")
+    return _whisper
+
+def _transcribe_local(pcm: bytes, lang: str | None, prompt: str) -> str:
+    import numpy as np
+    audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+    segs, _ = _local_whisper().transcribe(audio, language=lang, beam_size=1,
+                                          initial_prompt=prompt or None, condition_on_previous_text=False)
+    return "".join(s.text for s in segs).strip()
+
+def pcm_to_wav(pcm: bytes) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(vad.SAMPLE_RATE)
+        w.writeframes(pcm)
+    return buf.getvalue()
+
+async def transcribe_pcm(pcm: bytes, lang: str | None = None, prompt: str = "") -> str:
+    """16 kHz PCM 片段 -> 文本；prompt 为本句前面已转写的部分（本地模型用来保持上下文连贯）"""
+    lang = lang if lang in ("zh", "en") else None
+    if STT_BACKEND == "local" and WhisperModel is not None:
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(_stt_pool, _transcribe_local, pcm, lang, prompt)
+        except Exception as e:
+            print("[STT] local whisper error, fallback to OpenAI ->", e)
+    return (await transcribe_audio_to_text(pcm_to_wav(pcm), "wav")).strip()
+
+def join_transcript(parts) -> str:
+    """拼接片段文本：两边都是西文时加空格，中文直接相连"""
+    out = ""
+    for p in parts:
+        p = (p or "").strip()
+        if not p:
+            continue
+        if out and not (re.match(r"[\u4e00-\u9fff]", out[-1]) or re.match(r"[\u4e00-\u9fff]", p[0])):
+            out += " "
+        out += p
+    return out
+
+
+TTS_CHUNK = 16 * 1024   # 向客户端转发音频的块大小
+
+# ========== TTS 音频缓存 ==========
+# 同一段文本（缓存 / FAQ 回答、UI 重播）不再重复合成：key = sha256(model|voice|format|text)，
+# 音频存成文件 <dir>/<key[:2]>/<key>.mp3，进程内 LRU 索引按总字节数淘汰；命中直接读文件，不占 tts_sem、不花 TTS 费用。
+# 索引在启动时扫一次目录建好；异步路径里的文件读写 / 淘汰都走 atts_cache_get / atts_cache_put（线程池），不卡事件循环。
+# /tts-say 带 ETag（= key）+ Cache-Control，客户端 If-None-Match 命中时返回 304。
+#   MINBIZ_TTS_CACHE          1=启用（默认），0=关闭
+#   MINBIZ_TTS_CACHE_DIR      缓存目录（默认 data/tts_cache）
+#   MINBIZ_TTS_CACHE_MB       总大小上限（默认 256）
+#   MINBIZ_TTS_CACHE_MAX_AGE  Cache-Control max-age 秒数（默认 86400）
+TTS_CACHE         = os.getenv("MINBIZ_TTS_CACHE", "1") == "1"
+TTS_CACHE_DIR     = os.getenv("MINBIZ_TTS_CACHE_DIR") or str(Path(DATA_DIR) / "tts_cache")
+TTS_CACHE_BYTES   = int(float(os.getenv("MINBIZ_TTS_CACHE_MB", "256")) * (1 << 20))
+TTS_CACHE_MAX_AGE = int(os.getenv("MINBIZ_TTS_CACHE_MAX_AGE", "86400"))
+
+_tts_index: "OrderedDict[str, int] | None" = None   # key -> 字节数，最近使用的在末尾
+_tts_bytes = 0
+_tts_lock = threading.Lock()
+_tts_hits = _tts_misses = 0
+
+def tts_cache_key(text: str, voice: str, model: str, fmt: str = "mp3") -> str:
+    return hashlib.sha256(f"{model}|{voice}|{fmt}|{text.strip()}".encode("utf-8")).hexdigest()
+
+def _tts_file(key: str) -> Path:
+    return Path(TTS_CACHE_DIR) / key[:2] / f"{key}.mp3"
+
+def _tts_load_index():
+    """扫一遍目录重建索引（按 mtime 排序；命中时会 touch，重启后仍近似 LRU）；调用方持有 _tts_lock"""
+    global _tts_index, _tts_bytes
+    files = []
+    for f in Path(TTS_CACHE_DIR).glob("??/*.mp3"):
+        with suppress(OSError):
+            st = f.stat()
+            files.append((st.st_mtime, f.stem, st.st_size))
+    _tts_index = OrderedDict((k, n) for _, k, n in sorted(files))
+    _tts_bytes = sum(_tts_index.values())
+
+def _tts_forget(key: str):
+    global _tts_bytes
+    _tts_bytes -= _tts_index.pop(key, 0)
+
+def tts_cache_get(key: str) -> bytes | None:
+    global _tts_hits, _tts_misses
+    if not TTS_CACHE:
+        return None
+    with _tts_lock:
+        if _tts_index is None:
+            _tts_load_index()
+        hit = key in _tts_index
+        if hit:
+            _tts_index.move_to_end(key)
+    data = None
+    if hit:
+        f = _tts_file(key)
+        try:
+            data = f.read_bytes()
+            os.utime(f)
+        except OSError:                      # 文件被外部删掉：当作未命中
+            with _tts_lock:
+                _tts_forget(key)
+    with _tts_lock:
+        if data:
+            _tts_hits += 1
+        else:
+            _tts_misses += 1
+    return data or None
+
+def tts_cache_put(key: str, data: bytes):
+    """写临时文件再 rename（读端不会读到半个文件），然后按 LRU 淘汰到上限以内"""
+    global _tts_bytes
+    if not TTS_CACHE or not data or len(data) > TTS_CACHE_BYTES // 8:
+        return
+    f = _tts_file(key)
+    try:
+        f.parent.mkdir(parents=True, exist_ok=True)
+        tmp = f.with_name(f"{f.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, f)
+    except OSError as e:
+        print("[TTS] cache write error ->", e)
+        return
+    evict = []
+    with _tts_lock:
+        if _tts_index is None:
+            _tts_load_index()
+        _tts_forget(key)
+        _tts_index[key] = len(data)
+        _tts_bytes += len(data)
+        while _tts_bytes > TTS_CACHE_BYTES and len(_tts_index) > 1:
+            old = next(iter(_tts_index))
+            _tts_forget(old)
+            evict.append(old)
+    for old in evict:
+        with suppress(OSError):
+            _tts_file(old).unlink()
+
+def tts_cache_warm():
+    """启动时建索引（之后的读写不再扫目录）"""
+    if TTS_CACHE:
+        with _tts_lock:
+            if _tts_index is None:
+                _tts_load_index()
+
+async def atts_cache_get(key: str) -> bytes | None:
+    return await asyncio.to_thread(tts_cache_get, key)
+
+async def atts_cache_put(key: str, data: bytes):
+    await asyncio.to_thread(tts_cache_put, key, data)
+
+def tts_cache_stats() -> Dict[str, Any]:
+    with _tts_lock:
+        return {"enabled": TTS_CACHE, "entries": len(_tts_index or ()), "bytes": _tts_bytes,
+                "max_bytes": TTS_CACHE_BYTES, "hits": _tts_hits, "misses": _tts_misses}
+
+async def _bytes_chunks(data: bytes):
+    for i in range(0, len(data), TTS_CHUNK):
+        yield data[i:i + TTS_CHUNK]
+
+async def _tts_chunks(text: str, voice: str, model: str):
+    """
+    流式取 mp3 字节。只有读上游这一段占 tts_sem：单独的任务把上游读完放进队列，这里从队列转发给客户端，
+    客户端慢 / 卡住时上游照样读完、闸门照常释放，没发出去的部分留在内存里。
+    生成器关闭（客户端断开）时停止读取，连接和闸门一并释放。
+    """
+    q: "asyncio.Queue" = asyncio.Queue()                 # 音频块；None = 读完，Exception = 上游出错
+
+    async def _pump():
+        try:
+            async with tts_sem:
+                async with _aoc(model).audio.speech.with_streaming_response.create(
+                    model=model,
+                    voice=voice,
+                    input=text,
+                    response_format="mp3",
+                ) as resp:
+                    async for chunk in resp.iter_bytes(TTS_CHUNK):
+                        q.put_nowait(chunk)
+            q.put_nowait(None)
+        except Exception as e:
+            q.put_nowait(e)
+
+    pump = asyncio.create_task(_pump())
+    try:
+        while True:
+            item = await q.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        pump.cancel()
+
+async def open_tts_stream(text: str, voice: str | None = None, lang: str | None = None, check_cache: bool = True):
     """
-    返回 base64 编码的 mp3。并发闸门 + 每次调用级超时。
+    开始合成并拿到第一块音频后返回异步字节迭代器；失败 / 关闭 TTS 时返回 None（调用方退回文本响应）。
+    只对「拿到第一块之前」重试；之后的字节直接从上游转发给客户端，不做 base64。
+    先查 TTS 缓存，命中直接返回文件内容；未命中时边转发边攒下完整音频，正常结束后写入缓存。
     VOICE_TTS_MODEL 支持 gpt-4o-mini-tts / tts-1 / tts-1-hd 等；voice 默认为 'alloy'。
     """
-    if DISABLE_TTS:
-        return ""
+    if DISABLE_TTS or not (text or "").strip():
+        return None
+    key = tts_cache_key(text, voice or "alloy", VOICE_TTS_MODEL or "tts-1")
+    cached = await atts_cache_get(key) if check_cache else None
+    if cached:
+        return _bytes_chunks(cached)
+
+    async def _open(m):
+        g = _tts_chunks(text, voice or "alloy", m)
+        try:
+            return g, await g.__anext__()
+        except BaseException:
+            await g.aclose()
+            raise
+
+    try:
+        g, first = await awith_retry(_open, VOICE_TTS_MODEL or "tts-1")
+    except Exception as e:
+        print("[TTS] error ->", e)
+        return None
+
+    async def _chain():
+        buf, done = [first], False
+        try:
+            yield first
+            async for chunk in g:
+                buf.append(chunk)
+                yield chunk
+            done = True
+        except Exception as e:
+            print("[TTS] stream error ->", e)   # 已经开始发送，只能截断
+        finally:
+            await g.aclose()
+            if done:                             # 截断 / 客户端中途断开的不缓存；写文件放线程池，不等它
+                asyncio.get_running_loop().run_in_executor(None, tts_cache_put, key, b"".join(buf))
+    return _chain()
+
+def _debug_headers(rag_debug: List[Dict[str, Any]], timings: Dict[str, Any]) -> Dict[str, str]:
+    """音频响应没有 JSON body，debug 信息以 JSON（ASCII 转义）放在响应头"""
+    return {"X-MinBiz-RAG-Debug": json.dumps(rag_debug or []),
+            "X-MinBiz-Timings": json.dumps(timings or {})}
+
+def _audio_response(stream, headers: Dict[str, str] = None) -> StreamingResponse:
+    return StreamingResponse(stream, media_type="audio/mpeg",
+                             headers={"Content-Disposition": 'inline; filename="answer.mp3"', **(headers or {})})
+
+async def synthesize_tts_bytes(text: str, voice: str | None = None) -> bytes:
+    """整段合成为 mp3 字节（句级流水线用，先查 TTS 缓存，闸门是 tts_pipe_sem）；失败返回 b\"\""""
+    if DISABLE_TTS or not (text or "").strip():
+        return b""
+    key = tts_cache_key(text, voice or "alloy", VOICE_TTS_MODEL or "tts-1")
+    cached = await atts_cache_get(key)
+    if cached:
+        return cached
     try:
-        with tts_sem:
-            model = VOICE_TTS_MODEL or "tts-1"
-            v = voice or "alloy"
-
-            oc = client.with_options(timeout=28)  # 每次调用再指定更短超时
-            audio = oc.audio.speech.create(
-                model=model,
-                voice=v,
+        async with tts_pipe_sem:
+            audio = await awith_retry(lambda m: _aoc(m).audio.speech.create(
+                model=m,
+                voice=voice or "alloy",
                 input=text,
                 response_format="mp3",
-            )
-            data = audio.read() if hasattr(audio, "read") else audio
-            return base64.b64encode(data).decode("utf-8")
+            ), VOICE_TTS_MODEL or "tts-1")
+        data = getattr(audio, "content", audio)
+        await atts_cache_put(key, data)
+        return data
     except Exception as e:
-        print("[TTS] error ->", e)
-        return ""
+        print("[TTS] segment error ->", e)
+        return b""
+
+
+# ========== 句级流水线 TTS ==========
+# LLM 边生成边按句切分，每句并发合成（每个请求最多 TTS_PIPELINE_PARALLEL 句在途，
+# 全进程最多 TTS_PIPELINE_MAX_CONCURRENCY 句在合成；与整段合成的 tts_sem 分开计数，
+# 否则默认 TTS_MAX_CONCURRENCY=1 时流水线退化成逐句串行），
+# 按句子顺序把 mp3 片段接成一条流发给客户端（MP3 按帧解码，片段直接拼接即可连续播放）。
+# 首包时间 ≈ 检索 + 第一句生成 + 第一句合成，而不是整段回答 + 整段合成。
+TTS_PIPELINE          = os.getenv("MINBIZ_TTS_PIPELINE", "1") == "1"
+TTS_PIPELINE_PARALLEL = int(os.getenv("MINBIZ_TTS_PIPELINE_PARALLEL", "3"))
+TTS_PIPELINE_MAX_CONCURRENCY = int(os.getenv("MINBIZ_TTS_PIPELINE_MAX_CONCURRENCY", "6"))
+tts_pipe_sem = asyncio.Semaphore(TTS_PIPELINE_MAX_CONCURRENCY)
+TTS_SEG_MIN           = int(os.getenv("MINBIZ_TTS_SEG_MIN", "8"))     # 太短的句子并到下一句（减少请求数）
+TTS_SEG_MAX           = int(os.getenv("MINBIZ_TTS_SEG_MAX", "160"))   # 迟迟没有句末标点时在逗号处强制切
+
+_SENT_END = re.compile(r"[。！？!?；;…\n]+[”’\"')）】」』]*|\.(?=\s)")
+_SOFT_CUT = re.compile(r"[，,、：:]")
+
+def cut_sentences(buf: str, final: bool = False) -> Tuple[List[str], str]:
+    """
+    从缓冲区切出完整句子：中文 。！？；… / 英文 .!?; 后跟空白 / 换行为句末。
+    返回 (句子列表, 剩余未完成部分)；final=True 时剩余部分也作为最后一句输出。
+    """
+    segs: List[str] = []
+    start = 0
+    for m in _SENT_END.finditer(buf):
+        seg = buf[start:m.end()].strip()
+        if len(seg) >= TTS_SEG_MIN:
+            segs.append(seg)
+            start = m.end()
+    rest = buf[start:]
+    while len(rest) > TTS_SEG_MAX:                       # 超长无句末：在最后一个逗号处切，没有就硬切
+        cut = max((m.end() for m in _SOFT_CUT.finditer(rest, 0, TTS_SEG_MAX)), default=TTS_SEG_MAX)
+        segs.append(rest[:cut].strip())
+        rest = rest[cut:]
+    if final and rest.strip():
+        segs.append(rest.strip())
+        rest = ""
+    return [x for x in segs if x], rest
+
+async def pipelined_tts(deltas, voice: str | None = None):
+    """deltas：异步文本增量；按句切分、并发合成、按顺序 yield mp3 字节"""
+    sem = asyncio.Semaphore(TTS_PIPELINE_PARALLEL)
+    order: "asyncio.Queue" = asyncio.Queue()            # 按句子顺序放合成任务，None 表示结束
+
+    async def _synth(seg: str) -> bytes:
+        async with sem:
+            return await synthesize_tts_bytes(seg, voice)
+
+    async def _produce():
+        buf = ""
+        try:
+            async for d in deltas:
+                buf += d
+                segs, buf = cut_sentences(buf)
+                for seg in segs:
+                    order.put_nowait(asyncio.create_task(_synth(seg)))
+            for seg in cut_sentences(buf, final=True)[0]:
+                order.put_nowait(asyncio.create_task(_synth(seg)))
+        except Exception as e:
+            print("[TTS] pipeline text error ->", e)
+        finally:
+            order.put_nowait(None)
+
+    producer = asyncio.create_task(_produce())
+    try:
+        while True:
+            task = await order.get()
+            if task is None:
+                break
+            data = await task
+            if data:
+                yield data
+    finally:                                             # 客户端断开：停掉生成和未完成的合成
+        producer.cancel()
+        while not order.empty():
+            t = order.get_nowait()
+            if t is not None:
+                t.cancel()
+
+async def _pipelined_voice(question: str, lang: str, voice: str = "alloy", debug: bool = False):
+    """
+    检索 -> 流式 LLM -> 句级 TTS。返回 (StreamingResponse 或 None, 回答文本, rag_debug, timings)：
+    拿到第一段音频后给出 StreamingResponse（debug 时 rag_debug / timings 放在响应头里，此时回答还在生成，
+    timings 只有 retrieve 和 first_audio）；一段音频都没合成出来时为 None，调用方退回文本响应。
+    """
+    timings: Dict[str, Dict[str, Any]] = {}
+    rag_context, rag_debug, timings["retrieve"] = await _retrieve(question)
+    out: Dict[str, str] = {}
+    t0 = time.perf_counter()
+    audio = pipelined_tts(stream_answer(question, lang, rag_context, out), voice=voice)
+    try:
+        first = await audio.__anext__()
+    except StopAsyncIteration:
+        timings["generate"] = {"ms": round((time.perf_counter() - t0) * 1000, 1), "status": "ok"}
+        return None, out.get("text", ""), rag_debug, timings
+    timings["first_audio"] = {"ms": round((time.perf_counter() - t0) * 1000, 1), "status": "ok"}
+
+    async def _chain():
+        yield first
+        async for chunk in audio:
+            yield chunk
+    headers = _debug_headers(rag_debug, timings) if debug else None
+    return _audio_response(_chain(), headers), out.get("text", ""), rag_debug, timings
 
 
 def guess_lang(text: str) -> str:
@@ -331,6 +803,9 @@ def health():
         "tts": VOICE_TTS_MODEL,
         "stt": VOICE_STT_MODEL,
         "index_dir": str(Path(MINBIZ_INDEX_DIR).resolve()),
+        "llm": llm_stats(),   # 请求 / 错误分类 / 重试 / 熔断 / 降级计数
+        "tts_cache": tts_cache_stats(),
+        "memory": memory.memory_stats(),   # 写回队列积压 / 写失败待重写 / 已丢弃行数
     }
 
 # 统一业务端点：总是返回 evidence；语言在 brain.answer 内部 auto 处理
@@ -345,6 +820,33 @@ def ask_business(req: BizReq, x_api_key: str = Header(None)):
         import traceback; traceback.print_exc()
         return {"ok": False, "error": str(e)}
 
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# 流式业务端点（Server-Sent Events）：先发 evidence，再逐段发 token，最后发 done（完整文本 + 各阶段耗时）
+# 出错时发 error 事件后结束。生成器是同步的，Starlette 会放到线程池里迭代，不阻塞事件循环。
+@app.post("/ask-business-v1/stream")
+def ask_business_stream(req: BizReq, x_api_key: str = Header(None)):
+    if x_api_key != MINBIZ_API_KEY:
+        return JSONResponse({"error": "Invalid API key"}, status_code=401)
+
+    def _events():
+        try:
+            for event, data in biz_answer_stream(session=req.session, query=req.query, db_path=FTS_DB):
+                if event == "evidence" and not req.debug:
+                    data = {"evidence": [], "timings": {}}
+                if event == "done" and not req.debug:
+                    data = {"text": data["text"]}
+                yield _sse(event, data)
+        except Exception as e:
+            traceback.print_exc()
+            yield _sse("error", {"error": str(e)})
+
+    return StreamingResponse(
+        _events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},  # 关掉反向代理缓冲
+    )
+
 # 兼容旧文本端点（仍可用）
 @app.post("/ask-text-v2")
 async def ask_text_v2(
@@ -360,25 +862,30 @@ async def ask_text_v2(
         return JSONResponse({"error": "Invalid API key"}, status_code=401)
 
     try:
-        rag_ctx, rag_debug = build_rag_context_and_refs(q, top_k=6)
-        if rag_debug is None or rag_debug is Ellipsis:
-            rag_debug = []   # <-- 防御式
-        answer = generate_answer(q, style, lang, bilingual, rag_ctx)
+        if do_tts and TTS_PIPELINE and not DISABLE_TTS:
+            resp, answer, rag_debug, timings = await _pipelined_voice(q, lang, debug=debug)
+            if resp is not None:
+                return resp
+            out: Dict[str, Any] = {"answer": answer, "warn": "TTS unavailable; returned text.",
+                                   "rag_debug": rag_debug if debug else []}
+            if debug:
+                out["timings"] = timings
+            return out
+
+        answer, rag_debug, timings = await answer_with_rag(q, style, lang, bilingual)
 
         if not do_tts:
             resp: Dict[str, Any] = {"answer": answer, "rag_debug": rag_debug if debug else []}
+            if debug:
+                resp["timings"] = timings
             return resp
 
         lg = guess_lang(answer)
         voice = "alloy"  # 如用 Azure，可改为 zh-CN-XiaoxiaoNeural / en-US-JennyNeural
-        tts_b64 = synthesize_tts_to_mp3_b64(answer, voice=voice, lang=lg)
-        if not tts_b64:
+        stream = await open_tts_stream(answer, voice=voice, lang=lg)
+        if stream is None:
             return {"answer": answer, "warn": "TTS unavailable; returned text."}
-
-        out_path = "answer.mp3"
-        with open(out_path, "wb") as f:
-            f.write(base64.b64decode(tts_b64))
-        return FileResponse(out_path, media_type="audio/mpeg", filename="answer.mp3")
+        return _audio_response(stream, _debug_headers(rag_debug, timings) if debug else None)
 
     except Exception as e:
         traceback.print_exc()
@@ -404,27 +911,34 @@ async def ask_voice_v2(
         if audio.filename and "." in audio.filename:
             suf = audio.filename.rsplit(".", 1)[-1].lower() or "wav"
 
-        text = transcribe_audio_to_text(data, suffix=suf)
+        text = await transcribe_audio_to_text(data, suffix=suf)
         if not text:
             return JSONResponse({"error": "STT failed"}, status_code=400)
 
-        rag_ctx, rag_debug = build_rag_context_and_refs(text, top_k=6)
-        answer = generate_answer(text, style, lang, bilingual, rag_ctx)
+        if do_tts and TTS_PIPELINE and not DISABLE_TTS:
+            resp, answer, rag_debug, timings = await _pipelined_voice(text, lang, debug=debug)
+            if resp is not None:
+                return resp
+            out: Dict[str, Any] = {"question": text, "answer": answer, "warn": "TTS unavailable; returned text.",
+                                   "rag_debug": rag_debug if debug else []}
+            if debug:
+                out["timings"] = timings
+            return out
+
+        answer, rag_debug, timings = await answer_with_rag(text, style, lang, bilingual)
 
         if not do_tts:
             resp: Dict[str, Any] = {"question": text, "answer": answer, "rag_debug": rag_debug if debug else []}
+            if debug:
+                resp["timings"] = timings
             return resp
 
         lg = guess_lang(answer)
         voice = "alloy"
-        tts_b64 = synthesize_tts_to_mp3_b64(answer, voice=voice, lang=lg)
-        if not tts_b64:
+        stream = await open_tts_stream(answer, voice=voice, lang=lg)
+        if stream is None:
             return {"question": text, "answer": answer, "warn": "TTS unavailable; returned text."}
-
-        out_path = "answer.mp3"
-        with open(out_path, "wb") as f:
-            f.write(base64.b64decode(tts_b64))
-        return FileResponse(out_path, media_type="audio/mpeg", filename="answer.mp3")
+        return _audio_response(stream, _debug_headers(rag_debug, timings) if debug else None)
 
     except Exception as e:
         traceback.print_exc()
@@ -437,10 +951,11 @@ async def stt_openai(file: UploadFile = File(...), x_api_key: str = Header(None)
         return JSONResponse({"error":"Invalid API key"}, status_code=401)
     try:
         audio_bytes = await file.read()
-        res = client.audio.transcriptions.create(
-            model=VOICE_STT_MODEL,
-            file=("audio.wav", io.BytesIO(audio_bytes))
-        )
+        async with stt_sem:
+            res = await awith_retry(lambda m: _aoc(m).audio.transcriptions.create(
+                model=m,
+                file=("audio.wav", io.BytesIO(audio_bytes))
+            ), VOICE_STT_MODEL)
         text = res.text.strip()
         return {"ok": True, "text": text}
     except Exception as e:
@@ -448,27 +963,162 @@ async def stt_openai(file: UploadFile = File(...), x_api_key: str = Header(None)
         return JSONResponse({"error": str(e)}, status_code=500)
 
 # 文本转语音（自动根据文本语言选择 voice）
+# ETag 由 (文本, voice, 模型, 格式) 决定：客户端重播时带 If-None-Match 即可拿到 304，不再传音频
 @app.post("/tts-say")
-async def tts_say(req: TTSReq, x_api_key: str = Header(None)):
+async def tts_say(req: TTSReq, x_api_key: str = Header(None), if_none_match: str = Header(None)):
     if x_api_key != MINBIZ_API_KEY:
         return JSONResponse({"error": "Invalid API key"}, status_code=401)
     try:
         lang = guess_lang(req.text)
         voice = "alloy"  # 如接入 Azure，这里改为 zh-CN-XiaoxiaoNeural / en-US-JennyNeural
-        b64 = synthesize_tts_to_mp3_b64(req.text, voice=voice, lang=lang)
-        if not b64:
+        etag = '"%s"' % tts_cache_key(req.text, voice, VOICE_TTS_MODEL or "tts-1")
+        headers = {"ETag": etag, "Cache-Control": f"private, max-age={TTS_CACHE_MAX_AGE}"}
+        if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        cached = await atts_cache_get(etag.strip('"'))
+        if cached:
+            return Response(cached, media_type="audio/mpeg", headers=headers)
+        stream = await open_tts_stream(req.text, voice=voice, lang=lang, check_cache=False)
+        if stream is None:
             return JSONResponse({"error": "TTS unavailable"}, status_code=500)
-        audio_bytes = base64.b64decode(b64)
-        return Response(content=audio_bytes, media_type="audio/mpeg")
+        return StreamingResponse(stream, media_type="audio/mpeg", headers=headers)
     except Exception as e:
         traceback.print_exc()
         return JSONResponse({"error": str(e)}, status_code=500)
 
-# 启动时确保索引
-@app.on_event("startup")
-async def _ensure_rag():
+# 实时语音（WebSocket /ws/voice?key=...）：客户端边说边推 16 kHz / 16-bit / 单声道 PCM（二进制帧）。
+# 服务端 VAD 切片段，片段一闭合就转写；一句话结束（静音 MINBIZ_VAD_END_MS）时只剩最后一段要转写，随即检索 + 流式回答，
+# 说话到回答的延迟不再包含整段上传和整段转写。
+# 上行文本帧（JSON）：{"type":"config","lang":"auto","tts":false,"voice":"alloy","barge_in":true}
+#                     {"type":"end"}（按键结束，不等静音） / {"type":"reset"}（丢弃当前这句）
+# 下行 JSON：speech_start / partial{index,text} / final{text,stt_ms} / token{text} / answer{question,text,timings} / error{error}
+# tts=true 时回答音频（句级流水线 mp3）以二进制帧下发；barge_in=true 时用户再次开口会打断还没说完的回答
+@app.websocket("/ws/voice")
+async def ws_voice(ws: WebSocket):
+    if (ws.query_params.get("key") or ws.headers.get("x-api-key")) != MINBIZ_API_KEY:
+        await ws.close(code=1008)
+        return
+    await ws.accept()
+
+    cfg: Dict[str, Any] = {"lang": "auto", "tts": False, "voice": "alloy", "barge_in": True}
+    seg = vad.UtteranceSegmenter()
+    parts: List[asyncio.Task] = []       # 本句各片段的转写任务
+    texts: List[str] = []                # 本句已转写完的片段文本（按片段序号）
+    answering: asyncio.Task | None = None
+    send_lock = asyncio.Lock()
+
+    async def _send(obj: Dict[str, Any] = None, audio: bytes = b""):
+        async with send_lock:
+            if audio:
+                await ws.send_bytes(audio)
+            else:
+                await ws.send_text(json.dumps(obj, ensure_ascii=False))
+
+    async def _stt_part(pcm: bytes, idx: int, texts: List[str]) -> str:
+        text = await transcribe_pcm(pcm, cfg["lang"], prompt=join_transcript(texts[:idx]))
+        texts[idx] = text
+        if text:
+            await _send({"type": "partial", "index": idx, "text": text})
+        return text
+
+    async def _finish(tasks: List[asyncio.Task], t_end: float):
+        try:
+            q = join_transcript(await asyncio.gather(*tasks))
+            timings: Dict[str, Any] = {"stt": {"ms": round((time.perf_counter() - t_end) * 1000, 1)}}
+            await _send({"type": "final", "text": q, "stt_ms": timings["stt"]["ms"]})
+            if not q:
+                return
+            rag_context, _, timings["retrieve"] = await _retrieve(q)
+
+            out: Dict[str, str] = {}
+            t0 = time.perf_counter()
+            first: Dict[str, float] = {}
+
+            async def _tokens():
+                async for d in stream_answer(q, cfg["lang"], rag_context, out):
+                    first.setdefault("ms", round((time.perf_counter() - t_end) * 1000, 1))
+                    await _send({"type": "token", "text": d})
+                    yield d
+
+            if cfg["tts"] and not DISABLE_TTS:
+                async for chunk in pipelined_tts(_tokens(), voice=cfg["voice"]):
+                    await _send(audio=chunk)
+            else:
+                async for _ in _tokens():
+                    pass
+            timings["generate"] = {"ms": round((time.perf_counter() - t0) * 1000, 1), "status": "ok"}
+            timings["speech_end_to_first_token_ms"] = first.get("ms")
+            await _send({"type": "answer", "question": q, "text": out.get("text", ""), "timings": timings})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            traceback.print_exc()
+            with suppress(Exception):
+                await _send({"type": "error", "error": str(e)})
+
+    def _drop(tasks):
+        for t in tasks:
+            if t is not None and not t.done():
+                t.cancel()
+
+    try:
+        while True:
+            msg = await ws.receive()
+            if msg.get("type") == "websocket.disconnect":
+                break
+            if msg.get("bytes"):
+                events = seg.feed(msg["bytes"])
+            elif msg.get("text"):
+                try:
+                    ctl = json.loads(msg["text"])
+                except ValueError:
+                    continue
+                kind = ctl.get("type")
+                if kind == "config":
+                    cfg.update({k: ctl[k] for k in cfg if k in ctl})
+                    continue
+                if kind == "reset":
+                    _drop(parts)
+                    seg, parts, texts = vad.UtteranceSegmenter(), [], []
+                    continue
+                if kind != "end":
+                    continue
+                events = seg.flush()
+            else:
+                continue
+
+            for ev, pcm in events:
+                if ev == "start":
+                    if cfg["barge_in"]:
+                        _drop([answering])
+                    await _send({"type": "speech_start"})
+                elif ev == "segment":
+                    texts.append("")
+                    parts.append(asyncio.create_task(_stt_part(pcm, len(texts) - 1, texts)))
+                elif ev == "end":
+                    answering = asyncio.create_task(_finish(parts, time.perf_counter()))
+                    parts, texts = [], []
+    except WebSocketDisconnect:
+        pass
+    finally:
+        _drop(parts + [answering])
+
+# 启动时确保索引：增量重建放到后台线程，不阻塞服务启动
+def _rag_build_bg():
     try:
-        if not Path(FTS_DB).exists():
-            rag_build(DATA_DIR)
+        rag_build(DATA_DIR)
     except Exception as e:
         print("RAG index build error:", e)
+
+@app.on_event("startup")
+async def _ensure_rag():
+    threading.Thread(target=_rag_build_bg, name="rag-build", daemon=True).start()
+    archive.start_archiver()
+    asyncio.get_running_loop().run_in_executor(_rag_pool, get_searcher)   # 预热检索器，不阻塞启动
+    await asyncio.to_thread(tts_cache_warm)
+
+
+# 关闭时把对话写回队列刷到磁盘（atexit 也会兜底）
+@app.on_event("shutdown")
+async def _flush_memory():
+    memory.shutdown()
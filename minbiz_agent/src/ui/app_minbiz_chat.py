@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 # src/ui/app_minbiz_chat.py — Minimal Chat UI (English default) + RAG + STT + TTS
 import os
+import json
 import uuid
 import requests
 import streamlit as st
@@ -37,6 +38,22 @@ def post_json_with_retry(url, *, json=None, data=None, files=None, headers=None,
     raise last
 
 
+def iter_sse(resp):
+    """逐条解析 SSE 响应，yield (event, data_dict)"""
+    event, data = "message", []
+    for line in resp.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+
 # ---------- Page ----------
 def render_minbiz_ui():
     st.title("Startup Companion")
@@ -135,48 +152,58 @@ def render_minbiz_ui():
         with st.chat_message("user"):
             st.markdown(q)
 
-        # 2) 调用 /ask-business-v1
-        try:
-            payload = {
-                "session": st.session_state.session_id,
-                "query": q,
-                "debug": bool(st.session_state.get("show_ev", False)),  # ⬅ 关键
-            }
-            url_rag = API_BASE.rstrip("/") + "/ask-business-v1"
-            r = requests.post(url_rag, json=payload, headers=headers, timeout=180)
-            j = r.json()
-            ans_text = j["data"].get("text", "")
-            evs     = j["data"].get("evidence", [])
-        except Exception as e:
-            ans_text = f"❌ Request failed: {e}"
-            evs = []
-
-        # 3)（可选）TTS：把文字转语音
-        audio_data = None
-        if st.session_state.get("tts_enabled", False) and ans_text:
+        # 2) 调用 /ask-business-v1/stream（SSE）：边生成边渲染，首个 token 到达即可见
+        with st.chat_message("assistant"):
+            placeholder = st.empty()
             try:
-                url_tts = API_BASE.rstrip("/") + "/tts-say"
-                jr = requests.post(url_tts, json={"text": ans_text}, headers=headers, timeout=180)
-                if jr.headers.get("content-type", "").startswith("audio/"):
-                    audio_data = jr.content
-            except Exception:
-                # 不阻塞主流程，语音失败就忽略
-                pass
-
-        # 4) 保存与展示助手消息
-        msg = {"role": "assistant", "content": ans_text, "evidence": evs}
-        if audio_data:
-            msg["audio"] = audio_data
-        st.session_state.messages.append(msg)
+                payload = {
+                    "session": st.session_state.session_id,
+                    "query": q,
+                    "debug": bool(st.session_state.get("show_ev", False)),  # ⬅ 关键
+                }
+                url_rag = API_BASE.rstrip("/") + "/ask-business-v1/stream"
+                ans_text, evs = "", []
+                with requests.post(url_rag, json=payload, headers=headers, timeout=180, stream=True) as r:
+                    r.raise_for_status()
+                    for event, data in iter_sse(r):
+                        if event == "evidence":
+                            evs = data.get("evidence", [])
+                        elif event == "token":
+                            ans_text += data.get("t", "")
+                            placeholder.markdown(ans_text + "▌")
+                        elif event == "done":
+                            ans_text = data.get("text", ans_text)
+                        elif event == "error":
+                            raise RuntimeError(data.get("error"))
+            except Exception as e:
+                ans_text = f"❌ Request failed: {e}"
+                evs = []
+            placeholder.markdown(ans_text)
+
+            # 3)（可选）TTS：把文字转语音
+            audio_data = None
+            if st.session_state.get("tts_enabled", False) and ans_text:
+                try:
+                    url_tts = API_BASE.rstrip("/") + "/tts-say"
+                    jr = requests.post(url_tts, json={"text": ans_text}, headers=headers, timeout=180)
+                    if jr.headers.get("content-type", "").startswith("audio/"):
+                        audio_data = jr.content
+                except Exception:
+                    # 不阻塞主流程，语音失败就忽略
+                    pass
 
-        with st.chat_message("assistant"):
-            st.markdown(ans_text)
             if st.session_state.get("show_ev") and evs:
                 with st.expander("RAG evidence", expanded=False):
                     st.json(evs)
             if audio_data:
                 st.audio(audio_data, format="audio/mp3")
 
+        # 4) 保存助手消息
+        msg = {"role": "assistant", "content": ans_text, "evidence": evs}
+        if audio_data:
+            msg["audio"] = audio_data
+        st.session_state.messages.append(msg)
+
     # ---------- Footer actions ----------
     c1, c2, c3, c4 = st.columns([1, 1, 1, 1])
     with c1:
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""测试从 minbiz_agent/ 根目录导入 src.*（与 uvicorn src.server.voice_agent:app 的运行方式一致）"""
+import sys
+from pathlib import Path
+
+ROOT = str(Path(__file__).resolve().parents[1])
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
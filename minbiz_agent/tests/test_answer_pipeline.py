@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.orchestrator import answer_pipeline as ap
+from src.orchestrator.answer_pipeline import Stage, run_stages
+
+
+def test_dependencies_receive_upstream_results():
+    res, tim = run_stages([
+        Stage("a", lambda: 1),
+        Stage("b", lambda: 2),
+        Stage("c", lambda a, b: a + b, deps=("a", "b")),
+    ])
+    assert res == {"a": 1, "b": 2, "c": 3}
+    assert all(t["status"] == "ok" for t in tim.values())
+
+
+def test_independent_stages_run_concurrently():
+    t0 = time.perf_counter()
+    run_stages([Stage(n, lambda: time.sleep(0.2)) for n in "abc"])
+    assert time.perf_counter() - t0 < 0.5
+
+
+def test_timeout_uses_fallback_and_downstream_continues():
+    res, tim = run_stages([
+        Stage("slow", lambda: time.sleep(1) or "late", timeout=0.1, fallback=list),
+        Stage("next", lambda slow: ("got", slow), deps=("slow",)),
+    ])
+    assert res["slow"] == [] and tim["slow"]["status"] == "timeout"
+    assert res["next"] == ("got", [])
+
+
+def test_error_uses_fallback():
+    res, tim = run_stages([Stage("boom", lambda: 1 / 0, fallback="fb")])
+    assert res["boom"] == "fb"
+    assert tim["boom"]["status"] == "error" and "ZeroDivisionError" in tim["boom"]["error"]
+
+
+def test_deadline_starts_when_stage_starts_running(monkeypatch):
+    monkeypatch.setattr(ap, "_pool", ThreadPoolExecutor(max_workers=1))
+    res, tim = run_stages([
+        Stage("first", lambda: time.sleep(0.3) or 1, timeout=1),
+        Stage("queued", lambda: 2, timeout=0.1),         # 排队 0.3s，但自身执行很快
+    ])
+    assert res == {"first": 1, "queued": 2}
+    assert tim["queued"]["status"] == "ok"
+
+
+def test_llm_stages_do_not_starve_short_stages(monkeypatch):
+    monkeypatch.setattr(ap, "_pool", ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(ap, "_llm_pool", ThreadPoolExecutor(max_workers=1))
+    gate = threading.Event()
+    busy = ap._llm_pool.submit(gate.wait, 2)               # LLM 池被占满 0.3s
+    threading.Timer(0.3, gate.set).start()
+    try:
+        res, tim = run_stages([
+            Stage("facts", lambda: {"k": "v"}, timeout=0.2),
+            Stage("gen", lambda facts: facts["k"], deps=("facts",), llm=True, timeout=5),
+        ])
+    finally:
+        gate.set()
+        busy.result()
+    assert tim["facts"]["status"] == "ok" and res["gen"] == "v"
+
+
+def test_unknown_dependency_and_cycle_are_rejected():
+    with pytest.raises(ValueError, match="unknown stage"):
+        run_stages([Stage("a", lambda x: x, deps=("x",))])
+    with pytest.raises(ValueError, match="cycle"):
+        run_stages([Stage("a", lambda b: b, deps=("b",)), Stage("b", lambda a: a, deps=("a",))])
+
+
+def test_background_runs_off_path_and_survives_shutdown(monkeypatch):
+    done = []
+    ap.background(done.append, 1).result(timeout=2)
+    assert done == [1]
+
+    dead = ThreadPoolExecutor(max_workers=1)
+    dead.shutdown()
+    monkeypatch.setattr(ap, "_bg_pool", dead)
+    monkeypatch.setattr(ap, "_slow_bg_pool", dead)
+    ap.background(done.append, 2)                        # 线程池已关闭：就地执行
+    ap.background_slow(done.append, 3)                   # 慢任务直接丢弃
+    assert done == [1, 2]
+    ap.background(lambda: 1 / 0)                         # 异常只打日志
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from src.rag.context_packer import count_tokens, merge_neighbours, pack_context, truncate_tokens
+
+
+def hit(text, score, source="s", cid=None, **kw):
+    return {"text": text, "score": score, "meta": {"source": source, "chunk_id": cid}, **kw}
+
+
+def test_negative_scores_keep_ranking():
+    hits = [hit("第一段：客户细分怎么做", -1.0, cid=1), hit("第二段：现金流预测方法", -4.0, source="t", cid=2)]
+    out = pack_context(hits, mmr_lambda=1.0)
+    assert [p["meta"]["chunk_id"] for p in out] == [1, 2]
+
+
+def test_overlapping_neighbours_merge_on_full_text_even_with_snippets():
+    a = "甲" * 30 + "乙" * 40
+    b = "乙" * 40 + "丙" * 30
+    out = merge_neighbours([hit(a, 2.0, cid=1, snippet="甲甲"), hit(b, 1.0, cid=2, snippet="丙丙"),
+                            hit("别的", 1.5, source="t", cid=3, snippet="别")])
+    assert out[0]["merged"] == [1, 2] and out[0]["text"] == "甲" * 30 + "乙" * 40 + "丙" * 30
+    assert out[1]["text"] == "别"                          # 未合并的仍用 snippet
+
+
+def test_near_duplicates_dropped_and_budget_respected():
+    text = "定价策略：先做价值锚定，再做分层套餐。"
+    hits = [hit(text, 3.0, source="a", cid=1), hit(text + "!", 2.0, source="b", cid=2),
+            hit("融资节奏与估值" * 20, 1.0, source="c", cid=3)]
+    out = pack_context(hits, budget_tokens=60)
+    ids = [p["meta"]["chunk_id"] for p in out]
+    assert 2 not in ids and sum(p["tokens"] for p in out) <= 60
+
+
+def test_first_passage_is_truncated_to_fit():
+    out = pack_context([hit("很长的段落" * 100, 1.0)], budget_tokens=20)
+    assert len(out) == 1 and out[0]["tokens"] <= 20
+    assert count_tokens(truncate_tokens("abc" * 50, 5)) <= 5
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from src.app import llm_client as lc
+
+
+class APIError(Exception):
+    def __init__(self, status_code=None, headers=None, code=None):
+        super().__init__(f"status {status_code}")
+        self.status_code, self.code = status_code, code
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+
+
+class APITimeoutError(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(lc, "_breakers", {})
+    monkeypatch.setattr(lc, "_stats", {})
+    monkeypatch.setattr(lc, "_budget", lc._RetryBudget(1.0, min_per_s=0.0, cap=100.0))
+    monkeypatch.setattr(lc, "LLM_RETRIES", 3)
+    monkeypatch.setattr(lc, "LLM_BACKOFF_BASE", 0.0)
+    monkeypatch.setattr(lc, "LLM_CB_FAILURES", 5)
+    monkeypatch.setattr(lc, "LLM_FALLBACK", {})
+    monkeypatch.setattr(lc.time, "sleep", lambda s: None)
+
+
+def flaky(errors, result="ok"):
+    """依次抛出 errors 里的异常，之后返回 result；记录每次调用的模型"""
+    calls = []
+
+    def call(model):
+        calls.append(model)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return call, calls
+
+
+def test_classify_error():
+    assert lc.classify_error(APIError(429)) == "rate_limit"
+    assert lc.classify_error(APIError(429, code="insufficient_quota")) == "fatal"
+    assert lc.classify_error(APIError(503)) == "server"
+    assert lc.classify_error(APIError(400)) == "fatal"
+    assert lc.classify_error(APITimeoutError()) == "timeout"
+    assert lc.classify_error(ConnectionError()) == "network"
+    assert lc.classify_error(ValueError()) == "fatal"
+
+
+def test_retry_after_headers():
+    assert lc._retry_after(APIError(429, {"retry-after-ms": "1500"})) == 1.5
+    assert lc._retry_after(APIError(429, {"retry-after": "2"})) == 2.0
+    assert lc._retry_after(APIError(429)) is None
+
+
+def test_retryable_errors_are_retried():
+    call, calls = flaky([APIError(503), APIError(429)])
+    assert lc.with_retry(call, "m") == "ok"
+    assert len(calls) == 3 and lc.llm_stats()["retries"] == 2
+
+
+def test_fatal_errors_are_not_retried():
+    call, calls = flaky([APIError(400)])
+    with pytest.raises(APIError):
+        lc.with_retry(call, "m")
+    assert len(calls) == 1
+
+
+def test_retries_are_bounded():
+    call, calls = flaky([APIError(503)] * 10)
+    with pytest.raises(APIError):
+        lc.with_retry(call, "m")
+    assert len(calls) == lc.LLM_RETRIES + 1
+
+
+def test_retry_budget_exhaustion_stops_retries(monkeypatch):
+    monkeypatch.setattr(lc, "_budget", lc._RetryBudget(0.0, min_per_s=0.0, cap=0.0))
+    call, calls = flaky([APIError(503)] * 3)
+    with pytest.raises(APIError):
+        lc.with_retry(call, "m")
+    assert len(calls) == 1 and lc.llm_stats()["budget_exhausted"] == 1
+
+
+def test_breaker_opens_then_half_opens(monkeypatch):
+    monkeypatch.setattr(lc, "LLM_RETRIES", 0)
+    monkeypatch.setattr(lc, "LLM_CB_FAILURES", 2)
+    for _ in range(2):
+        with pytest.raises(APIError):
+            lc.with_retry(flaky([APIError(503)])[0], "m")
+    call, calls = flaky([])
+    with pytest.raises(lc.CircuitOpenError):
+        lc.with_retry(call, "m")
+    assert calls == []
+
+    lc._breakers["m"].opened_at -= lc.LLM_CB_OPEN_S + 1       # 冷却期已过：放一个探测请求
+    assert lc.with_retry(call, "m") == "ok"
+    assert lc.llm_stats()["breakers"]["m"] == "closed"
+
+
+def test_breaker_state_machine():
+    b = lc._Breaker(failures=2, open_s=0.0)
+    assert b.allow() and not b.failure() and b.failure()
+    assert b.state == "open"
+    assert b.allow() and b.state == "half_open"
+    assert not b.allow()                                      # 同时只放一个探测
+    b.failure()
+    assert b.state == "open"
+    b.allow()
+    b.success()
+    assert b.state == "closed" and b.fails == 0
+
+
+def test_fallback_model_after_retries(monkeypatch):
+    monkeypatch.setattr(lc, "LLM_RETRIES", 1)
+    monkeypatch.setattr(lc, "LLM_FALLBACK", {"big": "small"})
+    call, calls = flaky([APIError(503), APIError(503)])
+    assert lc.with_retry(call, "big") == "ok"
+    assert calls == ["big", "big", "small"]
+
+
+def _completion(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def test_response_cache_is_opt_in_and_follows_mode(tmp_path, monkeypatch):
+    monkeypatch.setattr(lc, "LLM_CACHE_DB", str(tmp_path / "llm_cache.db"))
+    monkeypatch.setattr(lc, "_cache_local", type(lc._cache_local)())
+    sent = []
+
+    def fake_completion(model, messages, temperature, **kw):
+        sent.append(model)
+        return _completion(json.dumps({"n": len(sent)}))
+    monkeypatch.setattr(lc, "chat_completion", fake_completion)
+    msgs = [{"role": "user", "content": "hi"}]
+
+    monkeypatch.setattr(lc, "LLM_CACHE", "on")
+    assert lc.chat_json(msgs, model="m") == {"n": 1}
+    assert lc.chat_json(msgs, model="m") == {"n": 2}          # 默认不走缓存（重试 / 重生成拿到新结果）
+    assert lc.chat_json(msgs, model="m", cache=True) == {"n": 3}
+    assert lc.chat_json(msgs, model="m", cache=True) == {"n": 3}     # 命中缓存
+    assert lc.chat_json(msgs, model="m", temperature=0.9, cache=True) == {"n": 4}   # 参数不同是另一个 key
+
+    monkeypatch.setattr(lc, "LLM_CACHE", "record")
+    assert lc.chat_json(msgs, model="m", cache=True) == {"n": 5}
+    monkeypatch.setattr(lc, "LLM_CACHE", "replay")
+    assert lc.chat_json(msgs, model="m", cache=True) == {"n": 5}
+    with pytest.raises(lc.LLMCacheMiss):
+        lc.chat_json([{"role": "user", "content": "new"}], model="m", cache=True)
+    assert len(sent) == 5
+
+
+def test_run_many_reports_partial_failures_in_order():
+    out = lc.run_many([lambda: 1, lambda: 1 / 0, lambda: 3])
+    assert [r["ok"] for r in out] == [True, False, True]
+    assert out[0]["value"] == 1 and out[2]["value"] == 3
+    assert "ZeroDivisionError" in out[1]["error"]
+
+
+def test_run_many_marks_slow_calls_as_deadline():
+    gate = threading.Event()
+    out = lc.run_many([lambda: gate.wait(5) and "late", lambda: "fast"], timeouts=[0.05, None])
+    gate.set()
+    assert out[0]["kind"] == "deadline" and out[1]["value"] == "fast"
+
+
+def test_chat_many_forwards_per_request_options(monkeypatch):
+    seen = []
+
+    def fake_completion(model, messages, temperature, **kw):
+        seen.append((messages[0]["content"], temperature))
+        return _completion(json.dumps({"q": messages[0]["content"]}))
+    monkeypatch.setattr(lc, "chat_completion", fake_completion)
+    out = lc.chat_many([
+        {"messages": [{"role": "user", "content": "a"}], "json": True, "temperature": 0.2},
+        {"messages": [{"role": "user", "content": "b"}], "json": True, "temperature": 0.5},
+    ])
+    assert [r["value"] for r in out] == [{"q": "a"}, {"q": "b"}]
+    assert sorted(seen) == [("a", 0.2), ("b", 0.5)]
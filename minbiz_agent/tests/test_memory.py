@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from src.agent import memory
+
+
+@pytest.fixture
+def mem(tmp_path, monkeypatch):
+    monkeypatch.setattr(memory, "DB_PATH", str(tmp_path / "minbiz.db"))
+    with memory._l1_lock:
+        memory._l1.clear()
+        memory._l1_by_session.clear()
+    yield memory
+    memory.flush()
+    memory.close_connections()
+
+
+def test_turns_are_readable_before_and_after_flush(mem):
+    for i in range(3):
+        mem.add_turn("s1", "user", f"q{i}")
+    assert mem.last_k_turns("s1", 2) == [("user", "q1"), ("user", "q2")]   # read-your-writes
+    assert mem.flush()
+    assert mem.last_k_turns("s1", 10) == [("user", "q0"), ("user", "q1"), ("user", "q2")]
+    assert mem.last_k_turns("s1", 10, pending=False) == mem.last_k_turns("s1", 10)
+    assert mem.last_k_turns("other", 10) == []
+
+
+def test_synchronous_mode_writes_immediately(mem, monkeypatch):
+    monkeypatch.setattr(mem, "MEM_WRITE_BEHIND", False)
+    mem.add_turn("s1", "user", "hi")
+    assert mem.last_k_turns("s1", 5, pending=False) == [("user", "hi")]
+
+
+def test_latest_fact_wins(mem):
+    mem.save_fact("s1", "stage", "idea")
+    mem.save_fact("s1", "stage", "mvp")
+    mem.save_fact("s1", "city", "Toronto")
+    assert mem.load_facts("s1") == {"stage": "mvp", "city": "Toronto"}
+    mem.flush()
+    assert mem.load_facts("s1", pending=False) == {"stage": "mvp", "city": "Toronto"}
+
+
+def test_failed_batch_is_kept_for_next_flush_and_counted(mem, monkeypatch):
+    monkeypatch.setattr(mem, "MEM_WRITE_BEHIND", False)
+    monkeypatch.setattr(mem.time, "sleep", lambda s: None)
+    real_tx, fails = mem._tx, [0]
+
+    def flaky_tx(con):
+        if fails[0] > 0:
+            fails[0] -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return real_tx(con)
+
+    monkeypatch.setattr(mem, "_tx", flaky_tx)
+    before = mem.memory_stats()
+
+    fails[0] = 3                                    # 三次都失败：留到下一批
+    mem.add_turn("s1", "user", "a")
+    st = mem.memory_stats()
+    assert st["carried"] == 1 and st["flush_errors"] == before["flush_errors"] + 1
+    assert mem.last_k_turns("s1", 5) == [("user", "a")]             # 读端仍可见
+    assert mem.last_k_turns("s1", 5, pending=False) == []
+
+    mem.add_turn("s1", "user", "b")                 # 下一批连同留存的行一起写入
+    assert mem.last_k_turns("s1", 5, pending=False) == [("user", "a"), ("user", "b")]
+    assert mem.memory_stats()["carried"] == 0
+
+    monkeypatch.setattr(mem, "MEM_CARRY_MAX", 1)
+    fails[0] = 6
+    mem.add_turn("s1", "user", "c")
+    mem.add_turn("s1", "user", "d")                 # 超出留存上限：最早的 c 被丢弃并计数
+    st = mem.memory_stats()
+    assert st["carried"] == 1 and st["dropped"] == before["dropped"] + 1
+    mem.add_turn("s1", "user", "e")
+    assert [c for _, c in mem.last_k_turns("s1", 10, pending=False)] == ["a", "b", "d", "e"]
+
+
+def test_answer_cache_keys_on_session_and_generation(mem):
+    mem.cache_set("s1", "How to price?", {"text": "a"}, generation=1)
+    assert mem.cache_get("s1", "how to price", generation=1) == {"text": "a"}   # 归一化问句
+    assert mem.cache_get("s1", "How to price?", generation=2) is None
+    assert mem.cache_get("s2", "How to price?", generation=1) is None
+
+
+def test_answer_cache_l2_survives_l1_eviction_and_respects_ttl(mem):
+    mem.cache_set("s1", "q", {"text": "a"})
+    with mem._l1_lock:
+        mem._l1.clear()
+    assert mem.cache_get("s1", "q") == {"text": "a"}
+    with sqlite3.connect(mem.DB_PATH) as con:
+        con.execute("UPDATE cache SET ts = ts - 7200")
+    with mem._l1_lock:
+        mem._l1.clear()
+    assert mem.cache_get("s1", "q", ttl_sec=3600) is None
+
+
+def test_save_fact_invalidates_session_cache(mem):
+    mem.cache_set("s1", "q", {"text": "a"})
+    mem.cache_set("s2", "q", {"text": "b"})
+    mem.save_fact("s1", "stage", "mvp")
+    assert mem.cache_get("s1", "q") is None
+    assert mem.cache_get("s2", "q") == {"text": "b"}
+
+
+def test_cache_sweep_caps_rows(mem):
+    for i in range(10):
+        mem.cache_set("s1", f"q{i}", {"text": str(i)})
+    assert mem.cache_sweep(expire=False, max_rows=4) == 6
+    with sqlite3.connect(mem.DB_PATH) as con:
+        assert con.execute("SELECT COUNT(*) FROM cache").fetchone()[0] == 4
+
+
+def test_compaction_folds_old_turns_into_summary(mem):
+    for i in range(8):
+        mem.add_turn("s1", "user" if i % 2 == 0 else "assistant", f"t{i}")
+    mem.flush()
+    seen = []
+
+    def summarize(prev, turns):
+        seen.append((prev, turns))
+        return "summary of " + ",".join(c for _, c in turns)
+
+    assert mem.compact_session("s1", summarize, keep=2, every=4)
+    assert seen[0][0] == "" and len(seen[0][1]) == 6
+    summary, turns = mem.history_for_prompt("s1")
+    assert summary == "summary of t0,t1,t2,t3,t4,t5"
+    assert [c for _, c in turns] == ["t6", "t7"]
+    assert not mem.compact_session("s1", summarize, keep=2, every=4)   # 未覆盖的轮次还不够
+
+
+def test_sharding_routes_sessions_to_separate_files(mem, monkeypatch):
+    monkeypatch.setattr(mem, "MEM_SHARDS", 4)
+    paths = mem.shard_paths()
+    assert [Path(p).name for p in paths] == [f"minbiz.s{i:02d}.db" for i in range(4)]
+    sessions = [f"user-{i}" for i in range(20)]
+    assert all(mem.shard_of(s) == mem.shard_of(s, 4) for s in sessions)
+    assert len({mem.shard_of(s) for s in sessions}) > 1
+    for s in sessions:
+        mem.add_turn(s, "user", s)
+    assert mem.flush()
+    for s in sessions:
+        assert mem.last_k_turns(s, 5, pending=False) == [("user", s)]
+        with sqlite3.connect(paths[mem.shard_of(s)]) as con:
+            assert con.execute("SELECT COUNT(*) FROM turns WHERE session=?", (s,)).fetchone()[0] == 1
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import json
+import sqlite3
+import threading
+
+from src.rag import sqlite_fts as fts
+
+
+def _write(data_dir, name, content):
+    d = data_dir / "paragraphs"
+    d.mkdir(parents=True, exist_ok=True)
+    (d / name).write_text(content, encoding="utf-8")
+
+
+def _meta(db):
+    with sqlite3.connect(db) as con:
+        return dict(con.execute("SELECT k, v FROM fts_meta").fetchall())
+
+
+def _tables(db):
+    with sqlite3.connect(db) as con:
+        return {n for (n,) in con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+
+def test_segment_roundtrip_and_compile_match():
+    s = "创业定位 pricing 策略"
+    assert fts.unsegment(fts.segment_cjk(s)) == s
+    expr = fts.compile_match("什么是创业定位？Pricing")
+    assert '"创 业"' in expr and '"定 位"' in expr and '"pricing"*' in expr
+    assert '"什 么"' not in expr                    # 高频虚词组合被过滤
+    assert fts.compile_match("的") == '"的"'        # 只有单字时退而用单字
+    assert fts.compile_match("？！") == ""
+
+
+def test_full_build_and_search(tmp_path):
+    _write(tmp_path, "a.txt", "# 定位\n创业定位要先找到细分客户")
+    _write(tmp_path, "b.jsonl", json.dumps({"text": "定价策略 pricing strategy", "cid": "b1"}, ensure_ascii=False))
+    db = fts.build_index(str(tmp_path), incremental=False)
+
+    hits = fts.search(db, "创业定位", top_k=3)
+    assert hits and hits[0]["meta"]["chunk_id"] == "a"
+    assert hits[0]["text"].startswith("# 定位")      # 读出时已去掉分隔符
+    assert [h["meta"]["chunk_id"] for h in fts.search(db, "pricing")] == ["b1"]
+
+
+def test_incremental_build_only_touches_changed_rows(tmp_path):
+    _write(tmp_path, "a.txt", "创业定位")
+    _write(tmp_path, "b.txt", "融资路演")
+    db = fts.build_index(str(tmp_path), incremental=False)
+    gen = fts.index_generation(db)
+
+    fts.build_index(str(tmp_path))                  # 没有变化：代号不变
+    assert fts.index_generation(db) == gen
+
+    _write(tmp_path, "b.txt", "现金流管理")
+    (tmp_path / "paragraphs" / "a.txt").unlink()
+    fts.build_index(str(tmp_path))
+    assert fts.index_generation(db) == gen + 1
+    assert fts.search(db, "创业定位") == []
+    assert fts.search(db, "融资路演") == []
+    assert [h["meta"]["chunk_id"] for h in fts.search(db, "现金流")] == ["b"]
+
+
+def test_full_rebuild_swaps_generation_and_keeps_previous(tmp_path):
+    _write(tmp_path, "a.txt", "创业定位")
+    db = fts.build_index(str(tmp_path), incremental=False)
+    for _ in range(2):
+        fts.build_index(str(tmp_path), incremental=False)
+    meta = _meta(db)
+    assert (meta["active"], meta["previous"], meta["generation"]) == ("3", "2", "3")
+    gens = {t for t in _tables(db) if fts._GEN_PTN.match(t)}
+    assert gens == {"paragraphs_g3", "paragraphs_g2"}     # 更早的代已清理
+    assert fts.search(db, "创业定位")
+
+
+def test_upgrade_legacy_paragraphs_table_in_place(tmp_path):
+    db = tmp_path / "rag_fts5.db"
+    with sqlite3.connect(db) as con:
+        con.execute("CREATE VIRTUAL TABLE paragraphs USING fts5(text, source, section_title, chunk_id)")
+        con.execute("INSERT INTO paragraphs VALUES(?,?,?,?)", ("老库里的创业定位内容", "old.txt", "", "old#1"))
+    fts.build_index(str(tmp_path))
+    assert _meta(str(db))["layout"] == fts.LAYOUT
+    assert "paragraphs" not in _tables(str(db))
+    assert [h["meta"]["chunk_id"] for h in fts.search(str(db), "创业定位")] == ["old#1"]
+
+
+def test_concurrent_full_builds_are_serialised(tmp_path):
+    for i in range(5):
+        _write(tmp_path, f"f{i}.txt", "\n".join(f"创业定位第{i}篇第{j}行" for j in range(200)))
+    errors = []
+
+    def run():
+        try:
+            fts.build_index(str(tmp_path), incremental=False)
+        except Exception as e:                      # pragma: no cover - 失败时才有
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    db = str(tmp_path / "rag_fts5.db")
+    assert errors == []
+    meta = _meta(db)
+    assert meta["generation"] == "3" and "build_lock" not in meta
+    assert len(fts.search(db, "创业定位", top_k=10)) == 5
+
+
+def test_stale_build_lock_is_taken_over(tmp_path, monkeypatch):
+    _write(tmp_path, "a.txt", "创业定位")
+    db = tmp_path / "rag_fts5.db"
+    with sqlite3.connect(db) as con:
+        con.execute("CREATE TABLE fts_meta(k TEXT PRIMARY KEY, v TEXT)")
+        con.execute("INSERT INTO fts_meta VALUES('build_lock', '999:1 0')")   # 崩溃进程留下的锁
+    monkeypatch.setattr(fts, "BUILD_LOCK_STALE", 60)
+    fts.build_index(str(tmp_path))
+    assert "build_lock" not in _meta(str(db))
+
+
+def test_snippet_and_highlight_are_opt_in(tmp_path):
+    _write(tmp_path, "a.txt", "# 定位\n创业定位要先找到细分客户，再决定渠道和定价")
+    db = fts.build_index(str(tmp_path), incremental=False)
+
+    plain = fts.search(db, "细分客户")[0]
+    assert "snippet" not in plain and "highlight" not in plain
+
+    hit = fts.search(db, "细分客户", snippet_tokens=8, highlight=True)[0]
+    assert hit["snippet"] and "<mark>" not in hit["snippet"]
+    assert "<mark>" in hit["highlight"]
+    assert hit["text"].startswith("# 定位")             # 正文始终是整段
+
+
+def test_result_cache_follows_index_generation(tmp_path):
+    _write(tmp_path, "a.txt", "创业定位")
+    db = fts.build_index(str(tmp_path), incremental=False)
+    assert [h["meta"]["chunk_id"] for h in fts.search(db, "创业定位")] == ["a"]
+
+    _write(tmp_path, "a.txt", "现金流管理")
+    fts.build_index(str(tmp_path))
+    assert fts.search(db, "创业定位") == []          # 换代后旧结果不再命中
+
+
+def test_retry_after_dropped_generation_caches_under_new_generation(tmp_path):
+    _write(tmp_path, "a.txt", "创业定位")
+    db = fts.build_index(str(tmp_path), incremental=False)
+    r = fts.get_reader(db)
+    for _ in range(2):                              # g1 被清理，当前为 g3
+        fts.build_index(str(tmp_path), incremental=False)
+    # 模拟读端已按旧代解析完、恰好碰上连续两次切换
+    r.state["active"] = ("paragraphs_g1", 1)
+    r.state["data_version"] = r.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    assert fts.search(db, "创业定位")
+    key = (fts.compile_match("创业定位"), 6, None, None, 0, False)
+    assert fts.RESULT_CACHE.get(f"fts:{db}", key, (r.ident, 3)) is not None
+    assert fts.RESULT_CACHE.get(f"fts:{db}", key, (r.ident, 1)) is None
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from array import array
+
+import pytest
+
+from src.server import vad
+
+FRAME_SAMPLES = vad.FRAME_BYTES // 2
+
+
+def _frames(n: int, amp: int) -> bytes:
+    return array("h", [amp, -amp] * (FRAME_SAMPLES // 2)).tobytes() * n
+
+
+def speech(ms):
+    return _frames(ms // vad.FRAME_MS, 3000)
+
+
+def silence(ms):
+    return _frames(ms // vad.FRAME_MS, 0)
+
+
+@pytest.fixture(autouse=True)
+def energy_vad(monkeypatch):
+    monkeypatch.setattr(vad, "webrtcvad", None)      # 固定用能量 VAD，结果不依赖是否装了 webrtcvad
+    monkeypatch.setattr(vad, "VAD_PAUSE_MS", 300)
+    monkeypatch.setattr(vad, "VAD_END_MS", 700)
+    monkeypatch.setattr(vad, "VAD_MAX_SEG_MS", 8000)
+
+
+def kinds(events):
+    return [k for k, _ in events]
+
+
+def test_silence_only_emits_nothing():
+    assert vad.UtteranceSegmenter().feed(silence(3000)) == []
+
+
+def test_short_click_is_not_speech():
+    seg = vad.UtteranceSegmenter()
+    assert seg.feed(silence(300) + speech(60) + silence(900)) == []
+
+
+def test_pause_cuts_segment_and_long_silence_ends_utterance():
+    seg = vad.UtteranceSegmenter()
+    ev = seg.feed(silence(300) + speech(600) + silence(360) + speech(600) + silence(900))
+    assert kinds(ev) == ["start", "segment", "segment", "end"]
+    first = ev[1][1]
+    assert len(first) >= len(speech(600))           # 含 preroll + 开口帧
+
+
+def test_pause_not_multiple_of_frame_still_cuts(monkeypatch):
+    monkeypatch.setattr(vad, "VAD_PAUSE_MS", 100)    # 不是 30 ms 的整数倍
+    seg = vad.UtteranceSegmenter()
+    ev = seg.feed(speech(600) + silence(150) + speech(600))
+    assert kinds(ev) == ["start", "segment"]         # 不必等到整句结束
+    assert kinds(seg.feed(silence(900))) == ["segment", "end"]
+
+
+def test_each_pause_cuts_once():
+    seg = vad.UtteranceSegmenter()
+    ev = seg.feed(speech(600) + silence(600))
+    assert kinds(ev) == ["start", "segment"]
+
+
+def test_max_segment_length_forces_cut(monkeypatch):
+    monkeypatch.setattr(vad, "VAD_MAX_SEG_MS", 900)
+    ev = vad.UtteranceSegmenter().feed(speech(3000))
+    assert kinds(ev)[0] == "start" and kinds(ev).count("segment") >= 3
+
+
+def test_partial_frames_are_buffered_across_feeds():
+    seg = vad.UtteranceSegmenter()
+    data = speech(600) + silence(900)
+    ev = []
+    for i in range(0, len(data), 1000):              # 不按帧对齐地喂
+        ev += seg.feed(data[i:i + 1000])
+    assert kinds(ev) == ["start", "segment", "end"]
+
+
+def test_flush_emits_tail_and_end():
+    seg = vad.UtteranceSegmenter()
+    assert kinds(seg.feed(speech(600))) == ["start"]
+    assert kinds(seg.flush()) == ["segment", "end"]
+    assert seg.flush() == []
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+# 把超过保留期的对话轮次移到冷归档段文件（可放 cron）
+# 用法：python tools/archive_turns.py [天数]   （默认 MINBIZ_ARCHIVE_AGE_DAYS，30 天）
+import sys
+from src.agent import archive, memory
+
+days = float(sys.argv[1]) if len(sys.argv) > 1 else None
+memory.flush()
+print("Archiving turns older than", archive.ARCHIVE_AGE_DAYS if days is None else days, "days ->", archive.archive_dir())
+print("moved:", archive.archive_old_turns(days), "| archive:", archive.archive_stats())
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
+# 用法：python tools/build_rag_index.py [--full]   （默认增量，只重建变化的行）
+import sys
 from pathlib import Path
 from src.rag.sqlite_fts import build_index
 DATA_DIR = Path(__file__).resolve().parents[1] / "data"
 print("Building RAG index on", DATA_DIR)
-print(build_index(str(DATA_DIR)))
\ No newline at end of file
+print(build_index(str(DATA_DIR), incremental="--full" not in sys.argv[1:]))
@@ -1,5 +1,5 @@
 # tools/eval_run.py
-import argparse, shutil, pathlib, subprocess, sys, yaml
+import argparse, os, shutil, pathlib, subprocess, sys, yaml
 
 def cp_glob(src_glob: str, dst_dir: str) -> int:
     dst = pathlib.Path(dst_dir); dst.mkdir(parents=True, exist_ok=True)
@@ -53,5 +53,9 @@ if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("--mode", default="hybrid", choices=["bm25","faiss","hybrid"])
     ap.add_argument("--case", default="A", choices=["A","B"])
+    # LLM 响应缓存（src/app/llm_client.py）：on=读写 record=重新录制 replay=只用缓存离线重放
+    ap.add_argument("--llm-cache", default=None, choices=["off","on","record","replay"])
     args = ap.parse_args()
+    if args.llm_cache:
+        os.environ["MINBIZ_LLM_CACHE"] = args.llm_cache   # 子进程继承
     run_case(args.mode, args.case)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# 把单库会话记忆（MINBIZ_DB）按 session 哈希拆成 N 个分片库
+# 用法：python tools/shard_memory_db.py N [--force]
+#   先停服务（或确认写队列已刷完）；拆完后设置 MINBIZ_MEM_SHARDS=N 再启动
+#   原库保持不动，回滚只需去掉 MINBIZ_MEM_SHARDS；冷归档段文件（archive.py）不用动，索引随会话一起迁走
+import sqlite3, sys
+from pathlib import Path
+from src.agent import memory
+
+_TABLES = {
+    "facts":         "id, session, key, value, ts",
+    "turns":         "id, session, role, content, ts",
+    "cache":         "k, session, gen, v, ts, atime",
+    "summaries":     "session, from_id, to_id, summary, ts",
+    "archive_index": "session, segment, offset, length, from_id, to_id, n, ts_max",
+}
+BATCH = 5000
+
+
+def main(argv):
+    args = [a for a in argv if not a.startswith("--")]
+    if len(args) != 1 or not args[0].isdigit() or int(args[0]) < 2:
+        print("usage: python tools/shard_memory_db.py N [--force]   (N >= 2)")
+        return 2
+    n = int(args[0])
+    src = memory.DB_PATH
+    if not Path(src).exists():
+        print("[SHARD] source db not found:", src)
+        return 1
+    dsts = memory.shard_paths(n)
+    busy = [p for p in dsts if Path(p).exists()]
+    if busy and "--force" not in argv:
+        print("[SHARD] shard files already exist (use --force to overwrite):", *busy, sep="\n  ")
+        return 1
+    for p in busy:
+        for suffix in ("", "-wal", "-shm"):
+            Path(p + suffix).unlink(missing_ok=True)
+
+    memory._open(src).close()                  # 源库先迁移到当前 schema
+    s = sqlite3.connect(src)
+    outs = [memory._open(p) for p in dsts]     # 建表 + 迁移
+    for con in outs:
+        con.execute("BEGIN")
+    counts = [0] * n
+    for table, cols in _TABLES.items():
+        names = [c.strip() for c in cols.split(",")]
+        marks = ",".join("?" * len(names))
+        si = names.index("session")
+        cur = s.execute(f"SELECT {cols} FROM {table}")
+        while True:
+            rows = cur.fetchmany(BATCH)
+            if not rows:
+                break
+            parts = [[] for _ in range(n)]
+            for r in rows:
+                parts[memory.shard_of(r[si] or "", n)].append(r)
+            for i, part in enumerate(parts):
+                if part:
+                    # 保留原 id：摘要里的 from_id / to_id 指向 turns.id
+                    outs[i].executemany(f"INSERT OR REPLACE INTO {table}({cols}) VALUES({marks})", part)
+                    counts[i] += len(part)
+    for con in outs:
+        con.execute("COMMIT")
+        con.close()
+    s.close()
+    for p, c in zip(dsts, counts):
+        print(f"[SHARD] {p}: {c} rows")
+    print(f"[SHARD] done. set MINBIZ_MEM_SHARDS={n} to use the shards")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))